@@ -0,0 +1,292 @@
+import os
+import json
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+ALLOCATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "allocations")
+
+# borsapy asset_name -> the label TEFAS shows on its own allocation pages
+TEFAS_ORIGINAL_NAMES = {
+    "Yabancı Yatırım Fonu": "Yatırım Fonları Katılma Payları",
+    "BPP": "Borsa İstanbul Para Piyasası",
+    "Ters Repo Para Piyasası": "Takasbank Para Piyasası",
+    "Varlık İpotek Tahvil": "Vadeli İşlemler Nakit Teminatları",
+    "Borsa Yatırım Fonu": "Borsa Yatırım Fonları Katılma Payları",
+    "Vadesiz Mevduat Türk Lirası": "Mevduat (TL)",
+    "Vadeli Mevduat": "Mevduat (TL)",
+    "Hisse Senedi": "Hisse Senedi",
+    "Ters Repo": "Ters Repo",
+    "Devlet Tahvili": "Devlet Tahvili",
+    "Girişim Sermayesi Yatırım Katılma Belgesi": "Girişim Sermayesi Yatırım Fonu",
+    "Gayrimenkul Yatırım Katılma Belgesi": "Gayrimenkul Yatırım Fonu",
+    "Kamu Dış Borçlanma Aracı": "Kamu Dış Borçlanma Araçları",
+    "Varlığa Dayalı Menkul Kıymet": "Varlığa Dayalı Menkul Kıymet"
+}
+
+RISK_ASSETS = ("Hisse Senedi", "Gayrimenkul Yatırım Fonu", "Girişim Sermayesi Yatırım Fonu")
+DEFENSIVE_ASSETS = ("Repo", "Para Piyasası", "Mevduat", "Nakit Teminat")
+
+
+def override_raw_names(raw_names, fund_codes):
+    # Special Override for TLY: TEFAS reports "Vadeli Mevduat" under asset name but it is actually VDMK.
+    raw = np.asarray(raw_names, dtype=object).copy()
+    tly = (np.asarray(fund_codes, dtype=object) == 'TLY') & (raw == 'Vadeli Mevduat')
+    raw[tly] = "Varlığa Dayalı Menkul Kıymet"
+    return raw
+
+
+def map_asset_names(raw_names, fund_codes=None):
+    # Vectorized TEFAS_ORIGINAL_NAMES lookup over a whole column of raw asset names
+    if fund_codes is not None:
+        raw_names = override_raw_names(raw_names, fund_codes)
+    raw = pd.Series(np.asarray(raw_names, dtype=object))
+    return raw.map(TEFAS_ORIGINAL_NAMES).fillna(raw).to_numpy(dtype=object)
+
+
+def asset_group_masks(assets):
+    # Which asset columns count as risk / defensive for manager-action classification
+    risk = np.array([any(k in a for k in RISK_ASSETS) for a in assets], dtype=bool)
+    defensive = np.array([any(k in a for k in DEFENSIVE_ASSETS) for a in assets], dtype=bool)
+    return risk, defensive
+
+
+class AllocationStore:
+    """Daily allocation weights of every fund as a sparse (date, fund, raw asset, weight) COO table.
+
+    Rows keep borsapy's raw asset names, so a fund's own diff lists two holdings that share
+    a TEFAS label separately, as fetch_allocation_diff always did. Any date slice densifies
+    to a small funds x asset-classes matrix with those holdings summed per label, so
+    universe-wide diffs and rotations are plain array arithmetic. root=None keeps it in
+    memory only.
+    """
+
+    def __init__(self, root=ALLOCATION_DIR):
+        self.root = root
+        self.codes = []
+        self.raw_assets = []
+        self.assets = []
+        self.raw_label = np.empty(0, dtype=np.int32)
+        self.dates = np.array([], dtype="datetime64[D]")
+        self.date_idx = np.empty(0, dtype=np.int32)
+        self.fund_idx = np.empty(0, dtype=np.int32)
+        self.raw_idx = np.empty(0, dtype=np.int32)
+        self.weight = np.empty(0, dtype=np.float64)
+        self._code_row = {}
+        self._raw_col = {}
+        self._asset_col = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def load(self):
+        if self.root is None:
+            return self
+        index_path = self._path("index.json")
+        if not os.path.exists(index_path):
+            return self
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        # Stores written before raw names were kept hold TEFAS labels, which map onto themselves
+        self.codes, self.raw_assets = index["codes"], index["raw_assets"] if "raw_assets" in index else index["assets"]
+        with np.load(self._path("weights.npz")) as npz:
+            self.dates = npz["dates"].astype("datetime64[D]")
+            self.date_idx, self.fund_idx = npz["date_idx"], npz["fund_idx"]
+            self.raw_idx = npz["raw_idx"] if "raw_idx" in npz.files else npz["asset_idx"]
+            self.weight = npz["weight"]
+        self._code_row = {c: i for i, c in enumerate(self.codes)}
+        self._raw_col = {a: i for i, a in enumerate(self.raw_assets)}
+        self._label_raw_assets()
+        logging.info(f"Allocation store loaded: {len(self.codes)} funds x {len(self.assets)} assets, {len(self.weight)} entries")
+        return self
+
+    def save(self):
+        if self.root is None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._path("weights.npz.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, dates=self.dates, date_idx=self.date_idx, fund_idx=self.fund_idx,
+                     raw_idx=self.raw_idx, weight=self.weight)
+        os.replace(tmp, self._path("weights.npz"))
+        tmp = self._path("index.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"codes": self.codes, "raw_assets": self.raw_assets}, f, ensure_ascii=False)
+        os.replace(tmp, self._path("index.json"))
+
+    def _intern(self, values, table, lookup):
+        uniq, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        ids = np.empty(len(uniq), dtype=np.int32)
+        for i, v in enumerate(uniq):
+            if v not in lookup:
+                lookup[v] = len(table)
+                table.append(v)
+            ids[i] = lookup[v]
+        return ids[inverse]
+
+    def _label_raw_assets(self):
+        # TEFAS label column of every raw asset name, rebuilt whenever new raw names are interned
+        self.assets, self._asset_col = [], {}
+        self.raw_label = self._intern(map_asset_names(self.raw_assets), self.assets, self._asset_col) if self.raw_assets else np.empty(0, dtype=np.int32)
+
+    def last_dates(self):
+        # code -> last date with allocation rows. One pass over the whole table: callers fetching many
+        # funds take it once up front rather than per fund.
+        with self._lock:
+            if not len(self.weight):
+                return {}
+            last = np.full(len(self.codes), -1, dtype=np.int64)
+            np.maximum.at(last, self.fund_idx, self.date_idx)
+            return {code: self.dates[last[i]] for i, code in enumerate(self.codes) if last[i] >= 0}
+
+    def ingest(self, df):
+        # df: long rows with Date, fund_code, asset_name (raw borsapy names), weight.
+        # Rows for a (date, fund) already in the store replace the stored snapshot of that pair.
+        if df is None or df.empty:
+            return 0
+        with self._lock:
+            return self._ingest(df)
+
+    def _ingest(self, df):
+        day = pd.to_datetime(df['Date']).dt.normalize().values.astype("datetime64[D]")
+        codes = df['fund_code'].to_numpy(dtype=object)
+        raw_assets = override_raw_names(df['asset_name'].to_numpy(dtype=object), codes)
+        weight = pd.to_numeric(df['weight'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+
+        fund_idx = self._intern(codes, self.codes, self._code_row)
+        raw_idx = self._intern(raw_assets, self.raw_assets, self._raw_col)
+        self._label_raw_assets()
+        all_dates = np.unique(np.concatenate([self.dates, day]))
+        old_date_idx = np.searchsorted(all_dates, self.dates)[self.date_idx] if len(self.date_idx) else self.date_idx
+        date_idx = np.searchsorted(all_dates, day).astype(np.int32)
+        self.dates = all_dates
+
+        # Drop stored rows whose (date, fund) pair is being re-ingested
+        n_funds = max(len(self.codes), 1)
+        new_pairs = np.unique(date_idx.astype(np.int64) * n_funds + fund_idx)
+        old_pairs = old_date_idx.astype(np.int64) * n_funds + self.fund_idx
+        keep = ~np.isin(old_pairs, new_pairs)
+
+        self.date_idx = np.concatenate([old_date_idx[keep], date_idx]).astype(np.int32)
+        self.fund_idx = np.concatenate([self.fund_idx[keep], fund_idx]).astype(np.int32)
+        self.raw_idx = np.concatenate([self.raw_idx[keep], raw_idx]).astype(np.int32)
+        self.weight = np.concatenate([self.weight[keep], weight]).astype(np.float64)
+
+        # Same (date, fund, raw asset) repeated within the batch: sum, like TEFAS' own grouped rows
+        key = (self.date_idx.astype(np.int64) * n_funds + self.fund_idx) * max(len(self.raw_assets), 1) + self.raw_idx
+        uniq, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+        if len(uniq) != len(key):
+            summed = np.bincount(inverse, weights=self.weight).astype(np.float64)
+            self.date_idx, self.fund_idx, self.raw_idx = self.date_idx[first], self.fund_idx[first], self.raw_idx[first]
+            self.weight = summed
+        return len(new_pairs)
+
+    def as_of(self, date=None):
+        # Dense funds x assets weights: each fund's latest snapshot on or before `date`
+        matrix = np.zeros((len(self.codes), len(self.assets)), dtype=np.float64)
+        snap_date = np.full(len(self.codes), -1, dtype=np.int64)
+        if not len(self.weight):
+            return matrix, snap_date
+        limit = len(self.dates) - 1 if date is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(date).date(), "D"), side="right") - 1
+        mask = self.date_idx <= limit
+        np.maximum.at(snap_date, self.fund_idx[mask], self.date_idx[mask])
+        sel = mask & (self.date_idx == snap_date[self.fund_idx])
+        np.add.at(matrix, (self.fund_idx[sel], self.raw_label[self.raw_idx[sel]]), self.weight[sel])
+        return matrix, snap_date
+
+    def previous_snapshot(self, before_idx):
+        # Dense weights of each fund's snapshot strictly before its own date index before_idx[f]
+        matrix = np.zeros((len(self.codes), len(self.assets)), dtype=np.float64)
+        prev_date = np.full(len(self.codes), -1, dtype=np.int64)
+        mask = self.date_idx < before_idx[self.fund_idx]
+        np.maximum.at(prev_date, self.fund_idx[mask], self.date_idx[mask])
+        sel = mask & (self.date_idx == prev_date[self.fund_idx])
+        np.add.at(matrix, (self.fund_idx[sel], self.raw_label[self.raw_idx[sel]]), self.weight[sel])
+        return matrix, prev_date
+
+    def diff(self, start=None, end=None):
+        # Weight change per fund and asset between two dates. start=None compares each fund's
+        # latest snapshot with its previous one (what fetch_allocation_diff does per fund).
+        latest, latest_date = self.as_of(end)
+        if start is None:
+            prev, prev_date = self.previous_snapshot(latest_date)
+        else:
+            prev, prev_date = self.as_of(start)
+        has_both = (latest_date >= 0) & (prev_date >= 0)
+        delta = np.where(has_both[:, None], latest - prev, 0)
+        return delta, latest, has_both
+
+    def top_changes(self, asset, start=None, end=None, n=5, largest=True, diff=None):
+        # e.g. "which funds added the most Hisse Senedi this week"; diff reuses a precomputed diff() result
+        if asset not in self._asset_col:
+            return []
+        delta, latest, has_both = diff if diff is not None else self.diff(start, end)
+        col = delta[:, self._asset_col[asset]]
+        col = np.where(has_both, col, np.nan)
+        order = np.argsort(-col if largest else col, kind="stable")
+        out = []
+        for i in order[:n]:
+            if np.isnan(col[i]) or col[i] == 0:
+                break
+            out.append({'fund_code': self.codes[i], 'asset': asset, 'weight': float(latest[i, self._asset_col[asset]]), 'diff': float(col[i])})
+        return out
+
+    def rotation(self, start=None, end=None, threshold=0.2, diff=None):
+        # Universe-wide risk-on / defensive classification, same thresholds as build_manager_actions
+        delta, _, has_both = diff if diff is not None else self.diff(start, end)
+        risk_mask, defensive_mask = asset_group_masks(self.assets)
+        risk_delta = delta[:, risk_mask].sum(axis=1)
+        defensive_delta = delta[:, defensive_mask].sum(axis=1)
+        risk_on = has_both & (risk_delta > threshold) & (defensive_delta < -threshold)
+        defensive = has_both & (risk_delta < -threshold) & (defensive_delta > threshold)
+        return {
+            'risk_delta': risk_delta,
+            'defensive_delta': defensive_delta,
+            'risk_on': risk_on,
+            'defensive': defensive,
+            'funds_compared': int(has_both.sum())
+        }
+
+    def frame(self, fund_code):
+        # One fund's stored rows in the long (Date, asset_name, weight) layout of allocation_history
+        with self._lock:
+            row = self._code_row.get(fund_code)
+            rows = np.flatnonzero(self.fund_idx == row) if row is not None else np.empty(0, dtype=np.int64)
+            return pd.DataFrame({
+                'Date': pd.DatetimeIndex(self.dates[self.date_idx[rows]]),
+                'asset_name': np.asarray(self.raw_assets, dtype=object)[self.raw_idx[rows]] if len(rows) else np.empty(0, dtype=object),
+                'weight': self.weight[rows],
+            })
+
+    def fund_allocation_diff(self, fund_code):
+        # fetch_allocation_diff's output for one fund, served from the store
+        with self._lock:
+            return self._fund_allocation_diff(fund_code)
+
+    def _fund_allocation_diff(self, fund_code):
+        row = self._code_row.get(fund_code)
+        if row is None:
+            return None
+        rows = np.flatnonzero(self.fund_idx == row)
+        fund_dates = np.unique(self.date_idx[rows])
+        if len(fund_dates) < 2:
+            return None
+        latest_d, prev_d = fund_dates[-1], fund_dates[-2]
+        # Per raw asset name, like the old merge on asset_name; only the output shows TEFAS labels
+        latest = np.zeros(len(self.raw_assets)); prev = np.zeros(len(self.raw_assets))
+        sel = rows[self.date_idx[rows] == latest_d]
+        latest[self.raw_idx[sel]] = self.weight[sel]
+        sel = rows[self.date_idx[rows] == prev_d]
+        prev[self.raw_idx[sel]] = self.weight[sel]
+        diff = latest - prev
+        order = np.argsort(-latest, kind="stable")
+        keep = order[(latest[order] != 0) | (diff[order] != 0)]
+        return {
+            'fund_code': fund_code,
+            'latest_date': str(self.dates[latest_d]),
+            'prev_date': str(self.dates[prev_d]),
+            'allocations': [{'asset': self.assets[self.raw_label[a]], 'weight': float(latest[a]), 'diff': float(diff[a])} for a in keep]
+        }
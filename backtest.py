@@ -0,0 +1,199 @@
+import json
+import time
+import logging
+import argparse
+from datetime import timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from data_quality import EXCLUDING
+from flow_engine import RESULT_COLUMNS, FlowPanel, anchor_flows
+from fund_categories import ALL, UNIVERSES, build_category_index, category_mask, universe_mask
+from fund_metadata import MetadataCache
+from history_store import HistoryStore
+from signal_engine import (CROWDING, DIVERGENCE_RULES, MOMENTUM_WEIGHTS, QUIET, TOP_N, crowding_scores,
+                           divergence_scores, load_signal_weights, momentum_scores, top_k_columns)
+from trading_calendar import anchor_columns, period_target
+
+# Forward-return horizons in trading days (panel columns after the signal date)
+HORIZONS = (5, 20, 60)
+
+# Calendar days between a signal date and a fund's last row on or before it; a longer gap keeps the fund
+# out of that day's universe (data_fetcher.STALE_MAX_DAYS is the age limit of cached rows in a live run)
+BACKTEST_MAX_GAP_DAYS = 7
+
+# Calendar days loaded before the first reference row so every fund has one on/before it
+ANCHOR_BUFFER_DAYS = 10
+
+
+def rolling_flows(panel, period_type):
+    # compute_flows() as of every panel date in one pass: each key is a (funds x dates) matrix whose
+    # column t only sees rows on or before dates[t]
+    n_funds, n_dates = panel.price.shape
+    valid = ~np.isnan(panel.price)
+    ffill, first_idx = panel.published_index()
+    rows = np.arange(n_funds)[:, None]
+
+    # The reference row depends only on the latest row's trading day, so it is resolved once per panel column
+    ref_col = anchor_columns(panel.dates, period_type)
+    latest_idx = ffill
+    ref = ref_col[np.maximum(latest_idx, 0)]
+    prev_idx = np.where(ref >= 0, ffill[rows, np.maximum(ref, 0)], -1)
+    prev_idx = np.where(prev_idx >= 0, prev_idx, first_idx[:, None])
+    prev_idx = np.where(latest_idx >= 0, prev_idx, -1)
+
+    return {'valid': (latest_idx >= 0) & (np.cumsum(valid, axis=1) >= 2), **anchor_flows(panel, latest_idx, prev_idx)}
+
+
+def forward_returns(panel, horizons=HORIZONS):
+    # {h: (funds x dates) % change from each date's last price to the last price h columns later}
+    n_funds, n_dates = panel.price.shape
+    ffill, _ = panel.published_index()
+    price = np.where(ffill >= 0, panel.price[np.arange(n_funds)[:, None], np.maximum(ffill, 0)], np.nan)
+    out = {}
+    for h in horizons:
+        fwd = np.full(price.shape, np.nan)
+        if h < n_dates:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                fwd[:, :-h] = np.where(price[:, :-h] > 0, (price[:, h:] / price[:, :-h] - 1) * 100, np.nan)
+        out[h] = fwd
+    return out
+
+
+def summarize(picks, fwd, benchmark):
+    # picks: (k x dates) fund rows (-1 = empty slot) -> hit statistics per horizon
+    cols = np.broadcast_to(np.arange(picks.shape[1]), picks.shape)
+    taken = picks >= 0
+    summary = {'picks': int(taken.sum()), 'dates': int(taken.any(axis=0).sum()), 'horizons': {}}
+    for h, returns in fwd.items():
+        ret = returns[np.maximum(picks, 0), cols]
+        excess = ret - benchmark[h][None, :]
+        ok = taken & np.isfinite(excess)
+        summary['horizons'][h] = {
+            'n': int(ok.sum()),
+            'mean_return': float(ret[ok].mean()) if ok.any() else None,
+            'mean_excess': float(excess[ok].mean()) if ok.any() else None,
+            'hit_rate': float((excess[ok] > 0).mean() * 100) if ok.any() else None,
+        }
+    return summary
+
+
+def run_backtest(panel, period_type="weekly", start=None, end=None, horizons=HORIZONS, selected_cats=None,
+                 signal_weights=None, k=TOP_N, universe="YAT"):
+    # Replays the published divergent / momentum / crowding picks on every panel date in [start, end]
+    # and scores them against the equal-weight forward return of that day's eligible universe
+    signal_weights = load_signal_weights() if signal_weights is None else signal_weights
+    flows = rolling_flows(panel, period_type)
+    fwd = forward_returns(panel, horizons)
+
+    cols = np.ones(len(panel.dates), dtype=bool)
+    if start is not None:
+        cols &= panel.dates >= np.datetime64(pd.Timestamp(start).date(), "D")
+    if end is not None:
+        cols &= panel.dates <= np.datetime64(pd.Timestamp(end).date(), "D")
+    dates = panel.dates[cols]
+    flows = {key: value[:, cols] for key, value in flows.items()}
+    fwd = {h: value[:, cols] for h, value in fwd.items()}
+
+    # Leaderboard universe of each day: fresh rows, the published leaderboards' data-quality codes
+    # (which include their investor cut), default (or selected) categories
+    stale = dates[None, :] - panel.dates[np.maximum(flows['latest_idx'], 0)] > np.timedelta64(BACKTEST_MAX_GAP_DAYS, "D")
+    quality = panel.quality_index().check(flows['latest_idx'], flows['prev_idx'])
+    eligible = flows['valid'] & ~stale & ((quality & EXCLUDING) == 0)
+    eligible &= (category_mask(panel.category, panel.default_excluded, selected_cats) & universe_mask(panel.category, universe))[:, None]
+    results = SimpleNamespace(**{col: flows[col].astype(dtype) for col, dtype in RESULT_COLUMNS.items()})
+
+    benchmark = {}
+    for h, returns in fwd.items():
+        ok = eligible & np.isfinite(returns)
+        n = ok.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            benchmark[h] = np.where(n > 0, np.where(ok, returns, 0).sum(axis=0) / n, np.nan)
+
+    report = {}
+    rule, div_score = divergence_scores(results, signal_weights.get('divergence'))
+    div_picks = top_k_columns(div_score, k, eligible & np.isfinite(div_score))
+    report['divergent_signals'] = summarize(div_picks, fwd, benchmark)
+    picked_rule = np.where(div_picks >= 0, rule[np.maximum(div_picks, 0), np.arange(len(dates))], -1)
+    for r, (signal_key, _, _) in enumerate(DIVERGENCE_RULES):
+        report[f'divergent_signals/{signal_key}'] = summarize(np.where(picked_rule == r, div_picks, -1), fwd, benchmark)
+
+    weightings = signal_weights.get('momentum') or MOMENTUM_WEIGHTS
+    weightings = [weightings] if isinstance(weightings, dict) else list(weightings)
+    for w, scores in enumerate(momentum_scores(results, weightings, eligible)):
+        name = 'momentum_scores' if len(weightings) == 1 else f'momentum_scores/{w}'
+        report[name] = summarize(top_k_columns(scores, k, eligible), fwd, benchmark)
+        report[name]['weights'] = weightings[w]
+
+    kind, crowd_score = crowding_scores(results)
+    crowd_picks = top_k_columns(crowd_score, k, eligible & (kind > 0))
+    picked_kind = np.where(crowd_picks >= 0, kind[np.maximum(crowd_picks, 0), np.arange(len(dates))], 0)
+    report['crowding_signals'] = summarize(crowd_picks, fwd, benchmark)
+    report['crowding_signals/crowding'] = summarize(np.where(picked_kind == CROWDING, crowd_picks, -1), fwd, benchmark)
+    report['crowding_signals/quiet'] = summarize(np.where(picked_kind == QUIET, crowd_picks, -1), fwd, benchmark)
+
+    return {
+        'period': period_type,
+        'universe': universe,
+        'start': str(dates[0]) if len(dates) else None,
+        'end': str(dates[-1]) if len(dates) else None,
+        'dates': len(dates),
+        'funds': len(panel),
+        'horizons': list(horizons),
+        'benchmark': {h: float(np.nanmean(b)) if np.isfinite(b).any() else None for h, b in benchmark.items()},
+        'signals': report,
+    }
+
+
+def load_panel(store, metadata, period_type, start=None, end=None):
+    # Stored history from the first backtest date's reference row onwards, with the category index
+    since = None
+    if start is not None:
+        first = np.array([np.datetime64(pd.Timestamp(start).date(), "D")])
+        target = period_target(first, period_type)
+        since = pd.Timestamp((first if target is None else target)[0]) - timedelta(days=ANCHOR_BUFFER_DAYS)
+    panel = FlowPanel.from_store(store, start=since)
+    names = {code: metadata.name(code) or '' for code in panel.codes}
+    code_to_type = {code: info['fund_type'] for fund_type in UNIVERSES
+                    for code, info in metadata.universes.get(fund_type, {}).get("funds", {}).items()}
+    panel.category, panel.default_excluded = build_category_index(panel.codes, code_to_type, names)
+    return panel
+
+
+def print_report(report):
+    print(f"{report['period']} signals, {report['start']} .. {report['end']} ({report['dates']} dates, {report['funds']} funds)")
+    header = "".join(f"  {f'+{h}d ret/excess/hit':>24}" for h in report['horizons'])
+    print(f"{'signal':<40}{'picks':>7}{header}")
+    for name, summary in report['signals'].items():
+        line = f"{name:<40}{summary['picks']:>7}"
+        for h in report['horizons']:
+            s = summary['horizons'][h]
+            line += f"  {'-':>24}" if s['n'] == 0 else f"  {s['mean_return']:7.2f}%{s['mean_excess']:7.2f}%{s['hit_rate']:7.1f}%"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest the published flow signals over the local history store")
+    parser.add_argument("period", choices=["daily", "weekly", "monthly", "quarterly", "ytd", "1y", "3y"], default="weekly", nargs="?")
+    parser.add_argument("cats", default="", nargs="?")
+    parser.add_argument("--start", help="First signal date (YYYY-MM-DD), defaults to the start of the store")
+    parser.add_argument("--end", help="Last signal date (YYYY-MM-DD), defaults to the latest stored date")
+    parser.add_argument("--horizons", default=",".join(map(str, HORIZONS)), help="Forward-return horizons in trading days")
+    parser.add_argument("--universe", choices=UNIVERSES + [ALL], default="YAT", help="Backtest YAT funds, pension (EMK) funds or both")
+    parser.add_argument("--out", help="Also write the report as JSON to this path")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    selected_cats = [c.strip() for c in args.cats.split(",") if c.strip()]
+    horizons = tuple(int(h) for h in args.horizons.split(",") if h.strip())
+    t0 = time.perf_counter()
+    panel = load_panel(HistoryStore().load(), MetadataCache(None).load(), args.period, args.start, args.end)
+    t1 = time.perf_counter()
+    report = run_backtest(panel, args.period, args.start, args.end, horizons, selected_cats, universe=args.universe)
+    logging.info(f"Loaded {len(panel)} funds x {len(panel.dates)} dates in {t1 - t0:.2f}s, backtest took {time.perf_counter() - t1:.2f}s")
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -1,224 +1,266 @@
-import sys
 import os
 import json
-import logging
 import time
+import logging
 from datetime import datetime, timedelta
-import concurrent.futures
 import argparse
+import concurrent.futures
+from collections import namedtuple
 
-sys.path.append(r"C:\Users\svkto\.gemini\antigravity\scratch\borsapy_repo")
-import borsapy as bp
+import numpy as np
 import pandas as pd
 
+from history_store import HistoryStore
+from flow_engine import FlowPanel, FlowResults, FundDigest, compute_flows, flow_records, range_flows
+from trading_calendar import anchor_columns
+from data_quality import eligible, quality_summary
+from fund_metadata import MetadataCache
+from fund_categories import (ALL, ALL_CATS, FIRST_PENSION_ID, PENSION_CAT_TO_KEYWORDS, UNIVERSES, build_category_index,
+                             category_label, category_mask, universe_mask)
+from leaderboards import LeaderboardAccumulator, rank_leaderboards
+from run_cache import RunCache
+from providers import PROVIDERS, SyntheticProvider, active_provider, make_provider, set_provider
+from signal_engine import CROWDING, DIVERGENCE_RULES, TOP_N, compute_signals, load_signal_weights, rotation_scores, top_k
+from allocation_store import DEFENSIVE_ASSETS, RISK_ASSETS, AllocationStore
+from look_through import HoldingsCache, effective_diff, fund_of_funds_codes
+from fetch_pipeline import CHECKPOINT_DIR, FETCH_CONCURRENCY, FETCH_RATE, Checkpoint, fetch_many
+from tefas_bulk import BULK_HISTORY_URL, BulkHistoryClient, bulk_refresh
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_prev_row(df, period_type):
-    latest_date = df.index[-1]
-    if period_type == "daily":
-        return df.iloc[-2] if len(df) > 1 else df.iloc[0]
-    elif period_type == "weekly":
-        target = latest_date - timedelta(days=7)
-    elif period_type == "monthly":
-        # Target the last day of the previous calendar month
-        first_day_of_current_month = latest_date.replace(day=1)
-        target = first_day_of_current_month - timedelta(days=1)
+# Calendar days of history the flow metrics look at (matches history(period="3mo"))
+LOOKBACK_DAYS = 92
+
+# Calendar days of history each period needs before the latest row; anything past LOOKBACK_DAYS
+# is backfilled into the history store once and then only appended to
+PERIOD_LOOKBACK_DAYS = {
+    "daily": LOOKBACK_DAYS,
+    "weekly": LOOKBACK_DAYS,
+    "monthly": LOOKBACK_DAYS,
+    "quarterly": 100,
+    "ytd": 376,
+    "1y": 376,
+    "3y": 3 * 366 + 10,
+}
+
+# Extra calendar days loaded before a custom range start so every fund has a reference row on/before it
+RANGE_BUFFER_DAYS = 10
+
+# Funds filled in from the cache after a fetch deadline stay out of the leaderboards once their last
+# row is this many calendar days older than the newest row of the scan (3 covers a weekend)
+STALE_MAX_DAYS = 3
+
+# Funds whose last published price is more than this many days behind the universe count as dormant,
+# not late, and are not chased by --refresh-lagging
+PUBLISH_LAG_DAYS = 7
+
+# Output file suffix of each view (YAT keeps the historical data.json names)
+VIEW_SUFFIXES = {"YAT": "", "EMK": "_emk", ALL: "_combined"}
+
+# One (period, view) report of build_flow_report: the leaderboards, signals, category flows and footer of one
+# data.json, plus the run's coverage and data-quality summaries
+FlowReport = namedtuple("FlowReport", [
+    "top_inflows", "top_outflows", "top_cat_in", "top_cat_out", "top_inv_in", "top_inv_out", "top_gainers", "top_losers",
+    "divergent_signals", "momentum_scores", "crowding_signals", "category_rotation", "footer_note", "coverage", "quality",
+])
+
+# Last universe scan (panel + names + category index), reused by --snapshot-max-age
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "universe_snapshot.npz")
+
+def get_prev_row(df, period_type, start=None):
+    if period_type == "custom":
+        past_df = df[df.index <= pd.Timestamp(start)]
+        return past_df.iloc[-1] if not past_df.empty else df.iloc[0]
+    # Last row on or before the anchor trading day of the latest row (daily: the trading day before),
+    # from the same calendar tables as compute_flows
+    pos = int(anchor_columns(df.index.values.astype("datetime64[D]"), period_type)[-1])
+    return df.iloc[pos] if pos >= 0 else df.iloc[0]
+
+def history_since(periods=(), range_start=None):
+    # Earliest date a run needs: the longest lookback of its periods, or further back for a custom range
+    days = max([LOOKBACK_DAYS] + [PERIOD_LOOKBACK_DAYS.get(p, LOOKBACK_DAYS) for p in periods])
+    since = datetime.now() - timedelta(days=days)
+    if range_start is not None:
+        since = min(since, pd.Timestamp(range_start).to_pydatetime() - timedelta(days=RANGE_BUFFER_DAYS))
+    return since
+
+def bulk_current(store, fund_code):
+    # True once a bulk refresh has written this fund's rows up to today
+    through = store.bulk_through.get(fund_code) if store is not None else None
+    return through is not None and through >= datetime.now().date()
+
+def fetch_history(fund, fund_code, store=None, since=None):
+    # Fetching 3 months of data to safely get 30-day lookback for 'monthly'; longer periods pass an earlier `since`
+    default_since = datetime.now() - timedelta(days=LOOKBACK_DAYS)
+    long_window = since is not None and since < default_since
+    if store is None:
+        return fund.history(start=since) if long_window else fund.history(period="3mo")
+    
+    # With a history store only rows newer than the last stored date are downloaded
+    last_date = store.last_date(fund_code)
+    if last_date is None:
+        store.stage(fund_code, fund.history(start=since) if long_window else fund.history(period="3mo"))
+        if long_window:
+            store.mark_backfilled(fund_code, since)
     else:
-        return df.iloc[-2]
-        
-    past_df = df[df.index <= target]
-    return past_df.iloc[-1] if not past_df.empty else df.iloc[0]
+        # From the last published price, so a price-0 placeholder row is replaced once the fund publishes
+        start = (store.published_date(fund_code) or last_date) + timedelta(days=1)
+        if start.date() <= datetime.now().date() and not bulk_current(store, fund_code):
+            # An empty frame means no rows since the last stored date; upstream errors raise to fetch_many's
+            # retries and circuit breaker instead of silently serving the stored rows
+            store.stage(fund_code, fund.history(start=start))
+        if long_window and store.needs_backfill(fund_code, since):
+            # Rows older than the store's first date are downloaded once, not on every long-period run
+            first_date = store.first_date(fund_code)
+            try:
+                store.stage(fund_code, fund.history(start=since, end=first_date - timedelta(days=1)))
+                store.mark_backfilled(fund_code, since)
+            except Exception as e:
+                logging.warning(f"Backfill of {fund_code} before {first_date.date()} failed, retrying next run: {e}")
+    return store.frame(fund_code, start=default_since)
+
+def fund_name(fund, fund_code, metadata=None):
+    # fund.info is an extra upstream call per fund; only made when the metadata cache has no name
+    name = metadata.name(fund_code) if metadata is not None else None
+    if name is None:
+        name = fund.info.get('name', '')
+        if metadata is not None:
+            metadata.set_name(fund_code, name)
+    return name
+
+def get_fund(fund_code, cache=None):
+    provider = active_provider()
+    if cache is None:
+        return provider.fund(fund_code)
+    return cache.get_or_fetch('fund', fund_code, lambda: provider.fund(fund_code))
+
+def fetch_fund_history(fund_code, store=None, metadata=None, cache=None, since=None):
+    # Raises on upstream errors so the fetch pipeline can retry; None means too little data.
+    # With a run cache the universe scan, tracked funds and allocation diffs share one fetch per fund.
+    if cache is not None:
+        return cache.get_or_fetch('history', fund_code, lambda: _fetch_fund_history(fund_code, store, metadata, cache, since))
+    return _fetch_fund_history(fund_code, store, metadata, since=since)
 
-def get_fund_flow(fund_code, period_type):
+def _fetch_fund_history(fund_code, store=None, metadata=None, cache=None, since=None):
+    fund = get_fund(fund_code, cache)
+    df = fetch_history(fund, fund_code, store, since)
+    if df.empty or len(df) < 2:
+        return None
+    return fund_name(fund, fund_code, metadata), df
+
+def encode_fetched(fetched):
+    if fetched is None:
+        return None
+    name, df = fetched
+    return {
+        'name': name,
+        'index': [d.strftime("%Y-%m-%d") for d in df.index],
+        'columns': list(df.columns),
+        'data': df.values.tolist()
+    }
+
+def decode_fetched(fund_code, payload, store=None):
+    if payload is None:
+        return None
+    df = pd.DataFrame(payload['data'], index=pd.to_datetime(payload['index']), columns=payload['columns'])
+    if store is not None:
+        # Rows fetched before the interruption were never flushed; stage them again
+        store.stage(fund_code, df)
+    return payload['name'], df
+
+def get_fund_flow(fund_code, period_type, store=None, metadata=None):
     try:
-        fund = bp.Fund(fund_code)
-        # Fetching 3 months of data to safely get 30-day lookback for 'monthly'
-        df = fund.history(period="3mo")
-        if df.empty or len(df) < 2:
-            return None
-            
-        shares_col = 'Shares' if 'Shares' in df.columns else 'Tedavüldeki Pay Sayısı' if 'Tedavüldeki Pay Sayısı' in df.columns else None
-        if shares_col is None:
-            df['Shares'] = df['FundSize'] / df['Price']
-            shares_col = 'Shares'
-            
-        latest = df.iloc[-1]
-        prev = get_prev_row(df, period_type)
-        
-        latest_shares = latest[shares_col]
-        prev_shares = prev[shares_col]
-        
-        # Inflow/Outflow calculation
-        net_flow = (latest_shares - prev_shares) * latest['Price']
-        flow_pct = (net_flow / prev['FundSize']) * 100 if prev['FundSize'] > 0 else 0
-        
-        # Price-based return calculation
-        return_pct = ((latest['Price'] - prev['Price']) / prev['Price']) * 100 if prev['Price'] > 0 else 0
-        
-        # Investor change
-        inv_latest = latest.get('Investors', 0)
-        inv_prev = prev.get('Investors', 0)
-        inv_change = inv_latest - inv_prev
-        inv_change_pct = (inv_change / inv_prev * 100) if inv_prev > 0 else 0
-        
-        return {
-            'fund_code': fund_code,
-            'name': fund.info.get('name', ''),
-            'net_flow': float(net_flow),
-            'fund_size': float(latest['FundSize']),
-            'flow_pct': float(flow_pct),
-            'return_pct': float(return_pct),
-            'investors': int(inv_latest),
-            'inv_change': int(inv_change),
-            'inv_change_pct': float(inv_change_pct)
-        }
+        fetched = fetch_fund_history(fund_code, store, metadata)
     except Exception as e:
         logging.error(f"Error fetching fund {fund_code}: {e}")
         return None
+    if fetched is None:
+        return None
+    name, df = fetched
+    panel = FlowPanel.from_histories({fund_code: df})
+    records = flow_records(panel, compute_flows(panel, period_type), {fund_code: name})
+    return records[0] if records else None
 
-def normalize(s):
-    if not s: return ""
-    s = str(s).lower()
-    repls = {'ı': 'i', 'ş': 's', 'ğ': 'g', 'ü': 'u', 'ö': 'o', 'ç': 'c', 'i̇': 'i'}
-    for k, v in repls.items():
-        s = s.replace(k, v)
-    return s
-
-def build_divergent_signals(results_filtered):
-    signals = []
-
-    for r in results_filtered:
-        flow_pct = float(r.get('flow_pct', 0))
-        return_pct = float(r.get('return_pct', 0))
-        inv_change = int(r.get('inv_change', 0))
-        inv_change_pct = float(r.get('inv_change_pct', 0))
-        candidates = []
-
-        if flow_pct < 0 and return_pct > 0:
-            candidates.append(("flow_down_return_up", "Çıkışa rağmen getiri güçlü", "Çıkış var ama performans pozitif", abs(flow_pct) * 1.4 + abs(return_pct) * 1.1))
-        if flow_pct > 0 and return_pct < 0:
-            candidates.append(("flow_up_return_down", "Girişe rağmen getiri zayıf", "Para girişi var ama performans negatif", abs(flow_pct) * 1.4 + abs(return_pct) * 1.1))
-        if flow_pct < 0 and inv_change > 0:
-            candidates.append(("flow_down_investor_up", "Çıkışa rağmen yatırımcı artıyor", "Para çıkıyor ama yatırımcı sayısı artıyor", abs(flow_pct) * 1.2 + abs(inv_change_pct)))
-        if flow_pct > 0 and inv_change < 0:
-            candidates.append(("flow_up_investor_down", "Girişe rağmen yatırımcı azalıyor", "Para giriyor ama yatırımcı sayısı düşüyor", abs(flow_pct) * 1.2 + abs(inv_change_pct)))
-
-        if not candidates:
-            continue
-
-        signal_key, signal_title, signal_summary, signal_score = max(candidates, key=lambda x: x[3])
-        signals.append({
-            'fund_code': r['fund_code'],
-            'name': r.get('name', ''),
+def build_divergent_signals(results_filtered, signals=None):
+    r = results_filtered
+    if not len(r):
+        return []
+    top, rule, score = (signals or compute_signals(r))['divergent']
+    out = []
+    for i in top:
+        signal_key, signal_title, signal_summary = DIVERGENCE_RULES[rule[i]]
+        out.append({
+            'fund_code': r.codes[i],
+            'name': r.names[i],
             'signal_key': signal_key,
             'signal_title': signal_title,
             'signal_summary': signal_summary,
-            'signal_score': float(signal_score),
-            'flow_pct': flow_pct,
-            'return_pct': return_pct,
-            'inv_change': inv_change,
-            'inv_change_pct': inv_change_pct,
-            'net_flow': float(r.get('net_flow', 0)),
-            'fund_size': float(r.get('fund_size', 0)),
-            'investors': int(r.get('investors', 0))
+            'signal_score': float(score[i]),
+            'flow_pct': float(r.flow_pct[i]),
+            'return_pct': float(r.return_pct[i]),
+            'inv_change': int(r.inv_change[i]),
+            'inv_change_pct': float(r.inv_change_pct[i]),
+            'net_flow': float(r.net_flow[i]),
+            'fund_size': float(r.fund_size[i]),
+            'investors': int(r.investors[i])
         })
+    return out
 
-    signals.sort(key=lambda x: x['signal_score'], reverse=True)
-    return signals[:5]
-
-def build_rank_map(results, key):
-    if not results:
-        return {}
-    sorted_results = sorted(results, key=lambda x: x.get(key, 0))
-    total = max(len(sorted_results) - 1, 1)
-    rank_map = {}
-    for idx, item in enumerate(sorted_results):
-        rank_map[item['fund_code']] = (idx / total) * 100
-    return rank_map
-
-def build_momentum_scores(results_filtered):
-    if not results_filtered:
+def build_momentum_scores(results_filtered, signals=None):
+    r = results_filtered
+    if not len(r):
         return []
+    top, score = (signals or compute_signals(r))['momentum'][0]
+    return [{
+        'fund_code': r.codes[i],
+        'name': r.names[i],
+        'momentum_score': float(score[i]),
+        'flow_pct': float(r.flow_pct[i]),
+        'return_pct': float(r.return_pct[i]),
+        'inv_change_pct': float(r.inv_change_pct[i]),
+        'inv_change': int(r.inv_change[i])
+    } for i in top]
 
-    flow_ranks = build_rank_map(results_filtered, 'flow_pct')
-    ret_ranks = build_rank_map(results_filtered, 'return_pct')
-    inv_ranks = build_rank_map(results_filtered, 'inv_change_pct')
-    scores = []
-
-    for r in results_filtered:
-        code = r['fund_code']
-        score = flow_ranks.get(code, 0) * 0.45 + inv_ranks.get(code, 0) * 0.35 + ret_ranks.get(code, 0) * 0.20
-        scores.append({
-            'fund_code': code,
-            'name': r.get('name', ''),
-            'momentum_score': round(score, 2),
-            'flow_pct': float(r.get('flow_pct', 0)),
-            'return_pct': float(r.get('return_pct', 0)),
-            'inv_change_pct': float(r.get('inv_change_pct', 0)),
-            'inv_change': int(r.get('inv_change', 0))
-        })
-
-    scores.sort(key=lambda x: x['momentum_score'], reverse=True)
-    return scores[:5]
-
-def build_crowding_signals(results_filtered):
-    signals = []
-
-    for r in results_filtered:
-        flow_pct = float(r.get('flow_pct', 0))
-        inv_change_pct = float(r.get('inv_change_pct', 0))
-        return_pct = float(r.get('return_pct', 0))
-
-        if flow_pct <= 0 and inv_change_pct <= 0:
-            continue
-
-        crowd_gap = inv_change_pct - flow_pct
-        quiet_gap = flow_pct - inv_change_pct
-
-        if crowd_gap >= 1.0 and inv_change_pct > 0:
+def build_crowding_signals(results_filtered, signals=None):
+    r = results_filtered
+    if not len(r):
+        return []
+    top, kind, score = (signals or compute_signals(r))['crowding']
+    out = []
+    for i in top:
+        if kind[i] == CROWDING:
             label = "Kalabal\u0131kla\u015fma"
             summary = "Yat\u0131r\u0131mc\u0131 art\u0131\u015f\u0131 para giri\u015finden h\u0131zl\u0131"
-            signal_score = crowd_gap + max(inv_change_pct, 0) * 0.35
-        elif quiet_gap >= 1.0 and flow_pct > 0:
+        else:
             label = "Sakin Birikim"
             summary = "Para giri\u015fi yat\u0131r\u0131mc\u0131 art\u0131\u015f\u0131ndan g\u00fc\u00e7l\u00fc"
-            signal_score = quiet_gap + max(flow_pct, 0) * 0.35
-        else:
-            continue
-
-        signals.append({
-            'fund_code': r['fund_code'],
-            'name': r.get('name', ''),
+        out.append({
+            'fund_code': r.codes[i],
+            'name': r.names[i],
             'signal_title': label,
             'signal_summary': summary,
-            'signal_score': round(signal_score, 2),
-            'flow_pct': flow_pct,
-            'return_pct': return_pct,
-            'inv_change_pct': inv_change_pct
+            'signal_score': float(score[i]),
+            'flow_pct': float(r.flow_pct[i]),
+            'return_pct': float(r.return_pct[i]),
+            'inv_change_pct': float(r.inv_change_pct[i])
         })
-
-    signals.sort(key=lambda x: x['signal_score'], reverse=True)
-    return signals[:5]
+    return out
 
 def build_category_rotation(cat_list):
+    flow_pct = np.array([float(c.get('flow_pct', 0)) for c in cat_list])
+    moved, score = rotation_scores(flow_pct)
     rotations = []
-
-    for c in cat_list:
-        flow_pct = float(c.get('flow_pct', 0))
-        net_flow = float(c.get('net_flow', 0))
-        if abs(flow_pct) < 0.05:
-            continue
+    for i in top_k(score, TOP_N, moved):
+        up = flow_pct[i] > 0
         rotations.append({
-            'category': c.get('fund_code', ''),
-            'signal_title': "Rotasyon G\u00fc\u00e7leniyor" if flow_pct > 0 else "Rotasyon Zay\u0131fl\u0131yor",
-            'signal_summary': "Kategoriye para giri\u015fi var" if flow_pct > 0 else "Kategoriden para \u00e7\u0131k\u0131\u015f\u0131 var",
-            'flow_pct': flow_pct,
-            'net_flow': net_flow,
-            'rotation_score': round(abs(flow_pct), 2)
+            'category': cat_list[i].get('fund_code', ''),
+            'signal_title': "Rotasyon G\u00fc\u00e7leniyor" if up else "Rotasyon Zay\u0131fl\u0131yor",
+            'signal_summary': "Kategoriye para giri\u015fi var" if up else "Kategoriden para \u00e7\u0131k\u0131\u015f\u0131 var",
+            'flow_pct': float(flow_pct[i]),
+            'net_flow': float(cat_list[i].get('net_flow', 0)),
+            'rotation_score': float(score[i])
         })
-
-    rotations.sort(key=lambda x: x['rotation_score'], reverse=True)
-    return rotations[:5]
+    return rotations
 
 def build_relative_strength(tracked_data):
     if not tracked_data:
@@ -248,18 +290,17 @@ def build_manager_actions(allocation_diffs, tracked_data=None):
         return []
     tracked_data = tracked_data or {}
 
-    risk_assets = ("Hisse Senedi", "Gayrimenkul Yat\u0131r\u0131m Fonu", "Giri\u015fim Sermayesi Yat\u0131r\u0131m Fonu")
-    defensive_assets = ("Repo", "Para Piyasas\u0131", "Mevduat", "Nakit Teminat")
     actions = []
 
     for code, item in allocation_diffs.items():
-        allocations = item.get('allocations', [])
+        # Fund-of-funds: judge the manager on what the held funds actually hold
+        allocations = item.get('look_through') or item.get('allocations', [])
         if not allocations:
             continue
         top_inc = max(allocations, key=lambda x: x.get('diff', 0))
         top_dec = min(allocations, key=lambda x: x.get('diff', 0))
-        risk_delta = sum(float(a.get('diff', 0)) for a in allocations if any(k in a.get('asset', '') for k in risk_assets))
-        defensive_delta = sum(float(a.get('diff', 0)) for a in allocations if any(k in a.get('asset', '') for k in defensive_assets))
+        risk_delta = sum(float(a.get('diff', 0)) for a in allocations if any(k in a.get('asset', '') for k in RISK_ASSETS))
+        defensive_delta = sum(float(a.get('diff', 0)) for a in allocations if any(k in a.get('asset', '') for k in DEFENSIVE_ASSETS))
 
         if risk_delta > 0.2 and defensive_delta < -0.2:
             title = "Risk art\u0131r\u0131yor"
@@ -283,152 +324,445 @@ def build_manager_actions(allocation_diffs, tracked_data=None):
 
     return actions
 
-def fetch_all_flows(period_type, selected_cats=None, sort_mode='tl'):
-    logging.info(f"Screening funds for {period_type} period (Sort: {sort_mode})...")
+def cached_histories(codes, store=None, metadata=None, periods=None, snapshot_path=None):
+    # Last known rows of funds a scan did not reach: the history store, else the previous universe snapshot
+    # (a snapshot of fund digests only if it holds the anchors of `periods`)
+    names = {}
+    frames = {}
+    snapshot_path = snapshot_path or SNAPSHOT_PATH
+    if store is not None:
+        start = datetime.now() - timedelta(days=LOOKBACK_DAYS)
+        frames = {code: store.frame(code, start=start) for code in codes if store.last_date(code) is not None}
+    elif os.path.exists(snapshot_path):
+        panel, meta = FlowPanel.load(snapshot_path)
+        if panel.periods is None or (periods and set(periods) <= set(panel.periods)):
+            held = set(panel.codes)
+            frames = {code: panel.frame(code) for code in codes if code in held}
+            names = meta['names']
+    return {code: (names.get(code) or (metadata.name(code) if metadata is not None else None) or '', df)
+            for code, df in frames.items() if len(df) >= 2}
+
+def universe_fund_types(views):
+    # TEFAS fund types a set of views needs screened, in UNIVERSES order
+    wanted = set(UNIVERSES) if ALL in views else set(views)
+    return tuple(fund_type for fund_type in UNIVERSES if fund_type in wanted)
+
+def universe_checkpoint_path(since, fund_types=("YAT",), shard=None, checkpoint_dir=None):
+    # Finished funds are checkpointed so a crashed run resumes the same day without refetching them
+    # (a long-period run keeps its own checkpoint: funds restored from a short run were never backfilled)
+    lookback_days = (datetime.now() - since).days
+    suffix = f"_{lookback_days}d" if lookback_days > LOOKBACK_DAYS else ""
+    if tuple(fund_types) != ("YAT",):
+        suffix += "_" + "_".join(fund_types)
+    if shard is not None:
+        suffix += f"_shard{shard[0]}of{shard[1]}"
+    return os.path.join(checkpoint_dir or CHECKPOINT_DIR, f"universe_{datetime.now().strftime('%Y-%m-%d')}{suffix}.jsonl")
+
+def digest_fetched(periods):
+    # fetch_many reduce step: (name, history frame) -> (name, FundDigest), so the frame is released right away
+    def reduce(fetched):
+        if fetched is None:
+            return None
+        name, df = fetched
+        return name, FundDigest.from_frame(df, periods)
+    return reduce
+
+def fetch_histories(fund_codes, store=None, *, concurrency=FETCH_CONCURRENCY, rate=FETCH_RATE, metadata=None, on_result=None, cache=None, since=None, deadline=None, checkpoint=None, periods=None, keep=None, snapshot_path=None):
+    # The fetch half of a universe scan, for the whole universe or one screening shard.
+    # Returns names and histories in fund_codes order plus the funds filled from cached rows and the ones missing.
+    # With preset `periods` every history is reduced to a FundDigest as soon as it arrives (custom ranges need
+    # every row); only the funds in `keep` (e.g. tracked funds, default: all) keep their full frame in the run cache.
+    reduce = digest_fetched(periods) if periods and "custom" not in periods else (lambda fetched: fetched)
+    shared = (lambda code: True) if keep is None else set(keep).__contains__
+    # After a bulk refresh stored funds are already current; only new or not yet backfilled ones go upstream
+    covered = {}
+    if store is not None and store.bulk_through:
+        default_since = datetime.now() - timedelta(days=LOOKBACK_DAYS)
+        long_window = since is not None and since < default_since
+        for code in fund_codes:
+            if not bulk_current(store, code) or store.last_date(code) is None or (long_window and store.needs_backfill(code, since)):
+                continue
+            df = store.frame(code, start=default_since)
+            name = metadata.name(code) if metadata is not None else None
+            covered[code] = (name or '', df) if len(df) >= 2 else None
+            if cache is not None and shared(code):
+                cache.put('history', code, covered[code])
+            covered[code] = reduce(covered[code])
+        logging.info(f"Bulk refresh covers {len(covered)} of {len(fund_codes)} funds")
     
-    # Mapping of categories to keywords for granular filtering
-    # Keys here MUST match the dashboard checkbox values exactly
-    cat_to_keywords = {
-        "Hisse Senedi": ["Hisse Senedi", "Hisse"],
-        "Değişken": ["Değişken", "Degisken"],
-        "Karma": ["Karma"],
-        "Fon Sepeti": ["Fon Sepeti"],
-        "Borçlanma Araçları": ["Borçlanma Araçları", "Borclanma Aracları", "Tahvil", "Bono"],
-        "K.Maden": ["Altın", "Gümüş", "Kıymetli Maden", "Altin", "Gumus"],  # dashboard sends 'K.Maden'
-        "Katılım": ["Katılım", "Katilim"],
-        "Para Piy.": ["Para Piyasası", "Para Piyasasi"],  # dashboard sends 'Para Piy.'
-        "Serbest (Genel)": ["Serbest"],        # dashboard sends 'Serbest (Genel)'
-        "Serbest (P.Piy)": ["Serbest", "Para Piyasası"],  # dashboard sends 'Serbest (P.Piy)'
-        "Serbest (Döviz)": ["Serbest", "Döviz"],
-        "Serbest (K.Vade)": ["Serbest", "Kısa Vadeli"],  # dashboard sends 'Serbest (K.Vade)'
-        "Serbest (Katılım)": ["Serbest", "Katılım"]
-    }
+    # Concurrency cap plus token bucket in front of the TEFAS calls, with retries and a circuit breaker
+    if on_result is not None:
+        for code, res in covered.items():
+            on_result(code, res)
+    def fetch(code):
+        if shared(code):
+            return fetch_fund_history(code, store, metadata, cache, since)
+        return _fetch_fund_history(code, store, metadata, cache, since)
+    fetched = fetch_many([code for code in fund_codes if code not in covered], fetch,
+                         concurrency=concurrency, rate=rate, on_result=on_result, checkpoint=checkpoint, deadline=deadline, reduce=reduce)
+    fetched.update(covered)
+    stale = {}
+    if deadline is not None:
+        # Funds cut off by the deadline (or failed) are served from their last cached rows and flagged stale
+        stale = {code: reduce(res) for code, res in cached_histories([code for code in fund_codes if code not in fetched], store, metadata, periods, snapshot_path).items()}
+        if stale:
+            logging.warning(f"Deadline: {len(stale)} funds filled in from cached rows")
+        fetched.update(stale)
+    missing = [code for code in fund_codes if code not in fetched]
+    # Universe order, not completion order: leaderboard ties and percentile ranks follow the panel rows
+    histories = {}
+    names = {}
+    for code in fund_codes:
+        res = fetched.get(code)
+        if res:
+            names[code], histories[code] = res
+    return names, histories, set(stale), missing
+
+def fetch_universe(store=None, *, concurrency=FETCH_CONCURRENCY, rate=FETCH_RATE, resume=True, metadata=None, on_result=None, cache=None, since=None, deadline=None, fund_types=("YAT",), periods=None, keep=None,
+                   snapshot_path=None, checkpoint_dir=None):
+    # The universe comes from the metadata cache; screen_funds only runs when it is missing or stale.
+    # Several fund types (YAT + EMK) are screened as one universe in one panel.
+    metadata = metadata or MetadataCache(active_provider().screen_funds).load()
+    funds = {}
+    for fund_type in fund_types:
+        funds.update(metadata.universe(fund_type))
+    fund_codes_all = list(funds)
+    code_to_type = {code: info['fund_type'] for code, info in funds.items()}
     
-    all_cats = sorted(cat_to_keywords.keys(), key=len, reverse=True)
-    df_yat = bp.screen_funds(fund_type="YAT", limit=5000)
-    df_yat = pd.DataFrame(df_yat)
-    fund_codes_all = df_yat['fund_code'].tolist()
-    code_to_type = dict(zip(df_yat['fund_code'], df_yat['fund_type']))
+    since = since or history_since()
+    def restore(code, payload):
+        fetched = decode_fetched(code, payload, store)
+        if cache is not None and (keep is None or code in keep):
+            cache.put('history', code, fetched)
+        return fetched
+    checkpoint = Checkpoint(universe_checkpoint_path(since, fund_types, checkpoint_dir=checkpoint_dir), encode_fetched, restore)
+    if not resume:
+        checkpoint.clear()
     
-    results_all = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-        future_to_code = {executor.submit(get_fund_flow, code, period_type): code for code in fund_codes_all}
-        for i, future in enumerate(concurrent.futures.as_completed(future_to_code)):
-            try:
-                res = future.result()
-                if res: results_all.append(res)
-                time.sleep(0.05)
-            except: pass
-            if (i+1) % 100 == 0: logging.info(f"Processed {i+1}/{len(fund_codes_all)} funds...")
-                
-    # Filter for Leaders
-    results_filtered = []
-    if selected_cats:
-        for r in results_all:
-            ftype = str(code_to_type.get(r['fund_code'], ''))
-            fname_n = normalize(r['name'])
-            effective_cat = ""
-            if "Serbest" in ftype:
-                # Map to dashboard checkbox values
-                if any(x in fname_n for x in ["para piyasasi", "p.piy"]): effective_cat = "Serbest (P.Piy)"
-                elif any(x in fname_n for x in ["doviz", "yabanci", "eurobond"]): effective_cat = "Serbest (Döviz)"
-                elif any(x in fname_n for x in ["kisa vadeli", "k.vade"]): effective_cat = "Serbest (K.Vade)"
-                elif "katilim" in fname_n: effective_cat = "Serbest (Katılım)"
-                else: effective_cat = "Serbest (Genel)"  # FIX: was 'Serbest', dashboard sends 'Serbest (Genel)'
-            elif any(x in ftype for x in ["Kıymetli Maden", "Altın", "Gümüş"]):
-                effective_cat = "K.Maden"  # FIX: was 'Kıymetli Madenler', dashboard sends 'K.Maden'
-            elif "Para Piyasası" in ftype:
-                effective_cat = "Para Piy."  # FIX: was 'Para Piyasası', dashboard sends 'Para Piy.'
-            else:
-                for cat_name in all_cats:
-                    if cat_name in ftype:
-                        effective_cat = cat_name
-                        break
-            if effective_cat in selected_cats: results_filtered.append(r)
+    callback = on_result(code_to_type) if on_result else None
+    names, histories, stale, missing = fetch_histories(fund_codes_all, store, concurrency=concurrency, rate=rate, metadata=metadata, on_result=callback,
+                                                       cache=cache, since=since, deadline=deadline, checkpoint=checkpoint, periods=periods, keep=keep,
+                                                       snapshot_path=snapshot_path)
+    metadata.save_if_dirty()
+    
+    # Align every fetched history into one funds x dates panel and compute all metrics at once
+    if store is not None:
+        logging.info(f"History store: merged new rows for {store.flush()} funds")
+        store.save()
+        panel = FlowPanel.from_store(store, list(histories), start=since)
+    elif any(isinstance(df, FundDigest) for df in histories.values()):
+        panel = FlowPanel.from_digests(histories, list(periods))
     else:
-        results_filtered = [r for r in results_all if not any(x in normalize(r['name']) for x in ["para piyasasi", "p.piy", "doviz", "yabanci"])]
+        panel = FlowPanel.from_histories(histories)
+    del histories
+    checkpoint.clear()
+    
+    # Classify every fund once; later category selections only re-mask this index
+    panel.category, panel.default_excluded = build_category_index(panel.codes, code_to_type, names)
+    if deadline is not None:
+        panel.stale = np.array([code in stale for code in panel.codes], dtype=bool)
+        panel.missing = missing
+    panel.save(snapshot_path or SNAPSHOT_PATH, created_at=datetime.now().isoformat(timespec="seconds"), since=since.isoformat(timespec="seconds"),
+               names=names, code_to_type=code_to_type, fund_types=list(fund_types))
+    return panel, names, code_to_type
+
+def live_leaderboards(period_type, selected_cats=None, sort_mode='tl', on_snapshot=None, every=250, universe="YAT"):
+    # Returns an on_result factory for fetch_universe: each fetched fund is scored and pushed into the
+    # top-k heaps right away, and on_snapshot(preview) fires every `every` funds with provisional leaders
+    acc = LeaderboardAccumulator(sort_mode)
     
-    # Investor Count Filter: Exclude funds with fewer than 500 investors from Leaderboards
-    # These are usually closed/institutional funds not available for general TEFAS trading
-    results_filtered = [r for r in results_filtered if r.get('investors', 0) >= 500]
+    def factory(code_to_type):
+        seen = 0
+        
+        def on_result(code, res):
+            nonlocal seen
+            seen += 1
+            if res:
+                name, df = res
+                panel = FlowPanel.from_digests({code: df}) if isinstance(df, FundDigest) else FlowPanel.from_histories({code: df})
+                flows = compute_flows(panel, period_type)
+                quality = panel.quality_index().check(flows['latest_idx'], flows['prev_idx'])
+                category, default_excluded = build_category_index([code], code_to_type, {code: name})
+                mask = flows['valid'] & category_mask(category, default_excluded, selected_cats) & universe_mask(category, universe) & eligible(quality)
+                for r in flow_records(panel, flows, {code: name}, mask):
+                    acc.add(r)
+            if on_snapshot is not None and seen % every == 0:
+                preview = acc.snapshot()
+                preview['funds_processed'] = seen
+                on_snapshot(preview)
+        return on_result
+    return factory
+
+def write_preview(path, period_type, sort_mode):
+    def on_snapshot(preview):
+        preview.update({'date': datetime.now().strftime("%Y-%m-%d"), 'period_type': period_type, 'sort_mode': sort_mode, 'provisional': True})
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(preview, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        logging.info(f"Preview: {preview['funds_processed']} funds processed, leaders written to {path}")
+    return on_snapshot
+
+def load_universe_snapshot(max_age_minutes, path=None, since=None, fund_types=("YAT",), periods=None):
+    # Re-filtering (categories, sort, period) reuses the last scan instead of rescreening,
+    # as long as it reaches back to `since`, screened every fund type asked for and, if it was built
+    # from fund digests, holds the anchor rows of every period asked for
+    path = path or SNAPSHOT_PATH
+    if not os.path.exists(path):
+        return None
+    panel, meta = FlowPanel.load(path)
+    age = datetime.now() - datetime.fromisoformat(meta['created_at'])
+    if age > timedelta(minutes=max_age_minutes):
+        return None
+    if since is not None and datetime.fromisoformat(meta.get('since', meta['created_at'])).date() > since.date():
+        logging.info("Universe snapshot does not cover the requested lookback; rescanning")
+        return None
+    if not set(fund_types) <= set(meta.get('fund_types', ["YAT"])):
+        logging.info(f"Universe snapshot does not include {', '.join(fund_types)} funds; rescanning")
+        return None
+    if panel.periods is not None and not (periods and set(periods) <= set(panel.periods)):
+        logging.info(f"Universe snapshot only holds the rows of {', '.join(panel.periods)} periods; rescanning")
+        return None
+    logging.info(f"Using universe snapshot from {meta['created_at']} ({len(panel)} funds)")
+    return panel, meta['names'], meta['code_to_type']
+
+def mark_stale(records, last_dates):
+    # Leaderboard rows of cache-filled funds carry the date of the row they show
+    for rec in records:
+        if rec.get('fund_code') in last_dates:
+            rec['stale'] = True
+            rec['last_date'] = last_dates[rec['fund_code']]
+    return records
+
+def lagging_funds(store, codes=None):
+    # Stored funds whose latest published price is behind the newest one in the universe (but not dormant)
+    published = store.published_dates()
+    codes = list(published) if codes is None else [code for code in codes if code in published]
+    if not codes:
+        return [], None
+    newest = max(published[code] for code in codes)
+    oldest = newest - np.timedelta64(PUBLISH_LAG_DAYS, "D")
+    return [code for code in codes if oldest <= published[code] < newest], newest
+
+def refresh_lagging(store, metadata=None, *, concurrency=FETCH_CONCURRENCY, rate=FETCH_RATE, cache=None, since=None, fund_types=("YAT",), snapshot_path=None):
+    # Follow-up to today's universe scan: re-pulls only funds that had not published the newest day yet
+    # and updates their rows in the scan's snapshot. None when there is no scan from today to update.
+    midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    universe = load_universe_snapshot((datetime.now() - midnight).total_seconds() / 60, snapshot_path, since, fund_types)
+    if universe is None:
+        logging.info("No universe scan from today to refresh; running a full scan")
+        return None
+    panel, names, code_to_type = universe
+    lagging, newest = lagging_funds(store, panel.codes)
+    logging.info(f"{len(lagging)} of {len(panel)} funds have not published {newest} yet; refreshing only those")
+    since = since or history_since()
+    # Only which funds came back matters here; their rows are read back from the store
+    fetched = fetch_many(lagging, lambda code: fetch_history(get_fund(code, cache), code, store, since), concurrency=concurrency, rate=rate,
+                         reduce=lambda df: None)
+    store.flush()
+    store.save()
+    caught_up = [code for code in lagging if (store.published_date(code) or pd.Timestamp(0)) >= pd.Timestamp(newest)]
+    panel.refresh_rows(store, list(fetched), start=since)
+    logging.info(f"{len(caught_up)} lagging funds published since the last run, {len(lagging) - len(caught_up)} still pending")
+    panel.save(snapshot_path or SNAPSHOT_PATH, created_at=datetime.now().isoformat(timespec="seconds"), since=since.isoformat(timespec="seconds"),
+               names=names, code_to_type=code_to_type, fund_types=list(fund_types))
+    return panel, names, code_to_type
+
+def category_sums(types, net_flow, fund_size):
+    # Per-category [net flow, fund size] in first-seen order like the old dict, summed in row order
+    ids, labels = pd.factorize(pd.Series(types, dtype=object))
+    net = np.bincount(ids, weights=net_flow, minlength=len(labels))
+    size = np.bincount(ids, weights=fund_size, minlength=len(labels))
+    return {label: [net[i], size[i]] for i, label in enumerate(labels)}
+
+def flow_partial(panel, names, code_to_type, period_type, selected_cats=None, *, date_range=None, universe="YAT"):
+    # The per-fund half of build_flow_report: the leaderboard-eligible results plus each fund's category,
+    # net flow and size. Partials of disjoint fund sets (e.g. screening shards) combine with merge_partials();
+    # categories are only summed after the merge, so a sharded report adds the same floats in the same order.
+    # date_range=(start, end) answers any window from the panel's prefix sums instead of a preset period
+    flows = range_flows(panel, *date_range) if date_range else compute_flows(panel, period_type)
+    if panel.category is None:
+        panel.category, panel.default_excluded = build_category_index(panel.codes, code_to_type, names)
+    in_view = flows['valid'] & universe_mask(panel.category, universe)
+    results_all = FlowResults.from_flows(panel, flows, names, in_view)
     
-    # SORT LEADERS
-    sort_key = 'net_flow' if sort_mode == 'tl' else 'flow_pct'
+    # Filter for Leaders: category checkboxes are one mask over the index built at universe load
+    pool = in_view & category_mask(panel.category, panel.default_excluded, selected_cats)
     
-    # Filter for positive and negative flows separately
-    inflows_only = [r for r in results_filtered if r[sort_key] > 0]
-    outflows_only = [r for r in results_filtered if r[sort_key] < 0]
+    # Data-quality codes for the period: unpublished or stale prices, share jumps, missing or too few
+    # investors (closed/institutional funds) keep a fund off the leaderboards
+    quality = panel.quality_index().check(flows['latest_idx'], flows['prev_idx'])
+    leader_mask = pool & eligible(quality)
     
-    inflows_only.sort(key=lambda x: x[sort_key], reverse=True)
-    outflows_only.sort(key=lambda x: x[sort_key], reverse=False) # Most negative first
+    # Cache-filled funds (fetch deadline): their last rows, to be cut against the newest day at report time
+    stale = panel.stale if panel.stale is not None else np.zeros(len(panel), dtype=bool)
+    last_date = panel.dates[np.maximum(flows['latest_idx'], 0)] if len(panel.dates) else np.zeros(len(panel), dtype="datetime64[D]")
     
-    top_inflows = inflows_only[:5]
-    top_outflows = outflows_only[:5]
+    # Category flows: group sums over the type of every fund (first-seen order, like the old dict)
+    ftypes = pd.Series(results_all.codes, dtype=object).map(code_to_type).fillna('Diğer').str.replace("Şemsiye Fonu", "").str.strip()
+    # Pension funds share a generic TEFAS type, so they are grouped by their BES category instead
+    view_category = panel.category[in_view]
+    ftypes = ftypes.where(view_category < FIRST_PENSION_ID, pd.Series(category_label(view_category), dtype=object))
     
-    # INVESTOR LEADERS
-    # Filter for positive changes for 'in' and negative for 'out'
-    # Use results_filtered so category filters apply to investor leaders too
-    inv_pos = [r for r in results_filtered if r['inv_change'] > 0]
-    inv_neg = [r for r in results_filtered if r['inv_change'] < 0]
+    coverage = None
+    if panel.stale is not None:
+        coverage = {
+            'funds': int(flows['valid'].sum()),
+            'fresh': int((flows['valid'] & ~stale).sum()),
+            'missing': len(panel.missing),
+        }
+    return {
+        'results': results_all.take(leader_mask[in_view]),
+        'categories': {'type': ftypes.to_numpy(dtype=object), 'net_flow': results_all.net_flow, 'fund_size': results_all.fund_size},
+        'stale_last': {panel.codes[i]: last_date[i] for i in np.flatnonzero(stale & flows['valid'])},
+        'newest': panel.dates.max(initial=np.datetime64(0, "D")),
+        'coverage': coverage,
+        'quality': {panel.codes[i]: int(quality[i]) for i in np.flatnonzero(pool & (quality != 0))},
+    }
+
+def merge_partials(partials):
+    # Partials in universe order -> one: eligible results and per-fund category rows concatenated
+    categories = {key: np.concatenate([partial['categories'][key] for partial in partials]) for key in ('type', 'net_flow', 'fund_size')}
+    coverages = [partial['coverage'] for partial in partials if partial['coverage'] is not None]
+    return {
+        'results': FlowResults.concat([partial['results'] for partial in partials]),
+        'categories': categories,
+        'stale_last': {code: day for partial in partials for code, day in partial['stale_last'].items()},
+        'newest': max((partial['newest'] for partial in partials), default=np.datetime64(0, "D")),
+        'coverage': {key: sum(c[key] for c in coverages) for key in coverages[0]} if coverages else None,
+        'quality': {code: bits for partial in partials for code, bits in partial['quality'].items()},
+    }
+
+def build_flow_report(panel, names, code_to_type, period_type, selected_cats=None, sort_mode='tl', *, date_range=None, signal_weights=None, max_stale_days=None,
+                      universe="YAT"):
+    # universe: the YAT or EMK (pension) funds of the panel, or ALL for the combined view
+    partial = flow_partial(panel, names, code_to_type, period_type, selected_cats, date_range=date_range, universe=universe)
+    return report_from_partial(partial, selected_cats, sort_mode, signal_weights=signal_weights, max_stale_days=max_stale_days, universe=universe)
+
+def report_from_partial(partial, selected_cats=None, sort_mode='tl', *, signal_weights=None, max_stale_days=None, universe="YAT"):
+    # The ranking half of build_flow_report, over one (possibly merged) partial
+    all_cats = ALL_CATS if universe == "YAT" else list(PENSION_CAT_TO_KEYWORDS) if universe == "EMK" else ALL_CATS + list(PENSION_CAT_TO_KEYWORDS)
+    if signal_weights is None:
+        signal_weights = load_signal_weights()
+    results_filtered = partial['results']
     
-    inv_pos.sort(key=lambda x: x['inv_change'], reverse=True)
-    inv_neg.sort(key=lambda x: x['inv_change'], reverse=False)
+    # Cache-filled funds are kept only while their last row is recent enough
+    max_stale_days = STALE_MAX_DAYS if max_stale_days is None else max_stale_days
+    too_old = {code for code, day in partial['stale_last'].items() if partial['newest'] - day > np.timedelta64(max_stale_days, "D")}
+    if too_old:
+        results_filtered = results_filtered.take(~np.isin(results_filtered.codes, list(too_old)))
+    stale_dates = {code: str(day) for code, day in partial['stale_last'].items() if code not in too_old}
     
-    top_inv_in = inv_pos[:5]
-    top_inv_out = inv_neg[:5]
-
-    # TOP GAINERS / LOSERS (price-based return)
-    # Filter out funds with -100% return (price is 0, fund hasn't published today's price yet)
-    valid_returns = [r for r in results_filtered if r.get('return_pct', 0) != -100]
-    gainers = sorted([r for r in valid_returns if r.get('return_pct', 0) > 0], key=lambda x: x['return_pct'], reverse=True)
-    losers = sorted([r for r in valid_returns if r.get('return_pct', 0) < 0], key=lambda x: x['return_pct'])
-    top_gainers = gainers[:5]
-    top_losers = losers[:5]
-    divergent_signals = build_divergent_signals(results_filtered)
-    momentum_scores = build_momentum_scores(results_filtered)
-    crowding_signals = build_crowding_signals(results_filtered)
-
-    # Category flows
-    cat_flows = {}
-    for res in results_all:
-        code = res['fund_code']
-        ftype = code_to_type.get(code, 'Diğer').replace("Şemsiye Fonu", "").strip()
-        if ftype not in cat_flows:
-            cat_flows[ftype] = {'fund_code': ftype, 'name': '', 'net_flow': 0, 'fund_size': 0}
-        cat_flows[ftype]['net_flow'] += res.get('net_flow', 0)
-        cat_flows[ftype]['fund_size'] += res.get('fund_size', 0)
-        
-    for k, v in cat_flows.items():
-        v['flow_pct'] = (v['net_flow'] / v['fund_size']) * 100 if v['fund_size'] > 0 else 0
-        
-    cat_list = list(cat_flows.values())
+    # LEADERS: top-k selections over the result columns (inflows/outflows, investor in/out, gainers/losers)
+    # Use results_filtered so category filters apply to investor leaders too
+    leaders = rank_leaderboards(results_filtered, sort_mode)
+    top_inflows, top_outflows = leaders['top_inflows'], leaders['top_outflows']
+    top_inv_in, top_inv_out = leaders['top_inv_in'], leaders['top_inv_out']
+    top_gainers, top_losers = leaders['top_gainers'], leaders['top_losers']
+    # SIGNALS: divergence, momentum and crowding scored in one vectorized pass, then formatted
+    signals = compute_signals(results_filtered, signal_weights.get('momentum'), signal_weights.get('divergence'))
+    divergent_signals = build_divergent_signals(results_filtered, signals)
+    momentum_scores = build_momentum_scores(results_filtered, signals)
+    crowding_signals = build_crowding_signals(results_filtered, signals)
+
+    cat_list = []
+    categories = partial['categories']
+    for ftype, (net, size) in category_sums(categories['type'], categories['net_flow'], categories['fund_size']).items():
+        net, size = float(net), float(size)
+        cat_list.append({
+            'fund_code': ftype,
+            'name': '',
+            'net_flow': net,
+            'fund_size': size,
+            'flow_pct': float(net / size * 100) if size > 0 else 0
+        })
     cat_list_in = sorted([c for c in cat_list if c['net_flow'] > 0], key=lambda x: x['net_flow'], reverse=True)[:5]
     cat_list_out = sorted([c for c in cat_list if c['net_flow'] < 0], key=lambda x: x['net_flow'])[:5]
     category_rotation = build_category_rotation(cat_list)
     
+    if stale_dates:
+        for records in (top_inflows, top_outflows, top_inv_in, top_inv_out, top_gainers, top_losers, divergent_signals, momentum_scores, crowding_signals):
+            mark_stale(records, stale_dates)
+    coverage = None
+    if partial['coverage'] is not None:
+        coverage = {
+            'funds': partial['coverage']['funds'],
+            'fresh': partial['coverage']['fresh'],
+            'stale': len(stale_dates),
+            'missing': partial['coverage']['missing'],
+            'excluded_stale': len(too_old),
+            'max_stale_days': max_stale_days,
+            'stale_funds': stale_dates,
+        }
+    
     # Footer
     if selected_cats:
         excl = [cat for cat in all_cats if cat not in selected_cats]
         footer_detail = f"{', '.join(excl)} kategorileri hariç tutulmuştur." if excl else "Tüm ana kategoriler dahil edilmiştir."
-    else:
+    elif universe == "YAT":
         footer_detail = "Para Piyasası ve Döviz fonları hariç tutulmuştur."
-    footer_note = f"* Veriler TEFAS üzerinden alınmıştır. {footer_detail}"
+    else:
+        footer_detail = "Para Piyasası, Döviz, Katkı ve OKS fonları hariç tutulmuştur."
+    scope = {"YAT": "", "EMK": " (emeklilik fonları)", ALL: " (yatırım ve emeklilik fonları birlikte)"}[universe]
+    footer_note = f"* Veriler TEFAS üzerinden alınmıştır{scope}. {footer_detail}"
+    if coverage is not None:
+        footer_note += f" Kapsam: {coverage['fresh']}/{coverage['funds'] + coverage['missing']} fon güncel"
+        if coverage['stale']:
+            footer_note += f", {coverage['stale']} fon son bilinen verilerle gösterilmiştir"
+        if coverage['excluded_stale']:
+            footer_note += f", {coverage['excluded_stale']} fon verisi {coverage['max_stale_days']} günden eski olduğu için sıralamalara alınmamıştır"
+        if coverage['missing']:
+            footer_note += f", {coverage['missing']} fon zamanında alınamamıştır"
+        footer_note += "."
     
-    return top_inflows, top_outflows, cat_list_in, cat_list_out, top_inv_in, top_inv_out, top_gainers, top_losers, divergent_signals, momentum_scores, crowding_signals, category_rotation, footer_note
+    return FlowReport(top_inflows, top_outflows, cat_list_in, cat_list_out, top_inv_in, top_inv_out, top_gainers, top_losers, divergent_signals,
+                      momentum_scores, crowding_signals, category_rotation, footer_note, coverage, quality_summary(partial['quality']))
 
-def fetch_tracked_funds(tracked_codes, period_type):
-    tracked_data = {}
+def fetch_all_flows(period_type, selected_cats=None, sort_mode='tl', *, store=None, concurrency=FETCH_CONCURRENCY, rate=FETCH_RATE, resume=True, metadata=None, on_result=None,
+                    cache=None, date_range=None, deadline=None, universe="YAT", keep=None, max_stale_days=None, snapshot_path=None, checkpoint_dir=None):
+    logging.info(f"Screening {universe} funds for {period_type} period (Sort: {sort_mode})...")
+    since = history_since([period_type], date_range[0] if date_range else None)
+    panel, names, code_to_type = fetch_universe(store, concurrency=concurrency, rate=rate, resume=resume, metadata=metadata, on_result=on_result, cache=cache,
+                                                since=since, deadline=deadline, fund_types=universe_fund_types([universe]), periods=[period_type], keep=keep,
+                                                snapshot_path=snapshot_path, checkpoint_dir=checkpoint_dir)
+    return build_flow_report(panel, names, code_to_type, period_type, selected_cats, sort_mode, date_range=date_range, max_stale_days=max_stale_days,
+                             universe=universe)
+
+def fetch_all_periods(periods, selected_cats=None, sort_mode='tl', *, store=None, concurrency=FETCH_CONCURRENCY, rate=FETCH_RATE, resume=True, metadata=None, on_result=None,
+                      cache=None, date_range=None, deadline=None, views=("YAT",), keep=None, max_stale_days=None, snapshot_path=None, checkpoint_dir=None):
+    # One universe scan serves every period and view: the panel reaches back as far as the longest period
+    # needs and holds every fund type the views cover. Reports are keyed by (period, view).
+    logging.info(f"Screening {', '.join(views)} funds for {', '.join(periods)} periods (Sort: {sort_mode})...")
+    since = history_since(periods, date_range[0] if date_range else None)
+    panel, names, code_to_type = fetch_universe(store, concurrency=concurrency, rate=rate, resume=resume, metadata=metadata, on_result=on_result, cache=cache,
+                                                since=since, deadline=deadline, fund_types=universe_fund_types(views), periods=periods, keep=keep,
+                                                snapshot_path=snapshot_path, checkpoint_dir=checkpoint_dir)
+    return {(period, view): build_flow_report(panel, names, code_to_type, period, selected_cats, sort_mode, date_range=date_range if period == "custom" else None,
+                                              max_stale_days=max_stale_days, universe=view)
+            for period in periods for view in views}
+
+def fetch_tracked_histories(tracked_codes, store=None, metadata=None, cache=None, since=None):
+    tracked_histories = {}
     for code in tracked_codes:
         try:
-            fund = bp.Fund(code)
-            df = fund.history(period="3mo")
-            if df.empty or len(df) < 2: continue
+            fetched = fetch_fund_history(code, store, metadata, cache, since)
+            if fetched is None: continue
+            tracked_histories[code] = fetched
+        except Exception as e:
+            logging.error(f"Error fetching tracked fund {code}: {e}")
+    return tracked_histories
+
+def build_tracked_funds(tracked_histories, period_type, date_range=None):
+    tracked_data = {}
+    for code, (name, df) in tracked_histories.items():
+        try:
+            df = df.copy() if date_range is None or date_range[1] is None else df[df.index <= pd.Timestamp(date_range[1])].copy()
             shares_col = 'Shares' if 'Shares' in df.columns else 'Tedavüldeki Pay Sayısı' if 'Tedavüldeki Pay Sayısı' in df.columns else None
             if shares_col is None:
                 df['Shares'] = df['FundSize'] / df['Price']
                 shares_col = 'Shares'
             latest = df.iloc[-1]
-            prev = get_prev_row(df, period_type)
+            prev = get_prev_row(df, period_type, date_range[0] if date_range else None)
             flow = (latest[shares_col] - prev[shares_col]) * latest['Price']
             flow_pct = (flow / prev['FundSize']) * 100 if prev['FundSize'] > 0 else 0
             inv_change = latest['Investors'] - prev['Investors']
@@ -450,7 +784,7 @@ def fetch_tracked_funds(tracked_codes, period_type):
                 })
             
             tracked_data[code] = {
-                'fund_code': code, 'name': fund.info.get('name', ''), 'price': float(latest['Price']),
+                'fund_code': code, 'name': name, 'price': float(latest['Price']),
                 'fund_size': float(latest['FundSize']), 'investors': int(latest['Investors']),
                 'period_flow': float(flow), 'period_flow_pct': float(flow_pct),
                 'period_investor_change': int(inv_change), 'period_investor_pct': float(inv_change_pct),
@@ -460,126 +794,316 @@ def fetch_tracked_funds(tracked_codes, period_type):
         except: pass
     return tracked_data
 
+def fetch_tracked_funds(tracked_codes, period_type, store=None, metadata=None, cache=None):
+    since = history_since([period_type])
+    tracked_histories = fetch_tracked_histories(tracked_codes, store, metadata, cache, since)
+    if store is not None:
+        store.flush()
+        tracked_histories = {code: (name, store.frame(code, start=since)) for code, (name, _) in tracked_histories.items()}
+    return build_tracked_funds(tracked_histories, period_type)
 
-def fetch_allocation_diff(fund_code):
-    try:
-        fund = bp.Fund(fund_code)
-        df = fund.allocation_history(period="1mo")
-        df['Date'] = pd.to_datetime(df['Date'])
-        dates = sorted(df['Date'].unique(), reverse=True)
-        
-        if len(dates) < 2:
+
+def fetch_allocation_history(fund_code, last=None, cache=None):
+    # Long allocation rows (Date, fund_code, asset_name, weight); only dates after `last`, the fund's last
+    # stored date (AllocationStore.last_dates()), when given
+    fund = get_fund(fund_code, cache)
+    if last is not None:
+        start = pd.Timestamp(last) + timedelta(days=1)
+        if start.date() > datetime.now().date():
             return None
-            
-        latest_date = dates[0]
-        prev_date = dates[1]
-        
-        df_latest = df[df['Date'] == latest_date].copy()
-        df_prev = df[df['Date'] == prev_date].copy()
-        
-        merged = pd.merge(df_latest, df_prev, on='asset_name', how='outer', suffixes=('_latest', '_prev'))
-        merged['weight_latest'] = merged['weight_latest'].fillna(0)
-        merged['weight_prev'] = merged['weight_prev'].fillna(0)
-        merged['diff'] = merged['weight_latest'] - merged['weight_prev']
-        
-        merged = merged.sort_values(by='weight_latest', ascending=False)
-        
-        TEFAS_ORIGINAL_NAMES = {
-            "Yabancı Yatırım Fonu": "Yatırım Fonları Katılma Payları",
-            "BPP": "Borsa İstanbul Para Piyasası",
-            "Ters Repo Para Piyasası": "Takasbank Para Piyasası",
-            "Varlık İpotek Tahvil": "Vadeli İşlemler Nakit Teminatları",
-            "Borsa Yatırım Fonu": "Borsa Yatırım Fonları Katılma Payları",
-            "Vadesiz Mevduat Türk Lirası": "Mevduat (TL)",
-            "Vadeli Mevduat": "Mevduat (TL)",
-            "Hisse Senedi": "Hisse Senedi",
-            "Ters Repo": "Ters Repo",
-            "Devlet Tahvili": "Devlet Tahvili",
-            "Girişim Sermayesi Yatırım Katılma Belgesi": "Girişim Sermayesi Yatırım Fonu",
-            "Gayrimenkul Yatırım Katılma Belgesi": "Gayrimenkul Yatırım Fonu",
-            "Kamu Dış Borçlanma Aracı": "Kamu Dış Borçlanma Araçları",
-            "Varlığa Dayalı Menkul Kıymet": "Varlığa Dayalı Menkul Kıymet"
-        }
-        
-        diff_list = []
-        for _, row in merged.iterrows():
-            if row['weight_latest'] == 0 and row['diff'] == 0:
-                continue
-            
-            raw_asset_name = row['asset_name']
-            mapped_name = TEFAS_ORIGINAL_NAMES.get(raw_asset_name, raw_asset_name)
-            
-            # Special Override for TLY: TEFAS reports "Vadeli Mevduat" under asset name but it is actually VDMK.
-            if fund_code == 'TLY' and raw_asset_name == 'Vadeli Mevduat':
-                mapped_name = "Varlığa Dayalı Menkul Kıymet"
-            
-            
-            diff_list.append({
-                'asset': mapped_name,
-                'weight': float(row['weight_latest']),
-                'diff': float(row['diff'])
-            })
-            
-        return {
-            'fund_code': fund_code,
-            'latest_date': latest_date.strftime('%Y-%m-%d'),
-            'prev_date': prev_date.strftime('%Y-%m-%d'),
-            'allocations': diff_list
-        }
+        fetch = lambda: fund.allocation_history(start=start)
+    else:
+        fetch = lambda: fund.allocation_history(period="1mo")
+    df = cache.get_or_fetch('allocation', fund_code, fetch) if cache is not None else fetch()
+    if df is None or df.empty:
+        return None
+    df = df[['Date', 'asset_name', 'weight']].copy()
+    df['fund_code'] = fund_code
+    return df
+
+def fetch_allocation_diff(fund_code, cache=None, alloc_store=None, last_dates=None):
+    # Latest vs previous allocation snapshot; a throwaway in-memory store when no persistent one is given.
+    # last_dates: alloc_store.last_dates(), taken once by callers diffing many funds
+    try:
+        alloc_store = alloc_store if alloc_store is not None else AllocationStore(root=None)
+        last_dates = alloc_store.last_dates() if last_dates is None else last_dates
+        alloc_store.ingest(fetch_allocation_history(fund_code, last_dates.get(fund_code), cache))
+        return alloc_store.fund_allocation_diff(fund_code)
     except Exception as e:
         logging.error(f"Error fetching allocation diff for {fund_code}: {e}")
         return None
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("period", choices=["daily", "weekly", "monthly"], default="daily", nargs="?")
-    parser.add_argument("tracked", default="TLY, DFI, PHE", nargs="?")
-    parser.add_argument("cats", default="", nargs="?")
-    parser.add_argument("--sort", choices=["tl", "pct"], default="tl")
-    args = parser.parse_args()
-    
-    selected_cats = [c.strip() for c in args.cats.split(",") if c.strip()]
-    raw_tracked = args.tracked.split(",")
-    tracked_codes = [code.strip().upper() for code in raw_tracked if code.strip()]
-    if not tracked_codes: tracked_codes = ['TLY', 'DFI', 'PHE']
-        
-    tracked_data = fetch_tracked_funds(tracked_codes, args.period)
-    top_inflows, top_outflows, top_cat_in, top_cat_out, top_inv_in, top_inv_out, top_gainers, top_losers, divergent_signals, momentum_scores, crowding_signals, category_rotation, footer_note = fetch_all_flows(args.period, selected_cats, args.sort)
+def fetch_universe_allocations(fund_codes, alloc_store, concurrency=FETCH_CONCURRENCY, rate=FETCH_RATE, cache=None):
+    # Every fund's new allocation rows go through the same rate-limited pipeline as histories, then one batch ingest
+    last_dates = alloc_store.last_dates()
+    fetched = fetch_many(fund_codes, lambda code: fetch_allocation_history(code, last_dates.get(code), cache), concurrency=concurrency, rate=rate)
+    frames = [df for df in fetched.values() if df is not None]
+    if frames:
+        logging.info(f"Allocation store: new rows for {alloc_store.ingest(pd.concat(frames, ignore_index=True))} fund-days")
+        alloc_store.save()
+    return alloc_store
+
+def build_allocation_rotation(alloc_store, names=None, n=5, holdings=None):
+    # Universe-wide manager actions: who moved into risk assets, who turned defensive, top adders per asset class.
+    # With holdings, fund-of-funds are scored on their look-through exposure.
+    names = names or {}
+    diff = effective_diff(alloc_store, holdings) if holdings else alloc_store.diff()
+    rotation = alloc_store.rotation(diff=diff)
+    def entries(mask, key, reverse):
+        idx = np.flatnonzero(mask)
+        idx = idx[np.argsort(rotation[key][idx], kind="stable")]
+        if reverse:
+            idx = idx[::-1]
+        return [{
+            'fund_code': alloc_store.codes[i],
+            'name': names.get(alloc_store.codes[i], ''),
+            'risk_delta': round(float(rotation['risk_delta'][i]), 2),
+            'defensive_delta': round(float(rotation['defensive_delta'][i]), 2)
+        } for i in idx[:n]]
+
+    top_adders = {}
+    for asset in alloc_store.assets:
+        adders = alloc_store.top_changes(asset, n=n, diff=diff)
+        if adders:
+            for a in adders:
+                a['name'] = names.get(a['fund_code'], '')
+                a['diff'] = round(a['diff'], 2)
+            top_adders[asset] = adders
+    return {
+        'funds_compared': rotation['funds_compared'],
+        'risk_on': entries(rotation['risk_on'], 'risk_delta', True),
+        'defensive': entries(rotation['defensive'], 'defensive_delta', True),
+        'risk_on_count': int(rotation['risk_on'].sum()),
+        'defensive_count': int(rotation['defensive'].sum()),
+        'top_adders': top_adders
+    }
+
+def add_look_through(allocation_diffs, alloc_store, holdings):
+    # Adds each tracked fund's effective (look-through) allocation next to its reported one
+    delta, effective, has_both = effective_diff(alloc_store, holdings)
+    for code, item in allocation_diffs.items():
+        row = alloc_store.codes.index(code) if code in alloc_store.codes else None
+        if row is None or not has_both[row]:
+            continue
+        order = np.argsort(-effective[row], kind="stable")
+        item['look_through'] = [
+            {'asset': alloc_store.assets[a], 'weight': round(float(effective[row, a]), 2), 'diff': round(float(delta[row, a]), 2)}
+            for a in order if round(float(effective[row, a]), 2) != 0 or round(float(delta[row, a]), 2) != 0
+        ]
+    return allocation_diffs
+
+def fetch_tracked_and_allocations(tracked_codes, store=None, metadata=None, cache=None, alloc_store=None, since=None):
+    tracked_histories = fetch_tracked_histories(tracked_codes, store, metadata, cache, since)
     
     # Fetch allocation diffs for all tracked funds
     allocation_diffs = {}
+    last_dates = alloc_store.last_dates() if alloc_store is not None else {}
     for code in tracked_codes:
-        diff_data = fetch_allocation_diff(code)
+        diff_data = fetch_allocation_diff(code, cache, alloc_store, last_dates)
         if diff_data:
             allocation_diffs[code] = diff_data
+    return tracked_histories, allocation_diffs
+
+PERIODS = ["daily", "weekly", "monthly", "quarterly", "ytd", "1y", "3y"]
 
+def build_output(period_type, sort_mode, flow_report, tracked_data, allocation_diffs, allocation_rotation=None, date_range=None, universe="YAT"):
     tracked_relative_strength = build_relative_strength(tracked_data)
     manager_actions = build_manager_actions(allocation_diffs, tracked_data)
     
-    output = {
+    return {
         'date': datetime.now().strftime("%Y-%m-%d"),
-        'period_type': args.period,
-        'sort_mode': args.sort,
-        'top_inflows': top_inflows,
-        'top_outflows': top_outflows,
-        'top_cat_in': top_cat_in,
-        'top_cat_out': top_cat_out,
-        'top_inv_in': top_inv_in,
-        'top_inv_out': top_inv_out,
-        'top_gainers': top_gainers,
-        'top_losers': top_losers,
-        'divergent_signals': divergent_signals,
-        'momentum_scores': momentum_scores,
-        'crowding_signals': crowding_signals,
-        'category_rotation': category_rotation,
+        'period_type': period_type,
+        'universe': universe,
+        'date_range': {'start': str(date_range[0]), 'end': str(date_range[1] or datetime.now().strftime("%Y-%m-%d"))} if date_range else None,
+        'sort_mode': sort_mode,
+        'top_inflows': flow_report.top_inflows,
+        'top_outflows': flow_report.top_outflows,
+        'top_cat_in': flow_report.top_cat_in,
+        'top_cat_out': flow_report.top_cat_out,
+        'top_inv_in': flow_report.top_inv_in,
+        'top_inv_out': flow_report.top_inv_out,
+        'top_gainers': flow_report.top_gainers,
+        'top_losers': flow_report.top_losers,
+        'divergent_signals': flow_report.divergent_signals,
+        'momentum_scores': flow_report.momentum_scores,
+        'crowding_signals': flow_report.crowding_signals,
+        'category_rotation': flow_report.category_rotation,
         'tracked': tracked_data,
         'tracked_relative_strength': tracked_relative_strength,
         'allocation_diffs': allocation_diffs,
         'manager_actions': manager_actions,
-        'footer_note': footer_note
+        'allocation_rotation': allocation_rotation,
+        'coverage': flow_report.coverage,
+        'quality': flow_report.quality,
+        'footer_note': flow_report.footer_note
     }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("period", choices=PERIODS + ["all", "custom"], default="daily", nargs="?")
+    parser.add_argument("tracked", default="TLY, DFI, PHE", nargs="?")
+    parser.add_argument("cats", default="", nargs="?")
+    parser.add_argument("--sort", choices=["tl", "pct"], default="tl")
+    parser.add_argument("--no-history", action="store_true", help="Skip the local history store and fetch full histories (3mo, longer for long periods)")
+    parser.add_argument("--concurrency", type=int, default=FETCH_CONCURRENCY, help="Max TEFAS fund fetches in flight")
+    parser.add_argument("--rate", type=float, default=FETCH_RATE, help="Max TEFAS fund fetches started per second")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore today's checkpoint and refetch every fund")
+    parser.add_argument("--refresh-metadata", action="store_true", help="Re-screen the fund universe even if the metadata cache is fresh")
+    parser.add_argument("--snapshot-max-age", type=float, default=0, help="Reuse the last universe scan if it is at most this many minutes old")
+    parser.add_argument("--preview", action="store_true", help="Write provisional leaderboards to data_preview.json while the scan is running")
+    parser.add_argument("--start", help="Range start (YYYY-MM-DD) for the 'custom' period")
+    parser.add_argument("--end", help="Range end (YYYY-MM-DD) for the 'custom' period, defaults to the latest data")
+    parser.add_argument("--allocations", action="store_true", help="Also update every fund's allocation history and add universe-wide manager actions")
+    parser.add_argument("--look-through", action="store_true", help="Resolve fund-of-funds holdings into effective exposures (implies --allocations)")
+    parser.add_argument("--refresh-lagging", action="store_true", help="Only re-pull funds that have not published the newest day yet and update today's scan")
+    parser.add_argument("--deadline", type=float, default=None, help="Finish the universe scan within this many seconds; funds not fetched by then use cached rows")
+    parser.add_argument("--max-stale-days", type=int, default=STALE_MAX_DAYS, help="Cached rows older than this stay out of the leaderboards")
+    parser.add_argument("--universe", default="YAT", help="Comma-separated views: YAT, EMK (pension funds) and/or ALL (both combined)")
+    parser.add_argument("--bulk", action="store_true", help="Refresh every stored fund from TEFAS's date-range endpoint before the per-fund scan")
+    parser.add_argument("--no-bulk", action="store_true", help="Do not bulk-refresh multi-universe runs automatically")
+    parser.add_argument("--bulk-url", default=BULK_HISTORY_URL, help="Bulk history endpoint (e.g. a tefas_bulk.py replay server)")
+    parser.add_argument("--shards", type=int, default=1, help="Split the universe scan over this many worker processes (needs the history store)")
+    parser.add_argument("--shard-dir", help="Spool the shards to this shared directory for `shard_screen.py work` on other machines")
+    parser.add_argument("--provider", choices=list(PROVIDERS), default="borsapy", help="Upstream data source: live TEFAS, the local stores, or the synthetic fixture")
+    parser.add_argument("--synthetic-funds", type=int, default=2000, help="Universe size of the synthetic provider")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every synthetic upstream call takes")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that a synthetic upstream call fails")
+    args = parser.parse_args()
+    started = time.monotonic()
+    
+    if args.provider == "synthetic":
+        set_provider(SyntheticProvider(args.synthetic_funds, args.latency, args.failure_rate))
+    else:
+        set_provider(make_provider(args.provider))
+    # Synthetic runs keep their stores, caches and snapshot under synthetic/ so they never mix with real data
+    sandbox = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic") if args.provider == "synthetic" else None
+    snapshot_path, checkpoint_dir = SNAPSHOT_PATH, CHECKPOINT_DIR
+    if sandbox:
+        os.makedirs(sandbox, exist_ok=True)
+        snapshot_path = os.path.join(sandbox, "universe_snapshot.npz")
+        checkpoint_dir = os.path.join(sandbox, "checkpoints")
+    
+    selected_cats = [c.strip() for c in args.cats.split(",") if c.strip()]
+    raw_tracked = args.tracked.split(",")
+    tracked_codes = [code.strip().upper() for code in raw_tracked if code.strip()]
+    if not tracked_codes: tracked_codes = ['TLY', 'DFI', 'PHE']
+    
+    # 'all' screens the universe once and writes one data_<period>.json per period
+    periods = PERIODS if args.period == "all" else [args.period]
+    date_range = None
+    if args.period == "custom":
+        if not args.start:
+            parser.error("the 'custom' period needs --start")
+        date_range = (args.start, args.end)
+    since = history_since(periods, date_range[0] if date_range else None)
+    views = [v.strip().upper() for v in args.universe.split(",") if v.strip()] or ["YAT"]
+    if any(view not in VIEW_SUFFIXES for view in views):
+        parser.error(f"--universe takes {', '.join(VIEW_SUFFIXES)}")
+    fund_types = universe_fund_types(views)
+    if (args.shards > 1 or args.shard_dir) and args.no_history:
+        parser.error("--shards/--shard-dir need the history store (drop --no-history)")
+    if (args.shards > 1 or args.shard_dir) and args.preview:
+        parser.error("--preview is not available for sharded scans")
+        
+    store = None if args.no_history else (HistoryStore(os.path.join(sandbox, "history")) if sandbox else HistoryStore()).load()
+    alloc_store = None if args.no_history else (AllocationStore(os.path.join(sandbox, "allocations")) if sandbox else AllocationStore()).load()
+    metadata = (MetadataCache(active_provider().screen_funds, path=os.path.join(sandbox, "fund_metadata.json")) if sandbox
+                else MetadataCache(active_provider().screen_funds)).load()
+    if args.refresh_metadata:
+        for fund_type in fund_types:
+            metadata.refresh(fund_type)
+    universe = load_universe_snapshot(args.snapshot_max_age, snapshot_path, since, fund_types, periods) if args.snapshot_max_age else None
+    if args.refresh_lagging and universe is None:
+        if store is None:
+            parser.error("--refresh-lagging needs the history store (drop --no-history)")
+        universe = refresh_lagging(store, metadata, concurrency=args.concurrency, rate=args.rate, since=since, fund_types=fund_types, snapshot_path=snapshot_path)
+    # Screening YAT and EMK per fund would double the fetch load, so live multi-universe runs take the bulk path by default
+    auto_bulk = len(fund_types) > 1 and args.provider == "borsapy" and not args.no_bulk
+    if (args.bulk or auto_bulk) and universe is None and store is not None:
+        # A handful of date-window requests per fund type instead of one history call per fund
+        for fund_type in fund_types:
+            client = BulkHistoryClient(args.bulk_url, fund_type=fund_type)
+            try:
+                bulk_refresh(store, client, metadata=metadata, codes=list(metadata.universe(fund_type)))
+            except Exception as e:
+                logging.warning(f"Bulk refresh of {fund_type} failed, falling back to per-fund fetches: {e}")
+            finally:
+                client.close()
+    cache = RunCache()
     
-    out_path = os.path.join(os.path.dirname(__file__), "data.json")
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
-    logging.info(f"Data saved to {out_path}")
+    # Tracked funds and allocation diffs run alongside the universe scan and share its fetches
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as side:
+        if universe is None:
+            side_work = side.submit(fetch_tracked_and_allocations, tracked_codes, store, metadata, cache, alloc_store, since)
+            on_result = None
+            if args.preview:
+                preview_path = os.path.join(os.path.dirname(__file__), "data_preview.json")
+                on_result = live_leaderboards(periods[0], selected_cats, args.sort, write_preview(preview_path, periods[0], args.sort), universe=views[0])
+            # The deadline covers the whole run, so time spent on metadata and the bulk refresh counts against it
+            deadline = max(args.deadline - (time.monotonic() - started), 0) if args.deadline is not None else None
+            if args.shards > 1 or args.shard_dir:
+                # Imported here: shard_screen builds on this module
+                from shard_screen import screen_sharded
+                provider_spec = (("synthetic", {'n_funds': args.synthetic_funds, 'latency': args.latency, 'failure_rate': args.failure_rate})
+                                 if args.provider == "synthetic" else (args.provider, {}))
+                flow_reports = screen_sharded(periods, views, args.shards, selected_cats, args.sort, store=store, metadata=metadata,
+                                              concurrency=args.concurrency, rate=args.rate, resume=not args.no_resume, since=since,
+                                              date_range=date_range, deadline=deadline, max_stale_days=args.max_stale_days,
+                                              provider=provider_spec, spool_dir=args.shard_dir, snapshot_path=snapshot_path,
+                                              checkpoint_dir=checkpoint_dir)
+            else:
+                flow_reports = fetch_all_periods(periods, selected_cats, args.sort, store=store, concurrency=args.concurrency, rate=args.rate,
+                                                 resume=not args.no_resume, metadata=metadata, on_result=on_result, cache=cache, date_range=date_range,
+                                                 deadline=deadline, views=views, keep=tracked_codes, max_stale_days=args.max_stale_days,
+                                                 snapshot_path=snapshot_path, checkpoint_dir=checkpoint_dir)
+        else:
+            # Only the selection changed: rebuild everything from the snapshot, fetching just tracked funds it lacks
+            panel, names, code_to_type = universe
+            # A snapshot of fund digests only holds anchor rows; tracked charts then fetch their full history
+            for code in tracked_codes if panel.periods is None else []:
+                if code in panel.codes:
+                    cache.put('history', code, (names.get(code, ''), panel.frame(code)))
+            side_work = side.submit(fetch_tracked_and_allocations, tracked_codes, store, metadata, cache, alloc_store, since)
+            flow_reports = {(period, view): build_flow_report(panel, names, code_to_type, period, selected_cats, args.sort, date_range=date_range,
+                                                              max_stale_days=args.max_stale_days, universe=view)
+                            for period in periods for view in views}
+        tracked_histories, allocation_diffs = side_work.result()
+    
+    # Rows staged by tracked fetches that finished after the scan's flush
+    if store is not None and store.flush():
+        store.save()
+    if store is not None and since < datetime.now() - timedelta(days=LOOKBACK_DAYS):
+        # Tracked frames cover LOOKBACK_DAYS; long periods and custom ranges read older stored rows
+        tracked_histories = {code: (name, store.frame(code, start=since)) for code, (name, _) in tracked_histories.items()}
+    
+    allocation_rotation = None
+    if args.allocations or args.look_through:
+        alloc_store = alloc_store if alloc_store is not None else AllocationStore(root=None)
+        fetch_universe_allocations([code for fund_type in fund_types for code in metadata.universe(fund_type)], alloc_store, args.concurrency, args.rate, cache)
+        holdings = None
+        if args.look_through:
+            # KAP disclosures are PDFs parsed by borsapy through OpenRouter; without a key only cached holdings are used
+            api_key = os.environ.get("OPENROUTER_API_KEY")
+            fetch_holdings = (lambda code: get_fund(code).get_holdings(api_key=api_key)) if api_key else None
+            holdings_cache = HoldingsCache(fetch_holdings).load()
+            if api_key:
+                holdings_cache.refresh(holdings_cache.stale(fund_of_funds_codes(alloc_store)))
+            else:
+                logging.warning("OPENROUTER_API_KEY not set; look-through uses cached fund holdings only")
+            holdings = holdings_cache.holdings()
+            add_look_through(allocation_diffs, alloc_store, holdings)
+        allocation_rotation = build_allocation_rotation(alloc_store, {code: metadata.name(code) for code in alloc_store.codes}, holdings=holdings)
+    elif alloc_store is not None:
+        alloc_store.save()
+    
+    base_dir = os.path.dirname(__file__)
+    for period in periods:
+        tracked_data = build_tracked_funds(tracked_histories, period, date_range)
+        for view in views:
+            output = build_output(period, args.sort, flow_reports[(period, view)], tracked_data, allocation_diffs, allocation_rotation, date_range, view)
+            
+            out_name = ("data" if args.period != "all" else f"data_{period}") + VIEW_SUFFIXES[view] + ".json"
+            out_path = os.path.join(base_dir, out_name)
+            with open(out_path, "w", encoding="utf-8") as f:
+                json.dump(output, f, ensure_ascii=False, indent=2)
+            logging.info(f"Data saved to {out_path}")
@@ -0,0 +1,113 @@
+import numpy as np
+
+# Per-fund quality flags, OR-ed into one code per fund and period
+NO_PRICE = 1 << 0           # latest price missing or zero (not published yet)
+STALE_PRICE = 1 << 1        # price unchanged over the last STALE_PRICE_ROWS published rows
+SHARE_JUMP = 1 << 2         # shares jumped inside the period (merger, split or a bad row)
+MISSING_INVESTORS = 1 << 3  # investor count missing at the latest row
+FEW_INVESTORS = 1 << 4      # closed / institutional fund, not traded on TEFAS
+DUPLICATE_DATES = 1 << 5    # the fetched history repeated dates (the last row per date is used)
+
+# Flag -> name in data.json
+QUALITY_FLAGS = {
+    NO_PRICE: "no_price",
+    STALE_PRICE: "stale_price",
+    SHARE_JUMP: "share_jump",
+    MISSING_INVESTORS: "missing_investors",
+    FEW_INVESTORS: "few_investors",
+    DUPLICATE_DATES: "duplicate_dates",
+}
+
+# Flags that keep a fund off the leaderboards and signals; the others are only reported
+EXCLUDING = NO_PRICE | STALE_PRICE | SHARE_JUMP | MISSING_INVESTORS | FEW_INVESTORS
+
+MIN_INVESTORS = 500
+STALE_PRICE_ROWS = 5
+# Shares growing or shrinking by more than this factor between two published rows
+SHARE_JUMP_RATIO = 3.0
+
+
+def row_checks(price, shares, ffill=None):
+    # funds x dates (NaN = no row) -> at every published column, the running count of share jumps and
+    # the length of the run of equal prices ending there. Per row, so a FundDigest can keep them for its anchors.
+    # ffill: the panel's published_index(), if already built.
+    n_funds, n_dates = price.shape
+    valid = ~np.isnan(price)
+    if ffill is None:
+        ffill = np.where(valid, np.arange(n_dates), -1)
+        np.maximum.accumulate(ffill, axis=1, out=ffill)
+    # Values of each column's previous published row; a fund with none before lands on its (empty) first column
+    flat = np.maximum(ffill[:, :-1], 0) + (np.arange(n_funds) * n_dates)[:, None]
+    prev_price = np.full(price.shape, np.nan)
+    prev_shares = np.full(price.shape, np.nan)
+    prev_price[:, 1:] = np.take(price, flat)
+    prev_shares[:, 1:] = np.take(shares, flat)
+
+    with np.errstate(invalid="ignore"):
+        jump = (valid & (shares > 0) & (prev_shares > 0)
+                & ((shares > SHARE_JUMP_RATIO * prev_shares) | (prev_shares > SHARE_JUMP_RATIO * shares)))
+    share_jumps = np.cumsum(jump, axis=1)
+
+    # A run restarts at a fund's first row and wherever the price differs from the row before
+    ordinal = np.cumsum(valid, axis=1)
+    at_change = np.where(valid & (price != prev_price), ordinal, 0)
+    np.maximum.accumulate(at_change, axis=1, out=at_change)
+    return share_jumps, ordinal - at_change + 1
+
+
+def _at(values, idx):
+    # values[fund, idx] for per-fund (n) or per-fund-and-date (n x d) column indices
+    if not len(values):
+        return np.zeros(idx.shape)
+    return np.take_along_axis(values, np.maximum(idx, 0).reshape(len(values), -1), axis=1).reshape(idx.shape)
+
+
+class QualityIndex:
+    """Per-column quality facts over a FlowPanel, built once and checked against any period's anchors.
+
+    Panels built from FundDigests carry the row facts their digests computed over the full histories;
+    every other panel derives them from its own rows.
+    """
+
+    def __init__(self, panel):
+        self.price = panel.price
+        self.investors = panel.investors
+        if panel.quality_rows is not None:
+            self.share_jumps, self.price_run = panel.quality_rows
+        else:
+            self.share_jumps, self.price_run = row_checks(panel.price, panel.shares, panel.published_index()[0])
+        self.duplicates = panel.duplicates
+
+    def check(self, latest_idx, prev_idx):
+        # Quality code per fund (or per fund and date for rolling anchors) from the latest / reference columns.
+        # Price and investors are checked on the latest row only: a fund launched inside the period has a zero
+        # price or investor count at its reference row and still ranks, as it did before the checks existed.
+        inv_l = _at(self.investors, latest_idx)
+        missing = ~(inv_l > 0)
+        codes = (np.where(~(_at(self.price, latest_idx) > 0), NO_PRICE, 0)
+                 | np.where(_at(self.price_run, latest_idx) >= STALE_PRICE_ROWS, STALE_PRICE, 0)
+                 | np.where(_at(self.share_jumps, latest_idx) > _at(self.share_jumps, prev_idx), SHARE_JUMP, 0)
+                 | np.where(missing, MISSING_INVESTORS, 0)
+                 | np.where(~missing & (inv_l < MIN_INVESTORS), FEW_INVESTORS, 0))
+        if self.duplicates is not None:
+            dup = np.where(self.duplicates > 0, DUPLICATE_DATES, 0)
+            codes = codes | (dup if codes.ndim == 1 else dup[:, None])
+        return np.where(latest_idx >= 0, codes, 0)
+
+
+def eligible(codes):
+    # Funds the leaderboards and signals may rank
+    return (codes & EXCLUDING) == 0
+
+
+def flag_names(code):
+    return [name for flag, name in QUALITY_FLAGS.items() if code & flag]
+
+
+def quality_summary(flagged):
+    # {fund_code: code} of the flagged funds -> the report's quality block
+    return {
+        'flags': {name: sum(1 for code in flagged.values() if code & flag) for flag, name in QUALITY_FLAGS.items()},
+        'excluded': sum(1 for code in flagged.values() if code & EXCLUDING),
+        'funds': {fund: flag_names(code) for fund, code in flagged.items()},
+    }
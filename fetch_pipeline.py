@@ -0,0 +1,270 @@
+import os
+import json
+import random
+import asyncio
+import concurrent.futures
+import inspect
+import logging
+import time
+import argparse
+from collections import deque
+
+# Defaults for the TEFAS fund fetches: at most FETCH_CONCURRENCY calls in flight
+# and FETCH_RATE calls started per second (bursts up to FETCH_BURST)
+FETCH_CONCURRENCY = 6
+FETCH_RATE = 10.0
+FETCH_BURST = 10
+
+# Failed fetches are retried with full-jitter exponential backoff: sleep U(0, min(max, base * 2^attempt))
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints")
+
+
+class TokenBucket:
+    """Async token bucket: acquire() waits until a token is available, refilling at `rate` tokens/s."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    return random.uniform(0, min(max_delay, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Trips when the error rate over the last `window` calls exceeds `error_threshold`.
+
+    While open every new call waits for the cooldown, and each trip halves `rate_factor`
+    (the fetch pipeline scales its token bucket by it). A clean window doubles it back up to 1.
+    """
+
+    def __init__(self, window=50, error_threshold=0.3, cooldown=15.0, min_rate_factor=0.1):
+        self.window = window
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.min_rate_factor = min_rate_factor
+        self.outcomes = deque(maxlen=window)
+        self.open_until = 0.0
+        self.rate_factor = 1.0
+        self.trips = 0
+
+    @property
+    def error_rate(self):
+        return (len(self.outcomes) - sum(self.outcomes)) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def is_open(self):
+        return time.monotonic() < self.open_until
+
+    def record(self, ok):
+        self.outcomes.append(bool(ok))
+        if len(self.outcomes) < min(self.window, 10):
+            return
+        if self.error_rate > self.error_threshold:
+            if not self.is_open:
+                self.trips += 1
+                self.open_until = time.monotonic() + self.cooldown
+                self.rate_factor = max(self.min_rate_factor, self.rate_factor / 2)
+                logging.warning(f"Circuit breaker open: error rate {self.error_rate:.0%}, pausing {self.cooldown:.0f}s and slowing to {self.rate_factor:.0%} rate")
+                self.outcomes.clear()
+        elif len(self.outcomes) == self.window and self.error_rate == 0 and self.rate_factor < 1.0:
+            self.rate_factor = min(1.0, self.rate_factor * 2)
+            self.outcomes.clear()
+
+    async def wait(self):
+        remaining = self.open_until - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+
+class Checkpoint:
+    """Append-only JSONL of finished fetches so an interrupted screening resumes where it stopped.
+
+    encode(result) / decode(code, payload) convert results to and from JSON-safe payloads.
+    """
+
+    def __init__(self, path, encode=None, decode=None):
+        self.path = path
+        self.encode = encode or (lambda result: result)
+        self.decode = decode or (lambda code, payload: payload)
+        self._file = None
+
+    def load(self, reduce=None):
+        # reduce(result), if given, is applied to each entry as it is read
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash mid-write can leave a truncated last line
+                    continue
+                result = self.decode(entry["code"], entry["result"])
+                done[entry["code"]] = reduce(result) if reduce is not None else result
+        logging.info(f"Checkpoint: resuming with {len(done)} funds already fetched ({self.path})")
+        return done
+
+    def add(self, code, result):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"code": code, "result": self.encode(result)}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def clear(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def fetch_many_async(codes, fetch_fn, concurrency=FETCH_CONCURRENCY, rate=FETCH_RATE, burst=FETCH_BURST, on_result=None,
+                           retries=RETRY_ATTEMPTS, breaker=None, checkpoint=None, deadline=None, reduce=None):
+    # fetch_fn(code) may be a coroutine function or a blocking function (run in a worker thread).
+    # It should raise on upstream errors (retried) and return None when a fund simply has no data.
+    # on_result(code, result) is called as soon as each fetch finishes.
+    # After `deadline` seconds whatever is still queued or in flight is abandoned and left out of the results.
+    # reduce(result) replaces each result as soon as it is checkpointed, so only the reduced form is kept.
+    results = checkpoint.load(reduce) if checkpoint is not None else {}
+    if on_result is not None:
+        for code, res in results.items():
+            on_result(code, res)
+    pending = [code for code in codes if code not in results]
+    breaker = breaker or CircuitBreaker()
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(rate, burst) if rate else None
+    is_async = inspect.iscoroutinefunction(fetch_fn)
+    # Blocking fetchers get their own pool sized to the cap (the default executor is often smaller)
+    executor = None if is_async else concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    loop = asyncio.get_running_loop()
+    done = len(results)
+
+    async def call(code):
+        async with semaphore:
+            await breaker.wait()
+            if bucket is not None:
+                bucket.rate = rate * breaker.rate_factor
+                await bucket.acquire()
+            return await fetch_fn(code) if is_async else await loop.run_in_executor(executor, fetch_fn, code)
+
+    async def run_one(code):
+        nonlocal done
+        for attempt in range(retries + 1):
+            try:
+                res = await call(code)
+                breaker.record(True)
+                break
+            except Exception as e:
+                breaker.record(False)
+                if attempt == retries:
+                    logging.error(f"Error fetching fund {code} after {retries + 1} attempts: {e}")
+                    return
+                delay = backoff_delay(attempt)
+                logging.debug(f"Retrying {code} in {delay:.2f}s ({e})")
+                await asyncio.sleep(delay)
+        if checkpoint is not None:
+            checkpoint.add(code, res)
+        if reduce is not None:
+            res = reduce(res)
+        results[code] = res
+        if on_result is not None:
+            on_result(code, res)
+        done += 1
+        if done % 100 == 0: logging.info(f"Processed {done}/{len(codes)} funds...")
+
+    tasks = [asyncio.ensure_future(run_one(code)) for code in pending]
+    late = set()
+    try:
+        if tasks:
+            _, late = await asyncio.wait(tasks, timeout=deadline)
+        for task in late:
+            task.cancel()
+        if late:
+            # Blocking fetches already running finish in their threads; their results are simply not waited for
+            await asyncio.gather(*late, return_exceptions=True)
+            logging.warning(f"Fetch deadline of {deadline:.0f}s reached: {len(late)} funds abandoned")
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=bool(late))
+        if checkpoint is not None:
+            checkpoint.close()
+    failed = len(codes) - len(results) - len(late)
+    if failed:
+        logging.warning(f"{failed} funds failed after retries (circuit breaker trips: {breaker.trips})")
+    return results
+
+
+def fetch_many(codes, fetch_fn, concurrency=FETCH_CONCURRENCY, rate=FETCH_RATE, burst=FETCH_BURST, on_result=None,
+               retries=RETRY_ATTEMPTS, breaker=None, checkpoint=None, deadline=None, reduce=None):
+    return asyncio.run(fetch_many_async(codes, fetch_fn, concurrency, rate, burst, on_result, retries, breaker, checkpoint, deadline, reduce))
+
+
+class LatencyStandIn:
+    """Local stand-in for TEFAS: every call sleeps `latency` seconds, fails with probability
+    `failure_rate` and counts calls that exceed `max_rps`."""
+
+    def __init__(self, latency=0.2, max_rps=None, failure_rate=0.0):
+        self.latency = latency
+        self.max_rps = max_rps
+        self.failure_rate = failure_rate
+        self.calls = []
+        self.throttled = 0
+
+    def fetch(self, code):
+        now = time.monotonic()
+        self.calls.append(now)
+        if self.max_rps and sum(1 for t in self.calls[-int(self.max_rps) - 1:] if now - t < 1.0) > self.max_rps:
+            self.throttled += 1
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ConnectionError(f"stand-in failure for {code}")
+        return code
+
+
+def benchmark(n_funds=500, latency=0.2, max_rps=None, failure_rate=0.0, settings=((3, None), (6, 10.0), (12, 20.0), (24, 40.0))):
+    codes = [f"F{i:04d}" for i in range(n_funds)]
+    for concurrency, rate in settings:
+        stand_in = LatencyStandIn(latency, max_rps, failure_rate)
+        t0 = time.perf_counter()
+        results = fetch_many(codes, stand_in.fetch, concurrency=concurrency, rate=rate, burst=rate, retries=RETRY_ATTEMPTS)
+        elapsed = time.perf_counter() - t0
+        print(f"concurrency={concurrency:<3} rate={str(rate):<6} {elapsed:6.2f}s  {n_funds / elapsed:7.1f} funds/s  "
+              f"fetched={len(results)} throttled={stand_in.throttled}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the fetch pipeline against a local latency stand-in")
+    parser.add_argument("--funds", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--max-rps", type=float, default=None, help="Upstream tolerance; calls above it are counted as throttled")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that a stand-in call raises")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    benchmark(args.funds, args.latency, args.max_rps, args.failure_rate)
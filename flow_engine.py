@@ -0,0 +1,445 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from data_quality import QualityIndex, row_checks
+from history_store import FIELDS, history_arrays, normalize_history
+from trading_calendar import anchor_columns
+
+
+class FlowPanel:
+    """Dense funds x dates arrays (NaN where a fund has no row) shared by every vectorized metric."""
+
+    def __init__(self, codes, dates, price, size, shares, investors):
+        self.codes = list(codes)
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.price = price
+        self.size = size
+        self.shares = shares
+        self.investors = investors
+        # Per-fund dashboard category id and default-view exclusion flag (see fund_categories)
+        self.category = None
+        self.default_excluded = None
+        # Per-fund flag: rows come from the local cache because the fetch missed the deadline,
+        # and the universe codes that were neither fetched nor cached
+        self.stale = None
+        self.missing = []
+        # Preset periods whose anchor rows a panel built from FundDigests holds (None: every row)
+        self.periods = None
+        # Per-fund count of repeated dates dropped from this run's fetched histories (None: not tracked), and
+        # the (share_jumps, price_run) row facts of a panel built from FundDigests (see data_quality.row_checks)
+        self.duplicates = None
+        self.quality_rows = None
+        self._published = None
+        self._prefix = None
+        self._quality = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def frame(self, code):
+        # One fund's rows in borsapy's column layout
+        row = self.codes.index(code)
+        valid = ~np.isnan(self.price[row])
+        df = pd.DataFrame(
+            {col: getattr(self, field)[row, valid] for field, col in FIELDS.items()},
+            index=pd.DatetimeIndex(self.dates[valid]),
+        )
+        df["Investors"] = df["Investors"].fillna(0)
+        return df
+
+    def save(self, path, **meta):
+        arrays = {field: getattr(self, field) for field in FIELDS}
+        if self.category is not None:
+            arrays['category'] = self.category
+            arrays['default_excluded'] = self.default_excluded
+        if self.stale is not None:
+            arrays['stale'] = self.stale
+            arrays['missing'] = np.array(self.missing, dtype=str)
+        if self.periods is not None:
+            arrays['periods'] = np.array(self.periods, dtype=str)
+        if self.duplicates is not None:
+            arrays['duplicates'] = self.duplicates
+        if self.quality_rows is not None:
+            arrays['share_jumps'], arrays['price_run'] = self.quality_rows
+        with open(path, "wb") as f:
+            np.savez(f, codes=np.array(self.codes, dtype=str), dates=self.dates,
+                     meta=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+
+    def refresh_rows(self, store, codes, start=None):
+        # Re-reads `codes` from the store in place; dates they add extend the panel (NaN for everyone else)
+        update = FlowPanel.from_store(store, codes, start=start)
+        dates = np.union1d(self.dates, update.dates)
+        if len(dates) > len(self.dates):
+            cols = np.searchsorted(dates, self.dates)
+            for field in FIELDS:
+                grown = np.full((len(self.codes), len(dates)), np.nan)
+                grown[:, cols] = getattr(self, field)
+                setattr(self, field, grown)
+            self.dates = dates
+        index = {code: i for i, code in enumerate(self.codes)}
+        rows = np.array([index[code] for code in update.codes], dtype=int)
+        cols = np.searchsorted(self.dates, update.dates)
+        for field in FIELDS:
+            getattr(self, field)[rows[:, None], cols] = getattr(update, field)
+        if self.stale is not None:
+            self.stale[rows] = False
+        if self.duplicates is not None and update.duplicates is not None:
+            self.duplicates[rows] = update.duplicates
+        self._published = None
+        self._prefix = None
+        self._quality = None
+        return rows
+
+    def published_index(self):
+        # Per fund and column the column of its last published row on or before it (-1 before its first),
+        # and its first published column; built once and shared by every period's anchors
+        if self._published is None:
+            n_funds, n_dates = self.price.shape
+            valid = ~np.isnan(self.price)
+            ffill = np.where(valid, np.arange(n_dates), -1)
+            np.maximum.accumulate(ffill, axis=1, out=ffill)
+            first_idx = np.where(valid.any(axis=1), np.argmax(valid, axis=1), -1) if n_dates else np.full(n_funds, -1)
+            self._published = ffill, first_idx
+        return self._published
+
+    def quality_index(self):
+        # Built on first use and checked against every period's anchors
+        if self._quality is None:
+            self._quality = QualityIndex(self)
+        return self._quality
+
+    def prefix_index(self):
+        # Built on first use and reused by every range query on this panel
+        if self._prefix is None:
+            self._prefix = PrefixIndex(self)
+        return self._prefix
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            panel = cls(npz['codes'].tolist(), npz['dates'], **{field: npz[field] for field in FIELDS})
+            if 'category' in npz.files:
+                panel.category = npz['category']
+                panel.default_excluded = npz['default_excluded']
+            if 'stale' in npz.files:
+                panel.stale = npz['stale']
+                panel.missing = npz['missing'].tolist()
+            if 'periods' in npz.files:
+                panel.periods = npz['periods'].tolist()
+            if 'duplicates' in npz.files:
+                panel.duplicates = npz['duplicates']
+            if 'share_jumps' in npz.files:
+                panel.quality_rows = npz['share_jumps'], npz['price_run']
+            meta = json.loads(str(npz['meta']))
+        return panel, meta
+
+    @classmethod
+    def from_histories(cls, histories):
+        # histories: {fund_code: borsapy history frame}
+        frames = {code: normalize_history(df) for code, df in histories.items()}
+        frames = {code: f for code, f in frames.items() if not f.empty}
+        codes = list(frames)
+        if not codes:
+            empty = np.empty((0, 0))
+            return cls([], [], empty, empty, empty, empty)
+        duplicates = np.array([len(histories[code]) - len(frames[code]) for code in codes])
+        dates = np.unique(np.concatenate([f.index.values.astype("datetime64[D]") for f in frames.values()]))
+        arrays = {field: np.full((len(codes), len(dates)), np.nan) for field in FIELDS}
+        for row, code in enumerate(codes):
+            frame = frames[code]
+            cols = np.searchsorted(dates, frame.index.values.astype("datetime64[D]"))
+            for field in FIELDS:
+                arrays[field][row, cols] = frame[field].to_numpy(dtype=float)
+        panel = cls(codes, dates, **arrays)
+        panel.duplicates = duplicates
+        return panel
+
+    @classmethod
+    def from_digests(cls, digests, periods=None):
+        # digests: {fund_code: FundDigest} reduced for `periods`; a sparse panel over the union of the kept dates
+        codes = [code for code, digest in digests.items() if len(digest)]
+        if not codes:
+            empty = np.empty((0, 0))
+            panel = cls([], [], empty, empty, empty, empty)
+            panel.periods = periods
+            return panel
+        kept = [digests[code] for code in codes]
+        all_dates = np.concatenate([digest.dates for digest in kept])
+        dates = np.unique(all_dates)
+        arrays = np.full((len(FIELDS), len(codes), len(dates)), np.nan)
+        rows = np.repeat(np.arange(len(codes)), [len(digest) for digest in kept])
+        cols = np.searchsorted(dates, all_dates)
+        arrays[:, rows, cols] = np.concatenate([digest.values for digest in kept]).T
+        checks = np.full((2, len(codes), len(dates)), np.nan)
+        checks[:, rows, cols] = np.concatenate([digest.checks for digest in kept]).T
+        panel = cls(codes, dates, *arrays)
+        panel.periods = periods
+        panel.duplicates = np.array([digest.duplicates for digest in kept])
+        panel.quality_rows = checks[0], checks[1]
+        return panel
+
+    @classmethod
+    def from_store(cls, store, codes=None, start=None, end=None):
+        # Reads only the yearly partitions overlapping [start, end]
+        rows = np.arange(len(store.codes)) if codes is None else np.array(
+            [store._row[c] for c in codes if c in store._row], dtype=int)
+        dates, arrays = store.window(start, end, rows)
+        panel = cls([store.codes[r] for r in rows], dates, **arrays)
+        panel.duplicates = np.array([store.duplicates.get(code, 0) for code in panel.codes], dtype=int)
+        return panel
+
+
+def anchor_indices(panel, period_type):
+    # Per fund: column of the latest row and of the period's reference row (-1 if the fund has no rows).
+    # Mirrors get_prev_row: the reference is the fund's last row on or before the anchor trading day of
+    # its latest row (daily: the trading day before), falling back to the first row.
+    n_funds, n_dates = panel.price.shape
+    if n_funds == 0 or n_dates == 0:
+        empty = np.empty(0, dtype=int)
+        return empty, empty
+    ffill, first_idx = panel.published_index()
+    latest_idx = ffill[:, -1]
+    rows = np.arange(n_funds)
+
+    ref = anchor_columns(panel.dates, period_type)[np.maximum(latest_idx, 0)]
+    prev_idx = np.where(ref >= 0, ffill[rows, np.maximum(ref, 0)], -1)
+    prev_idx = np.where(prev_idx >= 0, prev_idx, first_idx)
+    prev_idx = np.where(latest_idx >= 0, prev_idx, -1)
+    return latest_idx, prev_idx
+
+
+def anchor_positions(dates, periods):
+    # Rows of one fund's (sorted, published) dates that compute_flows reads for `periods`: the first row
+    # (fallback reference), the second-to-last (daily), the latest and each preset's reference row
+    n = len(dates)
+    if n == 0:
+        return np.empty(0, dtype=int)
+    keep = {0, max(n - 2, 0), n - 1}
+    for period in periods:
+        pos = int(anchor_columns(dates, period)[-1])
+        if pos >= 0:
+            keep.add(pos)
+    return np.array(sorted(keep))
+
+
+class FundDigest:
+    """The few rows of one fund's history that compute_flows() reads for a fixed set of preset periods.
+
+    At most 3 + len(periods) rows, as a date vector and a rows x FIELDS array, so a scan can release
+    each fetched frame right away. A panel built from digests gives the same flows and quality codes
+    for those periods as one built from the full histories (not for custom ranges, whose flows sum
+    every day): the kept rows carry the row checks computed over the whole history.
+    """
+
+    __slots__ = ('dates', 'values', 'checks', 'duplicates')
+
+    def __init__(self, dates, values, checks, duplicates=0):
+        self.dates = dates
+        self.values = values
+        self.checks = checks
+        self.duplicates = duplicates
+
+    def __len__(self):
+        return len(self.dates)
+
+    @classmethod
+    def from_frame(cls, df, periods):
+        dates, values = history_arrays(df)
+        duplicates = (len(df) if df is not None else 0) - len(dates)
+        # Rows without a price are never an anchor
+        published = ~np.isnan(values[:, 0])
+        dates, values = dates[published], values[published]
+        share_jumps, price_run = row_checks(values[None, :, 0], values[None, :, 2])
+        rows = anchor_positions(dates, periods)
+        return cls(dates[rows], values[rows], np.column_stack([share_jumps[0, rows], price_run[0, rows]]), duplicates)
+
+
+def compute_flows(panel, period_type):
+    # Every flow metric for every fund in a handful of array operations
+    latest_idx, prev_idx = anchor_indices(panel, period_type)
+    # Same rule as the per-fund path: a fund needs at least two rows
+    n_rows = (~np.isnan(panel.price)).sum(axis=1) if panel.price.size else np.zeros(len(panel), dtype=int)
+    return {'valid': (latest_idx >= 0) & (n_rows >= 2), **anchor_flows(panel, latest_idx, prev_idx)}
+
+
+def anchor_flows(panel, latest_idx, prev_idx):
+    # The flow metrics between each fund's latest and reference columns: per fund (n) for compute_flows,
+    # per fund and date (n x d) for the backtest's rolling anchors
+    rows = np.arange(len(panel)).reshape((-1,) + (1,) * (np.ndim(latest_idx) - 1))
+    li = np.maximum(latest_idx, 0)
+    pi = np.maximum(prev_idx, 0)
+
+    price_l, price_p = panel.price[rows, li], panel.price[rows, pi]
+    size_l, size_p = panel.size[rows, li], panel.size[rows, pi]
+    shares_l, shares_p = panel.shares[rows, li], panel.shares[rows, pi]
+    inv_l = np.nan_to_num(panel.investors[rows, li])
+    inv_p = np.nan_to_num(panel.investors[rows, pi])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        net_flow = np.nan_to_num((shares_l - shares_p) * price_l)
+        flow_pct = np.where(size_p > 0, net_flow / size_p * 100, 0.0)
+        return_pct = np.where(price_p > 0, (price_l - price_p) / price_p * 100, 0.0)
+        inv_change = inv_l - inv_p
+        inv_change_pct = np.where(inv_p > 0, inv_change / inv_p * 100, 0.0)
+
+    return {
+        'latest_idx': latest_idx,
+        'prev_idx': prev_idx,
+        'net_flow': net_flow,
+        'fund_size': np.nan_to_num(size_l),
+        'flow_pct': np.nan_to_num(flow_pct),
+        'return_pct': np.nan_to_num(return_pct),
+        'investors': inv_l,
+        'inv_change': inv_change,
+        'inv_change_pct': np.nan_to_num(inv_change_pct),
+    }
+
+
+# Metric column -> dtype of the per-fund results (ints truncate like the int() of the old dict records)
+RESULT_COLUMNS = {
+    'net_flow': np.float64,
+    'fund_size': np.float64,
+    'flow_pct': np.float64,
+    'return_pct': np.float64,
+    'investors': np.int64,
+    'inv_change': np.int64,
+    'inv_change_pct': np.float64,
+}
+
+
+class FlowResults:
+    """Per-fund flow metrics as one array per column instead of one dict per fund.
+
+    Leaderboards and signals work on the columns; only the rows that reach the output are
+    turned into dicts with record()/records().
+    """
+
+    __slots__ = ('codes', 'names') + tuple(RESULT_COLUMNS)
+
+    def __init__(self, codes, names, **columns):
+        self.codes = np.asarray(codes, dtype=object)
+        self.names = np.asarray(names, dtype=object)
+        for col, dtype in RESULT_COLUMNS.items():
+            setattr(self, col, np.asarray(columns[col]).astype(dtype))
+
+    @classmethod
+    def from_flows(cls, panel, flows, names=None, mask=None):
+        names = names or {}
+        idx = np.flatnonzero(flows['valid'] if mask is None else mask)
+        codes = [panel.codes[i] for i in idx]
+        return cls(codes, [names.get(code, '') for code in codes], **{col: flows[col][idx] for col in RESULT_COLUMNS})
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def concat(cls, parts):
+        # Row-wise concatenation, e.g. of screening shards' results
+        parts = list(parts)
+        if not parts:
+            return cls([], [], **{col: np.array([], dtype=dtype) for col, dtype in RESULT_COLUMNS.items()})
+        return cls(np.concatenate([p.codes for p in parts]), np.concatenate([p.names for p in parts]),
+                   **{col: np.concatenate([getattr(p, col) for p in parts]) for col in RESULT_COLUMNS})
+
+    def take(self, idx):
+        # Row subset (index array or boolean mask), still columnar
+        return FlowResults(self.codes[idx], self.names[idx], **{col: getattr(self, col)[idx] for col in RESULT_COLUMNS})
+
+    def record(self, i):
+        rec = {'fund_code': self.codes[i], 'name': self.names[i]}
+        for col, dtype in RESULT_COLUMNS.items():
+            rec[col] = int(getattr(self, col)[i]) if dtype is np.int64 else float(getattr(self, col)[i])
+        return rec
+
+    def records(self, idx=None):
+        return [self.record(i) for i in (range(len(self)) if idx is None else idx)]
+
+
+def flow_records(panel, flows, names=None, mask=None):
+    # Back to the per-fund dicts the streaming leaderboards consume
+    return FlowResults.from_flows(panel, flows, names, mask).records()
+
+
+class PrefixIndex:
+    """Cumulative per-fund arrays over a FlowPanel so any [start, end] window is two column lookups.
+
+    Net flow over a window is the sum of daily flows, each valued at that day's price, rather than
+    the preset periods' (shares change x latest price); returns come from cumulative log returns.
+    """
+
+    def __init__(self, panel):
+        self.dates = panel.dates
+        n_funds, n_dates = panel.price.shape
+        valid = ~np.isnan(panel.price)
+        ffill, self.first_idx = panel.published_index()
+        self.ffill = ffill
+
+        rows = np.arange(n_funds)[:, None]
+        cols = np.maximum(ffill, 0)
+        price = np.where(ffill >= 0, panel.price[rows, cols], np.nan)
+        shares = np.where(ffill >= 0, panel.shares[rows, cols], np.nan)
+        self.size = np.where(ffill >= 0, panel.size[rows, cols], np.nan)
+        self.investors = np.nan_to_num(np.where(ffill >= 0, panel.investors[rows, cols], np.nan))
+
+        # Price-0 placeholder rows carry the last positive price, so the return across them lands on
+        # the next priced day instead of being dropped
+        priced = np.where(valid & (panel.price > 0), np.arange(n_dates), -1)
+        np.maximum.accumulate(priced, axis=1, out=priced)
+        last_price = np.where(priced >= 0, panel.price[rows, np.maximum(priced, 0)], np.nan)
+
+        # Zero on days the fund published nothing, so cumulative values carry over gaps
+        flow = np.zeros((n_funds, n_dates))
+        log_return = np.zeros((n_funds, n_dates))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_price = np.log(last_price)
+            if n_dates > 1:
+                flow[:, 1:] = np.where(valid[:, 1:], (shares[:, 1:] - shares[:, :-1]) * price[:, 1:], 0)
+                log_return[:, 1:] = np.where(valid[:, 1:], log_price[:, 1:] - log_price[:, :-1], 0)
+        self.cum_flow = np.cumsum(np.nan_to_num(flow), axis=1)
+        self.cum_log_return = np.cumsum(np.nan_to_num(log_return, posinf=0.0, neginf=0.0), axis=1)
+
+    def _column(self, date):
+        # Last panel column on or before `date` (-1 if the panel starts later)
+        return int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(date).date(), "D"), side="right")) - 1
+
+    def query(self, start, end=None):
+        # Same keys as compute_flows; the reference row is each fund's last row on or before `start`
+        # (first row if it starts later, like get_prev_row), the latest its last row on or before `end`
+        n_funds = len(self.ffill)
+        rows = np.arange(n_funds)
+        end_col = len(self.dates) - 1 if end is None else self._column(end)
+        start_col = self._column(start)
+        latest_idx = self.ffill[:, end_col] if end_col >= 0 else np.full(n_funds, -1)
+        prev_idx = self.ffill[:, start_col] if start_col >= 0 else np.full(n_funds, -1)
+        prev_idx = np.where(prev_idx >= 0, prev_idx, self.first_idx)
+        valid = (latest_idx >= 0) & (prev_idx >= 0) & (latest_idx > prev_idx)
+        li = np.where(valid, latest_idx, 0)
+        pi = np.where(valid, prev_idx, 0)
+
+        size_p = self.size[rows, pi]
+        inv_l, inv_p = self.investors[rows, li], self.investors[rows, pi]
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            net_flow = np.where(valid, self.cum_flow[rows, li] - self.cum_flow[rows, pi], 0.0)
+            flow_pct = np.where(size_p > 0, net_flow / size_p * 100, 0.0)
+            return_pct = np.where(valid, np.expm1(self.cum_log_return[rows, li] - self.cum_log_return[rows, pi]) * 100, 0.0)
+            inv_change = np.where(valid, inv_l - inv_p, 0)
+            inv_change_pct = np.where(inv_p > 0, inv_change / inv_p * 100, 0.0)
+        return {
+            'valid': valid,
+            'latest_idx': np.where(valid, latest_idx, -1),
+            'prev_idx': np.where(valid, prev_idx, -1),
+            'net_flow': net_flow,
+            'fund_size': np.nan_to_num(self.size[rows, li]),
+            'flow_pct': np.nan_to_num(flow_pct),
+            'return_pct': np.nan_to_num(return_pct),
+            'investors': inv_l,
+            'inv_change': inv_change,
+            'inv_change_pct': np.nan_to_num(inv_change_pct),
+        }
+
+
+def range_flows(panel, start, end=None):
+    # Universe-wide flow metrics for an arbitrary date window, O(1) per fund once the index exists
+    return panel.prefix_index().query(start, end)
@@ -0,0 +1,139 @@
+import numpy as np
+
+# Mapping of categories to keywords for granular filtering
+# Keys here MUST match the dashboard checkbox values exactly
+CAT_TO_KEYWORDS = {
+    "Hisse Senedi": ["Hisse Senedi", "Hisse"],
+    "Değişken": ["Değişken", "Degisken"],
+    "Karma": ["Karma"],
+    "Fon Sepeti": ["Fon Sepeti"],
+    "Borçlanma Araçları": ["Borçlanma Araçları", "Borclanma Aracları", "Tahvil", "Bono"],
+    "K.Maden": ["Altın", "Gümüş", "Kıymetli Maden", "Altin", "Gumus"],  # dashboard sends 'K.Maden'
+    "Katılım": ["Katılım", "Katilim"],
+    "Para Piy.": ["Para Piyasası", "Para Piyasasi"],  # dashboard sends 'Para Piy.'
+    "Serbest (Genel)": ["Serbest"],        # dashboard sends 'Serbest (Genel)'
+    "Serbest (P.Piy)": ["Serbest", "Para Piyasası"],  # dashboard sends 'Serbest (P.Piy)'
+    "Serbest (Döviz)": ["Serbest", "Döviz"],
+    "Serbest (K.Vade)": ["Serbest", "Kısa Vadeli"],  # dashboard sends 'Serbest (K.Vade)'
+    "Serbest (Katılım)": ["Serbest", "Katılım"]
+}
+
+# Pension (BES / EMK) funds get their own categories, matched on the normalized fund name in this order
+# (state contribution and auto-enrolment funds also say "katılım", index funds also say "hisse")
+PENSION_CAT_TO_KEYWORDS = {
+    "BES Katkı": ["katki"],
+    "BES OKS/Standart": ["otomatik katilim", "baslangic", "standart"],
+    "BES Fon Sepeti": ["fon sepeti"],
+    "BES Altın": ["altin", "kiymetli maden", "gumus"],
+    "BES Para Piy.": ["para piyasasi"],
+    "BES Endeks": ["endeks"],
+    "BES Hisse": ["hisse"],
+    "BES Borçlanma": ["borclanma", "tahvil", "bono", "eurobond"],
+    "BES Katılım": ["katilim", "kira sertifika"],
+    "BES Karma/Değişken": ["karma", "degisken", "dengeli"],
+    "BES Diğer": [],
+}
+
+# Fund universes a run can screen; ALL is the combined view over both
+UNIVERSES = ["YAT", "EMK"]
+ALL = "ALL"
+
+# Category id i + 1 <-> CATEGORY_NAMES[i]; id 0 means the fund matches no dashboard category
+CATEGORY_NAMES = list(CAT_TO_KEYWORDS) + list(PENSION_CAT_TO_KEYWORDS)
+CATEGORY_IDS = {name: i + 1 for i, name in enumerate(CATEGORY_NAMES)}
+CATEGORY_BITS = np.array([0] + [1 << i for i in range(len(CATEGORY_NAMES))], dtype=np.int32)
+# Every pension fund gets a pension category (BES Diğer at worst), so ids from here on mark the EMK universe
+FIRST_PENSION_ID = CATEGORY_IDS[next(iter(PENSION_CAT_TO_KEYWORDS))]
+
+# Longest names first so e.g. 'Hisse Senedi' wins over shorter matches
+ALL_CATS = sorted(CAT_TO_KEYWORDS.keys(), key=len, reverse=True)
+
+# Funds left out of the leaderboards when no category is selected
+DEFAULT_EXCLUDED_KEYWORDS = ["para piyasasi", "p.piy", "doviz", "yabanci"]
+# Pension funds people do not choose themselves are left out too
+DEFAULT_EXCLUDED_PENSION = ["BES Katkı", "BES OKS/Standart"]
+
+# Single-pass replacement of the Turkish letters normalize() folds ('İ'.lower() leaves a combining dot)
+_NORMALIZE_TABLE = str.maketrans({'ı': 'i', 'ş': 's', 'ğ': 'g', 'ü': 'u', 'ö': 'o', 'ç': 'c', '̇': None})
+
+
+def normalize(s):
+    if not s: return ""
+    return str(s).lower().translate(_NORMALIZE_TABLE)
+
+
+def is_pension(fund_type, name):
+    # TEFAS pension fund titles all end in "Emeklilik Yatırım Fonu" (a YAT fund's founder may still be a pension company)
+    return "emeklilik" in normalize(fund_type) or "emeklilik yatirim fonu" in normalize(name)
+
+
+def classify_pension(name):
+    fname_n = normalize(name)
+    for cat_name, keywords in PENSION_CAT_TO_KEYWORDS.items():
+        if any(k in fname_n for k in keywords):
+            return cat_name
+    return "BES Diğer"
+
+
+def classify(fund_type, name):
+    # Effective dashboard category of one fund
+    ftype = str(fund_type or '')
+    fname_n = normalize(name)
+    if is_pension(ftype, name):
+        return classify_pension(name)
+    if "Serbest" in ftype:
+        # Map to dashboard checkbox values
+        if any(x in fname_n for x in ["para piyasasi", "p.piy"]): return "Serbest (P.Piy)"
+        elif any(x in fname_n for x in ["doviz", "yabanci", "eurobond"]): return "Serbest (Döviz)"
+        elif any(x in fname_n for x in ["kisa vadeli", "k.vade"]): return "Serbest (K.Vade)"
+        elif "katilim" in fname_n: return "Serbest (Katılım)"
+        else: return "Serbest (Genel)"
+    elif any(x in ftype for x in ["Kıymetli Maden", "Altın", "Gümüş"]):
+        return "K.Maden"
+    elif "Para Piyasası" in ftype:
+        return "Para Piy."
+    for cat_name in ALL_CATS:
+        if cat_name in ftype:
+            return cat_name
+    return ""
+
+
+def build_category_index(codes, code_to_type, names):
+    # Runs once per universe load: per-fund category id plus the default-view exclusion flag
+    category = np.zeros(len(codes), dtype=np.int8)
+    default_excluded = np.zeros(len(codes), dtype=bool)
+    for i, code in enumerate(codes):
+        name = names.get(code, '')
+        cat = classify(code_to_type.get(code, ''), name)
+        category[i] = CATEGORY_IDS.get(cat, 0)
+        fname_n = normalize(name)
+        default_excluded[i] = any(x in fname_n for x in DEFAULT_EXCLUDED_KEYWORDS) or cat in DEFAULT_EXCLUDED_PENSION
+    return category, default_excluded
+
+
+def universe_mask(category, universe="YAT"):
+    # Funds of one universe (YAT or EMK), or every fund for the combined view
+    if universe == ALL:
+        return np.ones(len(category), dtype=bool)
+    pension = category >= FIRST_PENSION_ID
+    return pension if universe == "EMK" else ~pension
+
+
+def category_label(category):
+    # Dashboard category name per fund ('' for none), e.g. to group pension funds whose TEFAS type is generic
+    return np.array([''] + CATEGORY_NAMES, dtype=object)[category]
+
+
+def selection_bits(selected_cats):
+    bits = 0
+    for cat in selected_cats or []:
+        if cat in CATEGORY_IDS:
+            bits |= int(CATEGORY_BITS[CATEGORY_IDS[cat]])
+    return bits
+
+
+def category_mask(category, default_excluded, selected_cats=None):
+    # Any checkbox combination is one vectorized AND over the precomputed ids
+    if not selected_cats:
+        return ~default_excluded
+    return (CATEGORY_BITS[category] & selection_bits(selected_cats)) != 0
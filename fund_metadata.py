@@ -0,0 +1,120 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+METADATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fund_metadata.json")
+
+# Fund names and types change maybe once a month; a week-old universe is still good enough to screen
+METADATA_TTL = timedelta(days=7)
+
+
+def umbrella_of(fund_type):
+    fund_type = str(fund_type or '')
+    return fund_type if "Şemsiye Fonu" in fund_type else ""
+
+
+class MetadataCache:
+    """Persisted code -> name/type/umbrella map per universe (YAT, EMK, ...).
+
+    A stale universe is served from disk while a background thread re-screens it;
+    a missing one is screened synchronously.
+    """
+
+    def __init__(self, screen_fn, path=METADATA_PATH, ttl=METADATA_TTL):
+        self.screen_fn = screen_fn
+        self.path = path
+        self.ttl = ttl
+        self.universes = {}
+        # Names learned from fund.info for funds the screener returned without one
+        self.names = {}
+        self._lock = threading.Lock()
+        self._refreshing = {}
+        self._dirty = False
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    payload = json.load(f)
+                self.universes = payload.get("universes", {})
+                self.names = payload.get("names", {})
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable metadata cache {self.path}: {e}")
+        return self
+
+    def save(self):
+        # Serialize under the lock: fetch workers may be adding names concurrently
+        with self._lock:
+            text = json.dumps({"universes": self.universes, "names": self.names}, ensure_ascii=False)
+            self._dirty = False
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def is_fresh(self, fund_type):
+        entry = self.universes.get(fund_type)
+        if not entry:
+            return False
+        return datetime.now() - datetime.fromisoformat(entry["fetched_at"]) < self.ttl
+
+    def refresh(self, fund_type):
+        df = pd.DataFrame(self.screen_fn(fund_type=fund_type, limit=5000))
+        names = df['name'].fillna('') if 'name' in df.columns else [''] * len(df)
+        with self._lock:
+            funds = {}
+            for code, ftype, name in zip(df['fund_code'], df['fund_type'], names):
+                funds[code] = {
+                    'name': name or '',
+                    'fund_type': ftype,
+                    'umbrella': umbrella_of(ftype)
+                }
+            self.universes[fund_type] = {"fetched_at": datetime.now().isoformat(timespec="seconds"), "funds": funds}
+        self.save()
+        logging.info(f"Metadata cache: refreshed {len(funds)} {fund_type} funds")
+        return funds
+
+    def refresh_in_background(self, fund_type):
+        with self._lock:
+            running = self._refreshing.get(fund_type)
+            if running is not None and running.is_alive():
+                return running
+            thread = threading.Thread(target=self._refresh_quietly, args=(fund_type,), name=f"metadata-{fund_type}")
+            self._refreshing[fund_type] = thread
+        thread.start()
+        return thread
+
+    def _refresh_quietly(self, fund_type):
+        try:
+            self.refresh(fund_type)
+        except Exception as e:
+            logging.warning(f"Background metadata refresh for {fund_type} failed: {e}")
+
+    def universe(self, fund_type="YAT", force=False):
+        # {code: {'name', 'fund_type', 'umbrella'}}
+        if force or fund_type not in self.universes:
+            return self.refresh(fund_type)
+        if not self.is_fresh(fund_type):
+            logging.info(f"Metadata cache: {fund_type} universe is stale, refreshing in background")
+            self.refresh_in_background(fund_type)
+        return self.universes[fund_type]["funds"]
+
+    def name(self, code):
+        for entry in self.universes.values():
+            info = entry["funds"].get(code)
+            if info and info.get('name'):
+                return info['name']
+        return self.names.get(code)
+
+    def set_name(self, code, name):
+        with self._lock:
+            self.names[code] = name
+            self._dirty = True
+
+    def save_if_dirty(self):
+        if self._dirty:
+            self.save()
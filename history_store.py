@@ -0,0 +1,368 @@
+import os
+import json
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history")
+
+# Store field -> borsapy history column. Every field is kept as a funds x dates float64 panel
+# (NaN = no row published for that fund on that date).
+FIELDS = {
+    "price": "Price",
+    "size": "FundSize",
+    "shares": "Shares",
+    "investors": "Investors",
+}
+SHARES_ALIASES = ("Shares", "Tedavüldeki Pay Sayısı")
+
+
+def to_day(value):
+    return np.datetime64(pd.Timestamp(value).date(), "D")
+
+
+def normalize_history(df):
+    # Turn a borsapy history frame into a date-indexed frame holding the store fields only
+    if df is None or df.empty:
+        return pd.DataFrame(columns=list(FIELDS))
+    shares_col = next((c for c in SHARES_ALIASES if c in df.columns), None)
+    out = pd.DataFrame(index=pd.DatetimeIndex(df.index).normalize())
+    out["price"] = pd.to_numeric(df["Price"], errors="coerce").values
+    out["size"] = pd.to_numeric(df["FundSize"], errors="coerce").values if "FundSize" in df.columns else np.nan
+    if shares_col is not None:
+        out["shares"] = pd.to_numeric(df[shares_col], errors="coerce").values
+    else:
+        out["shares"] = out["size"] / out["price"]
+    out["investors"] = pd.to_numeric(df["Investors"], errors="coerce").values if "Investors" in df.columns else np.nan
+    out = out[~out.index.duplicated(keep="last")].sort_index()
+    return out
+
+
+def history_arrays(df):
+    # normalize_history() as (dates, rows x FIELDS array) without building a frame: the last row per date, sorted
+    if df is None or df.empty:
+        return np.array([], dtype="datetime64[D]"), np.empty((0, len(FIELDS)))
+    def column(name):
+        return pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=float) if name in df.columns else np.full(len(df), np.nan)
+    shares_col = next((c for c in SHARES_ALIASES if c in df.columns), None)
+    price, size = column("Price"), column("FundSize")
+    shares = column(shares_col) if shares_col is not None else size / price
+    dates = pd.DatetimeIndex(df.index).normalize().values.astype("datetime64[D]")
+    order = np.argsort(dates, kind="stable")
+    dates, values = dates[order], np.column_stack([price, size, shares, column("Investors")])[order]
+    last = np.append(dates[1:] != dates[:-1], True)
+    return dates[last], values[last]
+
+
+class HistoryStore:
+    """Funds x dates panel of Price/FundSize/Shares/Investors, partitioned by calendar year.
+
+    codes.json holds the fund rows shared by every partition and <year>/ holds that year's
+    dates.npy plus one .npy per field. Partitions are memory-mapped on load, so a query reads only
+    the years, rows and fields it asks for and a daily run only rewrites the current year.
+    """
+
+    def __init__(self, root=HISTORY_DIR):
+        self.root = root
+        self.codes = []
+        # year -> {"dates": datetime64[D] array, field: array (mapped lazily)}
+        self._parts = {}
+        self._dirty = set()
+        # code -> earliest date a backfill was requested from (funds younger than that have no older rows)
+        self.backfilled = {}
+        self._row = {}
+        # code -> date a complete bulk refresh (tefas_bulk) has written that fund's rows up to
+        self.bulk_through = {}
+        # code -> repeated dates dropped from the frames staged this run (data_quality's DUPLICATE_DATES)
+        self.duplicates = {}
+        self._pending = {}
+        # (codes, dates, {field: values}) batches from stage_rows()
+        self._pending_rows = []
+        self._lock = threading.Lock()
+
+    def _path(self, *names):
+        return os.path.join(self.root, *names)
+
+    @property
+    def dates(self):
+        parts = [self._parts[year]["dates"] for year in sorted(self._parts)]
+        return np.concatenate(parts) if parts else np.array([], dtype="datetime64[D]")
+
+    def load(self):
+        codes_path = self._path("codes.json")
+        if not os.path.exists(codes_path):
+            return self
+        with open(codes_path, "r", encoding="utf-8") as f:
+            self.codes = json.load(f)
+        self._row = {code: i for i, code in enumerate(self.codes)}
+        if os.path.exists(self._path("backfill.json")):
+            with open(self._path("backfill.json"), "r", encoding="utf-8") as f:
+                self.backfilled = json.load(f)
+        if os.path.exists(self._path("dates.npy")):
+            self._load_flat()
+        for name in os.listdir(self.root):
+            if name.isdigit() and os.path.exists(self._path(name, "dates.npy")):
+                self._parts[int(name)] = {"dates": np.load(self._path(name, "dates.npy")).astype("datetime64[D]")}
+        logging.info(f"History store loaded: {len(self.codes)} funds x {len(self.dates)} dates in {len(self._parts)} yearly partitions")
+        return self
+
+    def _load_flat(self):
+        # Stores written before partitioning kept one flat panel per field; split it by year on load
+        dates = np.load(self._path("dates.npy")).astype("datetime64[D]")
+        data = {field: np.load(self._path(f"{field}.npy")) for field in FIELDS}
+        years = dates.astype("datetime64[Y]").astype(int) + 1970
+        for year in np.unique(years):
+            cols = years == year
+            self._parts[int(year)] = {"dates": dates[cols], **{field: data[field][:, cols] for field in FIELDS}}
+            self._dirty.add(int(year))
+
+    def _field(self, year, field):
+        part = self._parts[year]
+        if field not in part:
+            part[field] = np.load(self._path(str(year), f"{field}.npy"), mmap_mode="r")
+        return part[field]
+
+    def _write(self, path, arr):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, path)
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        # Only partitions touched by flush() are rewritten, each file through a temp name
+        for year in sorted(self._dirty):
+            part = self._parts[year]
+            os.makedirs(self._path(str(year)), exist_ok=True)
+            self._write(self._path(str(year), "dates.npy"), part["dates"])
+            for field in FIELDS:
+                self._write(self._path(str(year), f"{field}.npy"), part[field])
+        self._dirty.clear()
+        for name in ["codes.json", "backfill.json"]:
+            tmp = self._path(name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.codes if name == "codes.json" else self.backfilled, f)
+            os.replace(tmp, self._path(name))
+        for name in ["dates.npy"] + [f"{field}.npy" for field in FIELDS]:
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+
+    def window(self, start=None, end=None, rows=None, fields=FIELDS):
+        # (dates, {field: rows x dates array}) for [start, end], touching only the partitions in range
+        rows = np.arange(len(self.codes)) if rows is None else np.asarray(rows, dtype=int)
+        start = to_day(start) if start is not None else None
+        end = to_day(end) if end is not None else None
+        dates, chunks = [], {field: [] for field in fields}
+        for year in sorted(self._parts):
+            part_dates = self._parts[year]["dates"]
+            cols = np.ones(len(part_dates), dtype=bool)
+            if start is not None:
+                cols &= part_dates >= start
+            if end is not None:
+                cols &= part_dates <= end
+            if not cols.any():
+                continue
+            cols = np.flatnonzero(cols)
+            dates.append(part_dates[cols])
+            for field in fields:
+                arr = self._field(year, field)
+                # Funds added after this partition was written have no rows in it
+                out = np.full((len(rows), len(cols)), np.nan)
+                stored = rows < arr.shape[0]
+                if stored.any():
+                    out[stored] = arr[np.ix_(rows[stored], cols)]
+                chunks[field].append(out)
+        if not dates:
+            return np.array([], dtype="datetime64[D]"), {field: np.empty((len(rows), 0)) for field in fields}
+        return np.concatenate(dates), {field: np.concatenate(chunks[field], axis=1) for field in fields}
+
+    def _edge_dates(self, rows, last, published=False):
+        # Per row: last (or first) date with a row (or with a positive price, i.e. actually published),
+        # scanning years from that end
+        found = np.full(len(rows), np.datetime64("NaT"), dtype="datetime64[D]")
+        todo = np.ones(len(rows), dtype=bool)
+        for year in sorted(self._parts, reverse=last):
+            price = self._field(year, "price")
+            sel = todo & (rows < price.shape[0])
+            if not sel.any():
+                continue
+            valid = price[rows[sel]] > 0 if published else ~np.isnan(price[rows[sel]])
+            has_any = valid.any(axis=1)
+            idx = len(valid[0]) - 1 - np.argmax(valid[:, ::-1], axis=1) if last else np.argmax(valid, axis=1)
+            hit = np.flatnonzero(sel)[has_any]
+            found[hit] = self._parts[year]["dates"][idx[has_any]]
+            todo[hit] = False
+            if not todo.any():
+                break
+        return found
+
+    def last_dates(self):
+        # code -> last stored date, price-0 placeholder rows included; lagging-fund checks use published_dates()
+        if not self.codes or not self._parts:
+            return {}
+        found = self._edge_dates(np.arange(len(self.codes)), last=True)
+        return {code: found[i] for i, code in enumerate(self.codes) if not np.isnat(found[i])}
+
+    def last_date(self, code):
+        row = self._row.get(code)
+        if row is None:
+            return None
+        found = self._edge_dates(np.array([row]), last=True)[0]
+        return None if np.isnat(found) else pd.Timestamp(found)
+
+    def published_dates(self):
+        # code -> last date with a positive price; TEFAS lists a fund's new day with price 0 until it publishes
+        if not self.codes or not self._parts:
+            return {}
+        found = self._edge_dates(np.arange(len(self.codes)), last=True, published=True)
+        return {code: found[i] for i, code in enumerate(self.codes) if not np.isnat(found[i])}
+
+    def published_date(self, code):
+        row = self._row.get(code)
+        if row is None:
+            return None
+        found = self._edge_dates(np.array([row]), last=True, published=True)[0]
+        return None if np.isnat(found) else pd.Timestamp(found)
+
+    def first_date(self, code):
+        row = self._row.get(code)
+        if row is None:
+            return None
+        found = self._edge_dates(np.array([row]), last=False)[0]
+        return None if np.isnat(found) else pd.Timestamp(found)
+
+    def needs_backfill(self, code, since):
+        # True when stored rows start well after `since` and no backfill from that far back was tried
+        since = pd.Timestamp(since).normalize()
+        with self._lock:
+            tried = self.backfilled.get(code)
+        if tried is not None and pd.Timestamp(tried) <= since:
+            return False
+        first = self.first_date(code)
+        # A few days of slack for holidays at the start of the window
+        return first is not None and first > since + pd.Timedelta(days=7)
+
+    def mark_backfilled(self, code, since):
+        with self._lock:
+            self.backfilled[code] = pd.Timestamp(since).strftime("%Y-%m-%d")
+
+    def frame(self, code, start=None):
+        # Stored plus staged rows of one fund, in borsapy's column layout
+        row = self._row.get(code)
+        if row is not None:
+            dates, data = self.window(start=start, rows=[row])
+            valid = ~np.isnan(data["price"][0])
+            df = pd.DataFrame(
+                {field: data[field][0, valid] for field in FIELDS},
+                index=pd.DatetimeIndex(dates[valid]),
+            )
+        else:
+            df = pd.DataFrame(columns=list(FIELDS), dtype=float, index=pd.DatetimeIndex([]))
+        with self._lock:
+            staged = self._pending.get(code)
+        if staged is not None:
+            df = pd.concat([df, staged]) if not df.empty else staged.copy()
+            df = df[~df.index.duplicated(keep="last")].sort_index()
+        if start is not None:
+            df = df[df.index >= pd.Timestamp(start)]
+        df = df.rename(columns=FIELDS)
+        df["Investors"] = df["Investors"].fillna(0)
+        return df
+
+    def stage(self, code, df):
+        # Queue fetched rows; workers call this concurrently and flush() merges everything in one pass
+        frame = normalize_history(df)
+        if frame.empty:
+            return
+        with self._lock:
+            if len(df) > len(frame):
+                self.duplicates[code] = self.duplicates.get(code, 0) + len(df) - len(frame)
+            if code in self._pending:
+                frame = pd.concat([self._pending[code], frame])
+                frame = frame[~frame.index.duplicated(keep="last")].sort_index()
+            self._pending[code] = frame
+
+    def stage_rows(self, codes, dates, **fields):
+        # Bulk variant of stage() for many funds at once: one long array per store field.
+        # Merged by the next flush() after (so over) the per-fund frames; frame() does not see them before.
+        batch = (np.asarray(codes, dtype=object), np.asarray(dates, dtype="datetime64[D]"),
+                 {field: np.asarray(fields[field], dtype=float) for field in FIELDS})
+        with self._lock:
+            self._pending_rows.append(batch)
+
+    def staged_rows(self):
+        # Everything staged and not flushed yet as one stage_rows() batch (per-fund frames first, as flush()
+        # applies them), e.g. for a screening worker to hand its fetches to the process that saves the store
+        with self._lock:
+            frames = list(self._pending.items())
+            batches = list(self._pending_rows)
+        codes = [np.full(len(frame), code, dtype=object) for code, frame in frames] + [batch[0] for batch in batches]
+        dates = [frame.index.values.astype("datetime64[D]") for _, frame in frames] + [batch[1] for batch in batches]
+        values = {field: np.concatenate([np.empty(0)] + [frame[field].to_numpy(dtype=float) for _, frame in frames]
+                                        + [batch[2][field] for batch in batches]) for field in FIELDS}
+        return (np.concatenate([np.empty(0, dtype=object)] + codes),
+                np.concatenate([np.empty(0, dtype="datetime64[D]")] + dates), values)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            pending_rows, self._pending_rows = self._pending_rows, []
+        if not pending and not pending_rows:
+            return 0
+
+        bulk_codes = pd.unique(np.concatenate([batch[0] for batch in pending_rows])) if pending_rows else []
+        for code in list(pending) + list(bulk_codes):
+            if code not in self._row:
+                self._row[code] = len(self.codes)
+                self.codes.append(code)
+        if pending_rows:
+            bulk_rows = pd.Series(np.concatenate([batch[0] for batch in pending_rows])).map(self._row).to_numpy(dtype=np.int64)
+            bulk_dates = np.concatenate([batch[1] for batch in pending_rows])
+            bulk_values = {field: np.concatenate([batch[2][field] for batch in pending_rows]) for field in FIELDS}
+            bulk_years = bulk_dates.astype("datetime64[Y]").astype(int) + 1970
+        else:
+            bulk_years = np.empty(0, dtype=int)
+
+        # Group the staged rows by year so only the touched partitions are loaded and grown
+        by_year = {}
+        for code, frame in pending.items():
+            years = frame.index.year
+            for year in np.unique(years):
+                by_year.setdefault(int(year), []).append((self._row[code], frame[years == year]))
+
+        for year in sorted(set(by_year) | set(np.unique(bulk_years).tolist())):
+            items = by_year.get(year, [])
+            in_year = np.flatnonzero(bulk_years == year)
+            part = self._parts.get(year)
+            old_dates = part["dates"] if part else np.array([], dtype="datetime64[D]")
+            new_dates = np.unique(np.concatenate(
+                [old_dates] + [frame.index.values.astype("datetime64[D]") for _, frame in items]
+                + ([bulk_dates[in_year]] if len(in_year) else [])
+            ))
+            old_cols = np.searchsorted(new_dates, old_dates)
+            grown = {"dates": new_dates}
+            # Grow the partition once for the whole batch instead of once per fund
+            for field in FIELDS:
+                arr = np.full((len(self.codes), len(new_dates)), np.nan)
+                if part and len(old_dates):
+                    old = self._field(year, field)
+                    arr[:old.shape[0], old_cols] = old
+                grown[field] = arr
+            for row, frame in items:
+                cols = np.searchsorted(new_dates, frame.index.values.astype("datetime64[D]"))
+                for field in FIELDS:
+                    values = frame[field].to_numpy(dtype=float)
+                    keep = ~np.isnan(values)
+                    grown[field][row, cols[keep]] = values[keep]
+            if len(in_year):
+                cols = np.searchsorted(new_dates, bulk_dates[in_year])
+                for field in FIELDS:
+                    values = bulk_values[field][in_year]
+                    keep = ~np.isnan(values)
+                    grown[field][bulk_rows[in_year][keep], cols[keep]] = values[keep]
+            # Replacing the dict drops the memory maps of the old files
+            self._parts[year] = grown
+            self._dirty.add(year)
+        return len(set(pending) | set(bulk_codes))
@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import asyncio
 import subprocess
@@ -570,13 +571,13 @@ document.addEventListener('DOMContentLoaded', function() {{
 </script>"""
 
 
-async def main():
+async def main(data_file="data.json", output_file="infographic.png"):
     base_dir = os.path.dirname(__file__)
-    data_path = os.path.join(base_dir, "data.json")
+    data_path = os.path.join(base_dir, data_file)
     config_path = os.path.join(base_dir, "runtime_config.json")
     template_path = os.path.join(base_dir, "template", "index.html")
     output_html_path = os.path.join(base_dir, "template", "filled_index.html")
-    output_img_path = os.path.join(base_dir, "infographic.png")
+    output_img_path = os.path.join(base_dir, output_file)
     
     with open(data_path, "r", encoding="utf-8") as f:
         data = json.load(f)
@@ -618,6 +619,27 @@ async def main():
         title = "HAFTALIK TEFAS ÖZETİ"
         period_label = "Haftalık"
         period_note = "(Geçen Haftaya Göre)"
+    elif period_type == "quarterly":
+        title = "ÇEYREKLİK TEFAS ÖZETİ"
+        period_label = "Çeyreklik"
+        period_note = "(Çeyrek Başına Göre)"
+    elif period_type == "ytd":
+        title = "YILBAŞINDAN BERİ TEFAS ÖZETİ"
+        period_label = "Yılbaşından Beri"
+        period_note = "(Yılbaşına Göre)"
+    elif period_type == "1y":
+        title = "YILLIK TEFAS ÖZETİ"
+        period_label = "Yıllık"
+        period_note = "(Geçen Yıla Göre)"
+    elif period_type == "3y":
+        title = "3 YILLIK TEFAS ÖZETİ"
+        period_label = "3 Yıllık"
+        period_note = "(3 Yıl Öncesine Göre)"
+    elif period_type == "custom":
+        date_range = data.get('date_range') or {}
+        title = "DÖNEMSEL TEFAS ÖZETİ"
+        period_label = "Dönemsel"
+        period_note = f"({date_range.get('start', '')} - {date_range.get('end', '')})"
     else:
         title = "AYLIK TEFAS ÖZETİ"
         period_label = "Aylık"
@@ -857,4 +879,5 @@ async def main():
     print(f"Generated successfully: {output_img_path}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # Optional args: data file and output image, e.g. data_weekly.json infographic_weekly.png
+    asyncio.run(main(*sys.argv[1:3]))
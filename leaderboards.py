@@ -0,0 +1,96 @@
+import heapq
+import itertools
+
+from signal_engine import top_k
+
+
+class TopK:
+    """Bounded heap keeping the k best items seen so far: O(log k) per push.
+
+    largest=True keeps the k highest scores, otherwise the k lowest. Ties go to the item
+    pushed first, matching what a stable full sort followed by [:k] would return.
+    """
+
+    def __init__(self, k, largest=True):
+        self.k = k
+        self.sign = 1 if largest else -1
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, score, item):
+        # Heap root is the current worst entry; among equal scores the latest push is the worst
+        entry = (self.sign * score, -next(self._seq), item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def items(self):
+        return [item for _, _, item in sorted(self._heap, key=lambda e: (-e[0], -e[1]))]
+
+
+class LeaderboardAccumulator:
+    """Streaming version of the fund leaderboards in build_flow_report.
+
+    add() each (already filtered) fund result as it arrives; snapshot() returns the current top lists.
+    """
+
+    def __init__(self, sort_mode='tl', k=5):
+        self.sort_key = 'net_flow' if sort_mode == 'tl' else 'flow_pct'
+        self.count = 0
+        self.inflows = TopK(k, largest=True)
+        self.outflows = TopK(k, largest=False)
+        self.inv_in = TopK(k, largest=True)
+        self.inv_out = TopK(k, largest=False)
+        self.gainers = TopK(k, largest=True)
+        self.losers = TopK(k, largest=False)
+
+    def add(self, r):
+        self.count += 1
+        flow = r[self.sort_key]
+        # Positive and negative flows rank separately
+        if flow > 0: self.inflows.push(flow, r)
+        elif flow < 0: self.outflows.push(flow, r)
+        if r['inv_change'] > 0: self.inv_in.push(r['inv_change'], r)
+        elif r['inv_change'] < 0: self.inv_out.push(r['inv_change'], r)
+        # Unpublished prices are kept out upstream by the data-quality codes
+        ret = r.get('return_pct', 0)
+        if ret > 0: self.gainers.push(ret, r)
+        elif ret < 0: self.losers.push(ret, r)
+
+    def extend(self, results):
+        for r in results:
+            self.add(r)
+        return self
+
+    def snapshot(self):
+        return {
+            'top_inflows': self.inflows.items(),
+            'top_outflows': self.outflows.items(),
+            'top_inv_in': self.inv_in.items(),
+            'top_inv_out': self.inv_out.items(),
+            'top_gainers': self.gainers.items(),
+            'top_losers': self.losers.items(),
+            'funds_ranked': self.count
+        }
+
+
+def rank_leaderboards(results, sort_mode='tl', k=5):
+    # Batch counterpart of LeaderboardAccumulator over a FlowResults column store; same snapshot layout.
+    # top_k partitions around the k-th score (O(n)) and sorts only those; lowest-first lists rank the negated
+    # column. Ties stay in row order, as in TopK.
+    flow = results.net_flow if sort_mode == 'tl' else results.flow_pct
+    inv = results.inv_change
+    ret = results.return_pct
+    return {
+        'top_inflows': results.records(top_k(flow, k, flow > 0)),
+        'top_outflows': results.records(top_k(-flow, k, flow < 0)),
+        'top_inv_in': results.records(top_k(inv, k, inv > 0)),
+        'top_inv_out': results.records(top_k(-inv, k, inv < 0)),
+        'top_gainers': results.records(top_k(ret, k, ret > 0)),
+        'top_losers': results.records(top_k(-ret, k, ret < 0)),
+        'funds_ranked': len(results)
+    }
@@ -0,0 +1,166 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from fetch_pipeline import fetch_many
+
+HOLDINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fund_holdings.json")
+
+# KAP portfolio disclosures are monthly, so a month-old holdings list is as fresh as it gets
+HOLDINGS_TTL = timedelta(days=30)
+
+# Allocation column that stands for "shares of other funds"; look-through replaces it with what those funds hold
+FUND_SHARE_ASSETS = ("Yatırım Fonları Katılma Payları",)
+FUND_HOLDING_TYPES = ("fund", "etf")
+
+# Holdings are only worth fetching for funds with a meaningful fund-share weight
+LOOK_THROUGH_MIN_WEIGHT = 5.0
+
+
+class HoldingsCache:
+    """Persisted holder -> {held fund code: weight %} map from KAP portfolio disclosures."""
+
+    def __init__(self, fetch_fn=None, path=HOLDINGS_PATH, ttl=HOLDINGS_TTL):
+        # fetch_fn(code) -> DataFrame with symbol, weight, type (borsapy Fund.get_holdings layout)
+        self.fetch_fn = fetch_fn
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable holdings cache {self.path}: {e}")
+        return self
+
+    def save(self):
+        with self._lock:
+            text = json.dumps(self.entries, ensure_ascii=False)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def holdings(self):
+        return {code: entry["holdings"] for code, entry in self.entries.items()}
+
+    def stale(self, codes):
+        now = datetime.now()
+        out = []
+        for code in codes:
+            entry = self.entries.get(code)
+            if entry is None or now - datetime.fromisoformat(entry["fetched_at"]) > self.ttl:
+                out.append(code)
+        return out
+
+    def _fetch(self, code):
+        df = self.fetch_fn(code)
+        held = {}
+        if df is not None and not df.empty:
+            funds = df[df["type"].isin(FUND_HOLDING_TYPES)]
+            for symbol, weight in zip(funds["symbol"].astype(str).str.upper(), funds["weight"].astype(float)):
+                held[symbol] = held.get(symbol, 0.0) + weight
+        with self._lock:
+            self.entries[code] = {"fetched_at": datetime.now().isoformat(timespec="seconds"), "holdings": held}
+        return held
+
+    def refresh(self, codes, concurrency=2, rate=1.0):
+        # Each disclosure is a PDF download plus a parse, so keep the pipeline gentle
+        if self.fetch_fn is None or not codes:
+            return 0
+        fetched = fetch_many(codes, self._fetch, concurrency=concurrency, rate=rate)
+        self.save()
+        return len(fetched)
+
+
+def holdings_matrix(holdings, codes, has_data=None):
+    # COO triplets of the fund -> fund holding matrix (fractions of the holder's NAV) plus each
+    # holder's total disclosed fund-share weight, including funds outside `codes`
+    index = {code: i for i, code in enumerate(codes)}
+    rows, cols, weights = [], [], []
+    disclosed = np.zeros(len(codes))
+    for holder, held in holdings.items():
+        i = index.get(holder)
+        if i is None:
+            continue
+        for code, weight in held.items():
+            disclosed[i] += weight
+            j = index.get(code)
+            if j is None or j == i or (has_data is not None and not has_data[j]):
+                continue
+            rows.append(i); cols.append(j); weights.append(weight / 100)
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), np.array(weights, dtype=float), disclosed
+
+
+def propagate(rows, cols, weights, matrix):
+    # Sparse (funds x funds) @ dense (funds x assets), one bincount per asset column
+    out = np.zeros_like(matrix)
+    for a in range(matrix.shape[1]):
+        out[:, a] = np.bincount(rows, weights=weights * matrix[cols, a], minlength=matrix.shape[0])
+    return out
+
+
+def look_through(direct, codes, assets, holdings, tol=1e-6, max_iter=50):
+    # Effective exposure E = D + H @ E, where D is each fund's own allocation with the resolved part of
+    # its fund-share weight removed and H spreads that weight over the held funds. Iterated until stable.
+    direct = np.asarray(direct, dtype=float)
+    fund_cols = [assets.index(a) for a in FUND_SHARE_ASSETS if a in assets]
+    if not fund_cols or not holdings or not len(direct):
+        return direct.copy(), 0
+
+    has_data = direct.sum(axis=1) > 0
+    rows, cols, weights, disclosed = holdings_matrix(holdings, codes, has_data)
+    if not len(weights):
+        return direct.copy(), 0
+
+    # Disclosures are monthly and the allocation is daily: keep the disclosed mix but scale it to today's weight
+    fund_weight = direct[:, fund_cols].sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(disclosed > 0, fund_weight / disclosed, 0.0)
+    weights = weights * scale[rows]
+    resolved = np.bincount(rows, weights=weights * 100, minlength=len(codes))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        remaining = np.where(fund_weight > 0, 1 - resolved / fund_weight, 1.0)
+    base = direct.copy()
+    base[:, fund_cols] *= np.clip(remaining, 0, 1)[:, None]
+
+    effective = base
+    for iteration in range(1, max_iter + 1):
+        nxt = base + propagate(rows, cols, weights, effective)
+        delta = np.abs(nxt - effective).max()
+        effective = nxt
+        if delta < tol:
+            break
+    else:
+        logging.warning(f"Look-through did not converge in {max_iter} iterations (last change {delta:.2e})")
+    return effective, iteration
+
+
+def effective_diff(alloc_store, holdings):
+    # Look-through version of AllocationStore.diff(): latest vs previous snapshot of every fund
+    latest, latest_date = alloc_store.as_of()
+    prev, prev_date = alloc_store.previous_snapshot(latest_date)
+    eff_latest, n_iter = look_through(latest, alloc_store.codes, alloc_store.assets, holdings)
+    eff_prev, _ = look_through(prev, alloc_store.codes, alloc_store.assets, holdings)
+    logging.info(f"Look-through converged in {n_iter} iterations for {len(alloc_store.codes)} funds")
+    has_both = (latest_date >= 0) & (prev_date >= 0)
+    delta = np.where(has_both[:, None], eff_latest - eff_prev, 0)
+    return delta, eff_latest, has_both
+
+
+def fund_of_funds_codes(alloc_store, min_weight=LOOK_THROUGH_MIN_WEIGHT):
+    # Funds whose latest allocation holds at least min_weight % in other funds
+    fund_cols = [alloc_store.assets.index(a) for a in FUND_SHARE_ASSETS if a in alloc_store.assets]
+    if not fund_cols:
+        return []
+    latest, _ = alloc_store.as_of()
+    weight = latest[:, fund_cols].sum(axis=1)
+    return [alloc_store.codes[i] for i in np.flatnonzero(weight >= min_weight)]
@@ -0,0 +1,321 @@
+import os
+import sys
+import time
+import zlib
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from history_store import HistoryStore
+from allocation_store import AllocationStore
+from fund_metadata import MetadataCache
+
+# Where to find a borsapy checkout that is not pip-installed (e.g. a local clone)
+BORSAPY_PATH_ENV = "BORSAPY_PATH"
+
+# borsapy period strings -> calendar days
+PERIOD_DAYS = {"1d": 1, "5d": 5, "1mo": 31, "3mo": 92, "6mo": 183, "1y": 366, "2y": 731, "3y": 1096, "5y": 1827, "max": 3660}
+
+# Fund types the synthetic universe cycles through (real TEFAS umbrella names, so categories resolve)
+SYNTHETIC_FUND_TYPES = [
+    "Hisse Senedi Şemsiye Fonu",
+    "Serbest Şemsiye Fonu",
+    "Para Piyasası Şemsiye Fonu",
+    "Borçlanma Araçları Şemsiye Fonu",
+    "Karma Şemsiye Fonu",
+    "Değişken Şemsiye Fonu",
+    "Katılım Şemsiye Fonu",
+    "Fon Sepeti Şemsiye Fonu",
+    "Kıymetli Madenler Şemsiye Fonu",
+]
+# Pension (EMK) funds: TEFAS titles them "... <kind> Emeklilik Yatırım Fonu"
+SYNTHETIC_PENSION_KINDS = ["Hisse Senedi", "Borçlanma Araçları", "Katılım", "Dengeli Değişken", "Para Piyasası",
+                           "Altın", "Katkı", "OKS Standart", "BIST 30 Endeks", "Fon Sepeti"]
+SYNTHETIC_ASSETS = ["Hisse Senedi", "Devlet Tahvili", "Ters Repo", "Vadeli Mevduat", "Yabancı Yatırım Fonu", "BPP"]
+SYNTHETIC_START = "2020-01-01"
+
+
+def window_dates(dates, period=None, start=None, end=None):
+    # The slice of `dates` a borsapy-style (period | start, end) request covers
+    if start is not None:
+        dates = dates[dates >= pd.Timestamp(start).normalize()]
+    elif period is not None:
+        dates = dates[dates > pd.Timestamp(datetime.now().date()) - timedelta(days=PERIOD_DAYS.get(period, 92))]
+    if end is not None:
+        dates = dates[dates <= pd.Timestamp(end).normalize()]
+    return dates
+
+
+class BorsapyFund:
+    # borsapy.Fund whose history() answers "no rows in this window" with an empty frame, like the other
+    # providers; every other upstream error still raises so the fetch pipeline can retry it
+    def __init__(self, fund, no_data_error=()):
+        self.fund = fund
+        self.no_data_error = no_data_error
+
+    def __getattr__(self, name):
+        return getattr(self.fund, name)
+
+    def history(self, *args, **kwargs):
+        try:
+            return self.fund.history(*args, **kwargs)
+        except self.no_data_error:
+            return pd.DataFrame()
+
+
+class BorsapyProvider:
+    """Live TEFAS data through borsapy (the default)."""
+
+    name = "borsapy"
+
+    def __init__(self, path=None):
+        path = path or os.environ.get(BORSAPY_PATH_ENV)
+        if path and path not in sys.path:
+            sys.path.append(path)
+        import borsapy
+        self.bp = borsapy
+        # Resolved once: an `except` naming a missing attribute would itself raise on every upstream error.
+        # () catches nothing, so without it every error reaches the retries.
+        self.no_data_error = getattr(borsapy, "DataNotAvailableError", ())
+
+    def fund(self, code):
+        return BorsapyFund(self.bp.Fund(code), self.no_data_error)
+
+    def screen_funds(self, fund_type="YAT", limit=5000):
+        return self.bp.screen_funds(fund_type=fund_type, limit=limit)
+
+
+class StoreFund:
+    def __init__(self, provider, code):
+        self.provider = provider
+        self.code = code
+
+    @property
+    def info(self):
+        return {'name': self.provider.metadata.name(self.code) or ''}
+
+    def history(self, period=None, start=None, end=None):
+        df = self.provider.history_store.frame(self.code)
+        return df if df.empty else df.loc[window_dates(df.index, period, start, end)]
+
+    def allocation_history(self, period="1mo", start=None, end=None):
+        df = self.provider.alloc_store.frame(self.code)
+        dates = pd.DatetimeIndex(df['Date'])
+        return df[dates.isin(window_dates(dates.unique(), period, start, end))]
+
+    def get_holdings(self, api_key=None):
+        return pd.DataFrame(columns=["symbol", "weight", "type"])
+
+
+class StoreProvider:
+    """Offline provider that serves whatever the local history and allocation stores hold.
+
+    Reads from its own store instances, so a run writing to the default stores never sees its
+    own staged rows coming back as "upstream" data.
+    """
+
+    name = "store"
+
+    def __init__(self, history_store=None, alloc_store=None, metadata=None):
+        self.history_store = history_store or HistoryStore().load()
+        self.alloc_store = alloc_store or AllocationStore().load()
+        self.metadata = metadata or MetadataCache(None).load()
+
+    def fund(self, code):
+        return StoreFund(self, code)
+
+    def screen_funds(self, fund_type="YAT", limit=5000):
+        # Funds the metadata cache knows, else every stored fund with an unknown type
+        funds = self.metadata.universes.get(fund_type, {}).get("funds")
+        if funds:
+            rows = [{'fund_code': code, 'name': info.get('name', ''), 'fund_type': info['fund_type']} for code, info in funds.items()]
+        else:
+            rows = [{'fund_code': code, 'name': self.metadata.name(code) or '', 'fund_type': ''} for code in self.history_store.codes]
+        return rows[:limit]
+
+
+class SyntheticFund:
+    def __init__(self, provider, code):
+        self.provider = provider
+        self.code = code
+
+    @property
+    def info(self):
+        self.provider.call("info", self.code)
+        return {'name': self.provider.fund_name(self.code)}
+
+    def history(self, period=None, start=None, end=None):
+        self.provider.call("history", self.code)
+        return self.provider.history_frame(self.code, period, start, end)
+
+    def allocation_history(self, period="1mo", start=None, end=None):
+        self.provider.call("allocation", self.code)
+        return self.provider.allocation_frame(self.code, period, start, end)
+
+    def get_holdings(self, api_key=None):
+        self.provider.call("holdings", self.code)
+        return self.provider.holdings_frame(self.code)
+
+
+class SyntheticProvider:
+    """Deterministic fixture universe of `n_funds` funds for offline runs and load tests.
+
+    Every fund's history is a seeded random walk, identical on every run; each upstream call
+    sleeps `latency` seconds and fails with probability `failure_rate`, like a slow TEFAS.
+    The EMK universe has as many pension funds (codes E0000...) as the YAT one (S0000...).
+    """
+
+    name = "synthetic"
+
+    def __init__(self, n_funds=2000, latency=0.0, failure_rate=0.0, seed=0, end=None):
+        self.n_funds = n_funds
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.dates = pd.bdate_range(SYNTHETIC_START, pd.Timestamp(end or datetime.now().date()))
+        self.codes = [f"S{i:04d}" for i in range(n_funds)]
+        self.pension_codes = [f"E{i:04d}" for i in range(n_funds)]
+        self.calls = {}
+        self._failures = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def call(self, kind, code):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            fail = self._failures.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise ConnectionError(f"synthetic {kind} failure for {code}")
+
+    def _rng(self, code, salt=0):
+        return np.random.default_rng([self.seed, zlib.crc32(code.encode()), salt])
+
+    def fund_type(self, code):
+        if code.startswith("E"):
+            return "Emeklilik Yatırım Fonu"
+        return SYNTHETIC_FUND_TYPES[zlib.crc32(code.encode()) % len(SYNTHETIC_FUND_TYPES)]
+
+    def fund_name(self, code):
+        if code.startswith("E"):
+            kind = SYNTHETIC_PENSION_KINDS[zlib.crc32(code.encode()) % len(SYNTHETIC_PENSION_KINDS)]
+            return f"{code} EMEKLİLİK A.Ş. {kind.upper()} EMEKLİLİK YATIRIM FONU"
+        return f"{code} {self.fund_type(code).replace('Şemsiye Fonu', 'Fonu').upper()}"
+
+    def universe_codes(self, fund_type="YAT"):
+        return self.pension_codes if fund_type == "EMK" else self.codes
+
+    def fund(self, code):
+        return SyntheticFund(self, code)
+
+    def screen_funds(self, fund_type="YAT", limit=5000):
+        return [{'fund_code': code, 'name': self.fund_name(code), 'fund_type': self.fund_type(code)}
+                for code in self.universe_codes(fund_type)[:limit]]
+
+    def history_frame(self, code, period=None, start=None, end=None):
+        # The full walk is generated from the fund's seed and then sliced, so any window is consistent
+        rng = self._rng(code)
+        n = len(self.dates)
+        listed = int(rng.integers(0, n // 2)) if rng.random() < 0.2 else 0
+        price = np.exp(np.cumsum(rng.normal(0.0004, 0.012, n))) * rng.uniform(1, 20)
+        shares = np.maximum(np.cumsum(rng.normal(0, 2e4, n)) + rng.uniform(1e6, 5e7), 1e5)
+        investors = np.maximum(np.cumsum(rng.integers(-20, 21, n)) + int(rng.integers(50, 20000)), 1)
+        df = pd.DataFrame({'Price': price, 'FundSize': price * shares, 'Shares': shares, 'Investors': investors},
+                          index=self.dates).iloc[listed:]
+        return df.loc[window_dates(df.index, period, start, end)]
+
+    def allocation_frame(self, code, period="1mo", start=None, end=None):
+        rng = self._rng(code, 1)
+        base = rng.dirichlet(np.ones(len(SYNTHETIC_ASSETS)) * 0.7)
+        dates = window_dates(self.dates, period, start, end)
+        drift = np.cumsum(self._rng(code, 2).normal(0, 0.01, (len(self.dates), len(SYNTHETIC_ASSETS))), axis=0)
+        drift = drift[self.dates.get_indexer(dates)]
+        weights = np.clip(base + drift, 0, None)
+        weights = weights / np.maximum(weights.sum(axis=1, keepdims=True), 1e-9) * 100
+        return pd.DataFrame({
+            'Date': np.repeat(dates, len(SYNTHETIC_ASSETS)),
+            'asset_name': np.tile(SYNTHETIC_ASSETS, len(dates)),
+            'weight': weights.ravel(),
+        })
+
+    def holdings_frame(self, code):
+        # A fund of funds holds a few other synthetic funds
+        rng = self._rng(code, 3)
+        held = rng.choice(self.codes, size=min(3, len(self.codes)), replace=False)
+        held = [c for c in held if c != code]
+        return pd.DataFrame({'symbol': held, 'weight': rng.dirichlet(np.ones(len(held))) * 30, 'type': 'fund'})
+
+
+PROVIDERS = {"borsapy": BorsapyProvider, "store": StoreProvider, "synthetic": SyntheticProvider}
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def make_provider(name, **kwargs):
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown data provider {name!r} (choose from {', '.join(PROVIDERS)})")
+    return PROVIDERS[name](**kwargs)
+
+
+def set_provider(provider):
+    global _active
+    with _active_lock:
+        _active = provider
+    return provider
+
+
+def active_provider():
+    # borsapy is only imported the first time something actually needs upstream data
+    global _active
+    with _active_lock:
+        if _active is None:
+            _active = BorsapyProvider()
+        return _active
+
+
+def profile(n_funds=2000, latency=0.05, failure_rate=0.0, concurrency=None, rate=None):
+    # Times the three upstream-heavy entry points against the synthetic universe in a scratch directory
+    # Imported by name so the provider lands in the same module data_fetcher reads (not __main__'s copy)
+    import data_fetcher
+    import providers
+    from fetch_pipeline import FETCH_CONCURRENCY, FETCH_RATE
+
+    provider = providers.set_provider(providers.SyntheticProvider(n_funds, latency, failure_rate))
+    concurrency = concurrency or FETCH_CONCURRENCY
+    rate = rate or FETCH_RATE
+    with tempfile.TemporaryDirectory() as tmp:
+        scratch = {'snapshot_path': os.path.join(tmp, "universe_snapshot.npz"), 'checkpoint_dir': os.path.join(tmp, "checkpoints")}
+        store = HistoryStore(os.path.join(tmp, "history"))
+        metadata = MetadataCache(provider.screen_funds, path=os.path.join(tmp, "fund_metadata.json")).load()
+        steps = [
+            ("fetch_all_flows (cold store)", lambda: data_fetcher.fetch_all_flows("weekly", store=store, concurrency=concurrency, rate=rate, resume=False, metadata=metadata, **scratch)),
+            ("fetch_all_flows (warm store)", lambda: data_fetcher.fetch_all_flows("weekly", store=store, concurrency=concurrency, rate=rate, resume=False, metadata=metadata, **scratch)),
+            ("fetch_tracked_funds", lambda: data_fetcher.fetch_tracked_funds(provider.codes[:3], "weekly", store, metadata)),
+            ("fetch_allocation_diff", lambda: [data_fetcher.fetch_allocation_diff(code) for code in provider.codes[:3]]),
+        ]
+        for label, step in steps:
+            before = dict(provider.calls)
+            t0 = time.perf_counter()
+            step()
+            elapsed = time.perf_counter() - t0
+            calls = {k: v - before.get(k, 0) for k, v in provider.calls.items() if v - before.get(k, 0)}
+            print(f"{label:<30} {elapsed:7.2f}s  calls={calls}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the fetch entry points against the synthetic provider")
+    parser.add_argument("--funds", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--rate", type=float, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    profile(args.funds, args.latency, args.failure_rate, args.concurrency, args.rate)
@@ -0,0 +1,54 @@
+import threading
+import concurrent.futures
+
+
+class RunCache:
+    """Per-run memo of upstream fetches keyed by (kind, fund_code).
+
+    Each key is fetched at most once per run: concurrent callers asking for a key that is
+    already in flight wait for that fetch instead of starting another. Failures are not
+    cached, so a retry fetches again.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._values
+
+    def get(self, kind, code, default=None):
+        with self._lock:
+            return self._values.get((kind, code), default)
+
+    def put(self, kind, code, value):
+        with self._lock:
+            self._values[(kind, code)] = value
+
+    def get_or_fetch(self, kind, code, fetch_fn):
+        key = (kind, code)
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+        if not owner:
+            return future.result()
+
+        try:
+            value = fetch_fn()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._values[key] = value
+            self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
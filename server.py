@@ -308,10 +308,48 @@ class WebServerHandler(http.server.SimpleHTTPRequestHandler):
                             <span class="btn-text">Aylık İnfografik</span>
                         </button>
                     </div>
+
+                    <div class="button-group" style="margin-top: 18px;">
+                        <button id="btn-quarterly" class="action-btn" onclick="generate('quarterly')">
+                            <div class="loader"></div>
+                            <span class="btn-text">Çeyreklik</span>
+                        </button>
+                        <button id="btn-ytd" class="action-btn" onclick="generate('ytd')">
+                            <div class="loader"></div>
+                            <span class="btn-text">Yılbaşından Beri</span>
+                        </button>
+                        <button id="btn-1y" class="action-btn" onclick="generate('1y')">
+                            <div class="loader"></div>
+                            <span class="btn-text">1 Yıllık</span>
+                        </button>
+                        <button id="btn-3y" class="action-btn" onclick="generate('3y')">
+                            <div class="loader"></div>
+                            <span class="btn-text">3 Yıllık</span>
+                        </button>
+                    </div>
+
+                    <div style="display: grid; grid-template-columns: 1fr 1fr auto; gap: 20px; margin-top: 25px; align-items: end;">
+                        <div class="input-group">
+                            <label for="rangeStart">Başlangıç Tarihi:</label>
+                            <input type="date" id="rangeStart">
+                        </div>
+                        <div class="input-group">
+                            <label for="rangeEnd">Bitiş Tarihi (boş = bugün):</label>
+                            <input type="date" id="rangeEnd">
+                        </div>
+                        <button id="btn-custom" class="action-btn" onclick="generate('custom')">
+                            <div class="loader"></div>
+                            <span class="btn-text">Tarih Aralığı İnfografik</span>
+                        </button>
+                    </div>
                 </div>
 
                 <script>
                     function generate(period) {
+                        if (period === 'custom' && !document.getElementById('rangeStart').value) {
+                            alert('Tarih aralığı için başlangıç tarihi seçin.');
+                            return;
+                        }
                         const btnId = period === 'predictions' ? 'btn-preds' : 'btn-' + period;
                         const btn = document.getElementById(btnId);
                         const loader = btn.querySelector('.loader');
@@ -370,6 +408,8 @@ class WebServerHandler(http.server.SimpleHTTPRequestHandler):
                             headers: { 'Content-Type': 'application/json' },
                             body: JSON.stringify({
                                 period: period === 'predictions' ? 'daily' : period,
+                                date_start: period === 'custom' ? document.getElementById('rangeStart').value : '',
+                                date_end: period === 'custom' ? document.getElementById('rangeEnd').value : '',
                                 tracked_funds: document.getElementById('trackedFunds').value,
                                 bg_url: bgUrl,
                                 sections: finalSections.join(','),
@@ -561,6 +601,10 @@ class WebServerHandler(http.server.SimpleHTTPRequestHandler):
             
             # Extract and map fields
             period = req_data.get('period', 'daily')
+            date_start = req_data.get('date_start', '')
+            date_end = req_data.get('date_end', '')
+            if date_start:
+                period = 'custom'
             tracked_funds = req_data.get('tracked_funds', 'TLY, DFI, PHE')
             bg_url = req_data.get('bg_url', '')
             sections = req_data.get('sections', 'inflows,outflows,cat_in,cat_out,inv_in,inv_out,divergent,momentum,crowding,category_rotation,tracked,tracked_rs,manager_actions,portfolio_diff')
@@ -621,7 +665,12 @@ class WebServerHandler(http.server.SimpleHTTPRequestHandler):
                         tracked_funds = ", ".join(current_tracked)
 
                     print(f"Running data fetcher for {period}...")
-                    subprocess.run(["python", os.path.join(DIRECTORY, "data_fetcher.py"), period, tracked_funds, selected_categories, "--sort", sort_mode], check=True)
+                    # Category/sort/period changes within 30 minutes re-filter the last universe scan instead of rescreening
+                    fetcher_args = ["python", os.path.join(DIRECTORY, "data_fetcher.py"), period, tracked_funds, selected_categories, "--sort", sort_mode, "--snapshot-max-age", "30"]
+                    if period == 'custom':
+                        # Any start/end window is answered from the stored history's prefix sums
+                        fetcher_args += ["--start", date_start] + (["--end", date_end] if date_end else [])
+                    subprocess.run(fetcher_args, check=True)
                 
                 # Write runtime config
                 runtime_path = os.path.join(DIRECTORY, "runtime_config.json")
@@ -0,0 +1,282 @@
+import os
+import glob
+import time
+import pickle
+import socket
+import logging
+import argparse
+import tempfile
+import multiprocessing
+import concurrent.futures
+from datetime import datetime
+
+import numpy as np
+
+import data_fetcher
+from data_fetcher import (decode_fetched, encode_fetched, fetch_histories, flow_partial, merge_partials, report_from_partial,
+                          universe_checkpoint_path, universe_fund_types)
+from fetch_pipeline import FETCH_CONCURRENCY, FETCH_RATE, Checkpoint
+from flow_engine import FlowPanel
+from fund_categories import build_category_index
+from fund_metadata import MetadataCache
+from history_store import HistoryStore
+from providers import active_provider, make_provider, set_provider
+
+# Spool workers poll for new task files this often, and give up after this long without any
+SPOOL_POLL_SECONDS = 0.5
+SPOOL_IDLE_SECONDS = 300
+# A claimed shard whose result has not appeared after this long (its worker died) is queued again
+SPOOL_CLAIM_TIMEOUT = 1800
+
+
+def screen_shard(task):
+    # One worker's part of a sharded scan: fetch a contiguous slice of the universe into a private copy of
+    # the history store and reduce it to one flow_partial() per (period, view). The rows it staged go back
+    # to the coordinator, the only process that writes the store.
+    set_provider(make_provider(task['provider'], **task['provider_args']))
+    store = HistoryStore(task['store_root']).load()
+    store.bulk_through.update(task['bulk_through'])
+    metadata = MetadataCache(active_provider().screen_funds, path=task['metadata_path']).load()
+    known_names = dict(metadata.names)
+    since = datetime.fromisoformat(task['since'])
+    checkpoint = Checkpoint(task['checkpoint_path'], encode_fetched, lambda code, payload: decode_fetched(code, payload, store))
+    if not task['resume']:
+        checkpoint.clear()
+
+    codes = task['codes']
+    names, histories, stale, missing = fetch_histories(codes, store, concurrency=task['concurrency'], rate=task['rate'], metadata=metadata, since=since,
+                                                       deadline=task['deadline'], checkpoint=checkpoint, snapshot_path=task['snapshot_path'])
+    rows = store.staged_rows()
+    store.flush()
+    panel = FlowPanel.from_store(store, list(histories), start=since)
+    panel.category, panel.default_excluded = build_category_index(panel.codes, task['code_to_type'], names)
+    if task['deadline'] is not None:
+        panel.stale = np.array([code in stale for code in panel.codes], dtype=bool)
+        panel.missing = missing
+    partials = {(period, view): flow_partial(panel, names, task['code_to_type'], period, task['selected_cats'],
+                                             date_range=task['date_range'] if period == "custom" else None, universe=view)
+                for period in task['periods'] for view in task['views']}
+    return {
+        'shard': task['shard'],
+        'partials': partials,
+        'rows': rows,
+        'names': names,
+        'learned_names': {code: name for code, name in metadata.names.items() if known_names.get(code) != name},
+        'backfilled': {code: store.backfilled[code] for code in codes if code in store.backfilled},
+        'stale': sorted(stale),
+        'missing': missing,
+    }
+
+
+def run_pool(tasks):
+    # Fresh interpreters rather than forks: the parent holds memory maps, locks and fetch threads
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(tasks), mp_context=context) as pool:
+        return list(pool.map(screen_shard, tasks))
+
+
+def _spool_path(spool_dir, state, shard):
+    return os.path.join(spool_dir, state, f"shard-{shard:04d}.pkl")
+
+
+def _write_pickle(path, obj):
+    tmp = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def spool_tasks(spool_dir, tasks):
+    # tasks/ -> (rename) claimed/ -> results/, so any number of machines sharing the directory can work on one run
+    for state in ("tasks", "claimed", "results"):
+        os.makedirs(os.path.join(spool_dir, state), exist_ok=True)
+        for path in glob.glob(os.path.join(spool_dir, state, "shard-*")):
+            os.remove(path)
+    for task in tasks:
+        _write_pickle(_spool_path(spool_dir, "tasks", task['shard']), task)
+
+
+def claim_task(spool_dir):
+    # os.rename is atomic on a shared filesystem, so exactly one worker wins each task file
+    for path in sorted(glob.glob(os.path.join(spool_dir, "tasks", "shard-*.pkl"))):
+        claimed = os.path.join(spool_dir, "claimed", os.path.basename(path))
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            continue
+        # The claim's age (for SPOOL_CLAIM_TIMEOUT) counts from now, not from when the task was spooled
+        os.utime(claimed)
+        with open(claimed, "rb") as f:
+            return pickle.load(f)
+    return None
+
+
+def work_spool(spool_dir, idle_seconds=SPOOL_IDLE_SECONDS):
+    # Worker loop (`python shard_screen.py work DIR`): screen claimed shards until no task shows up for idle_seconds
+    done = 0
+    idle_since = time.monotonic()
+    while True:
+        task = claim_task(spool_dir)
+        if task is None:
+            if time.monotonic() - idle_since >= idle_seconds:
+                return done
+            time.sleep(SPOOL_POLL_SECONDS)
+            continue
+        logging.info(f"Screening shard {task['shard'] + 1}/{task['shards']} ({len(task['codes'])} funds)")
+        try:
+            result = screen_shard(task)
+        except Exception as e:
+            logging.exception(f"Shard {task['shard']} failed")
+            result = {'shard': task['shard'], 'error': f"{type(e).__name__}: {e} (on {socket.gethostname()})"}
+        _write_pickle(_spool_path(spool_dir, "results", task['shard']), result)
+        os.remove(_spool_path(spool_dir, "claimed", task['shard']))
+        done += 1
+        idle_since = time.monotonic()
+
+
+def collect_spool(spool_dir, n_shards, claim_timeout=SPOOL_CLAIM_TIMEOUT):
+    # The coordinator works through the queue too, so a spool run finishes even if no other machine joins
+    results = {}
+    while len(results) < n_shards:
+        work_spool(spool_dir, idle_seconds=0)
+        for shard in range(n_shards):
+            path = _spool_path(spool_dir, "results", shard)
+            if shard not in results and os.path.exists(path):
+                with open(path, "rb") as f:
+                    results[shard] = pickle.load(f)
+                if 'error' in results[shard]:
+                    raise RuntimeError(f"Shard {shard} failed: {results[shard]['error']}")
+        for shard in range(n_shards):
+            claimed = _spool_path(spool_dir, "claimed", shard)
+            if shard not in results and os.path.exists(claimed) and time.time() - os.path.getmtime(claimed) > claim_timeout:
+                logging.warning(f"Shard {shard} claimed {claim_timeout}s ago without a result; queueing it again")
+                os.replace(claimed, _spool_path(spool_dir, "tasks", shard))
+        if len(results) < n_shards:
+            time.sleep(SPOOL_POLL_SECONDS)
+    return [results[shard] for shard in range(n_shards)]
+
+
+def screen_sharded(periods, views, shards, selected_cats=None, sort_mode='tl', *, store=None, metadata=None,
+                   concurrency=FETCH_CONCURRENCY, rate=FETCH_RATE, resume=True, since=None, date_range=None, deadline=None,
+                   max_stale_days=None, provider=("borsapy", {}), spool_dir=None, snapshot_path=None, checkpoint_dir=None):
+    # fetch_all_periods() split over `shards` worker processes (or machines, through spool_dir): the same
+    # {(period, view): report} dict. Workers return each view's leaderboard-eligible result columns and per-fund
+    # category rows; the momentum percentile ranks and category sums are universe-wide, so both only run after the merge.
+    # The process pool shares the concurrency/rate budget between its workers; a spool worker, usually
+    # on its own machine, uses the full budget.
+    if store is None:
+        raise ValueError("Sharded screening needs the history store: workers hand their rows to the coordinator")
+    fund_types = universe_fund_types(views)
+    funds = {}
+    for fund_type in fund_types:
+        funds.update(metadata.universe(fund_type))
+    code_to_type = {code: info['fund_type'] for code, info in funds.items()}
+    since = since or data_fetcher.history_since(periods, date_range[0] if date_range else None)
+    # Contiguous slices, so the merged partials list the funds in universe order like one unsharded panel
+    slices = [part.tolist() for part in np.array_split(np.array(list(funds), dtype=object), shards)]
+    pooled = spool_dir is None
+    tasks = [{
+        'shard': i,
+        'shards': shards,
+        'codes': codes,
+        'code_to_type': {code: code_to_type[code] for code in codes},
+        'bulk_through': {code: store.bulk_through[code] for code in codes if code in store.bulk_through},
+        'store_root': os.path.abspath(store.root),
+        'metadata_path': os.path.abspath(metadata.path),
+        'checkpoint_path': universe_checkpoint_path(since, fund_types, (i, shards), checkpoint_dir),
+        'snapshot_path': os.path.abspath(snapshot_path or data_fetcher.SNAPSHOT_PATH),
+        'provider': provider[0],
+        'provider_args': provider[1],
+        'concurrency': max(1, -(-concurrency // shards)) if pooled else concurrency,
+        'rate': rate / shards if pooled and rate else rate,
+        'resume': resume,
+        'since': since.isoformat(),
+        'deadline': deadline,
+        'periods': list(periods),
+        'views': list(views),
+        'selected_cats': selected_cats,
+        'date_range': date_range,
+    } for i, codes in enumerate(slices)]
+
+    t0 = time.perf_counter()
+    if pooled:
+        results = run_pool(tasks)
+    else:
+        spool_tasks(spool_dir, tasks)
+        logging.info(f"Spooled {shards} shards to {spool_dir}; run `python shard_screen.py work {spool_dir}` on other machines to help")
+        results = collect_spool(spool_dir, shards)
+    logging.info(f"Screened {len(funds)} funds in {shards} shards in {time.perf_counter() - t0:.1f}s")
+
+    # Only the coordinator writes the store, metadata and snapshot
+    for result in results:
+        store.stage_rows(result['rows'][0], result['rows'][1], **result['rows'][2])
+        store.backfilled.update(result['backfilled'])
+        for code, name in result['learned_names'].items():
+            metadata.set_name(code, name)
+    logging.info(f"History store: merged new rows for {store.flush()} funds")
+    store.save()
+    metadata.save_if_dirty()
+    for task in tasks:
+        if os.path.exists(task['checkpoint_path']):
+            os.remove(task['checkpoint_path'])
+
+    names = {code: name for result in results for code, name in result['names'].items()}
+    panel = FlowPanel.from_store(store, list(names), start=since)
+    panel.category, panel.default_excluded = build_category_index(panel.codes, code_to_type, names)
+    if deadline is not None:
+        stale = {code for result in results for code in result['stale']}
+        panel.stale = np.array([code in stale for code in panel.codes], dtype=bool)
+        panel.missing = [code for result in results for code in result['missing']]
+    panel.save(snapshot_path or data_fetcher.SNAPSHOT_PATH, created_at=datetime.now().isoformat(timespec="seconds"),
+               since=since.isoformat(timespec="seconds"), names=names, code_to_type=code_to_type, fund_types=list(fund_types))
+
+    return {(period, view): report_from_partial(merge_partials([result['partials'][(period, view)] for result in results]),
+                                                selected_cats, sort_mode, max_stale_days=max_stale_days, universe=view)
+            for period in periods for view in views}
+
+
+def benchmark(n_funds=2000, shard_counts=(1, 2, 4), periods=("daily", "weekly", "monthly"), views=("YAT", "EMK", "ALL"), latency=0.0):
+    # Cold-store scans of the synthetic universe: unsharded fetch_all_periods() once, then every shard
+    # count, each checked report for report against the unsharded output
+    provider_args = {'n_funds': n_funds, 'latency': latency}
+    set_provider(make_provider("synthetic", **provider_args))
+    with tempfile.TemporaryDirectory() as tmp:
+        def scratch(label):
+            metadata = MetadataCache(active_provider().screen_funds, path=os.path.join(tmp, f"{label}_metadata.json")).load()
+            return HistoryStore(os.path.join(tmp, label)), metadata
+
+        paths = {'snapshot_path': os.path.join(tmp, "universe_snapshot.npz"), 'checkpoint_dir': os.path.join(tmp, "checkpoints")}
+        store, metadata = scratch("single")
+        t0 = time.perf_counter()
+        expected = data_fetcher.fetch_all_periods(list(periods), store=store, rate=None, resume=False, metadata=metadata, views=list(views), **paths)
+        baseline = time.perf_counter() - t0
+        print(f"unsharded      {baseline:7.2f}s  {len(metadata.universe('YAT')) * len(universe_fund_types(views))} funds, "
+              f"{os.cpu_count()} CPUs")
+        for shards in shard_counts:
+            store, metadata = scratch(f"shards{shards}")
+            t0 = time.perf_counter()
+            reports = screen_sharded(list(periods), list(views), shards, store=store, metadata=metadata, rate=None, resume=False,
+                                     provider=("synthetic", provider_args), **paths)
+            elapsed = time.perf_counter() - t0
+            same = sum(reports[key] == expected[key] for key in expected)
+            print(f"{shards:>2} shards      {elapsed:7.2f}s  x{baseline / elapsed:4.2f}  identical reports {same}/{len(expected)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded universe screening: spool worker and benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+    work = sub.add_parser("work", help="Screen shards from a spool directory shared with a coordinator (data_fetcher.py --shard-dir)")
+    work.add_argument("spool_dir")
+    work.add_argument("--idle", type=float, default=SPOOL_IDLE_SECONDS, help="Exit after this many seconds without a task")
+    bench = sub.add_parser("bench", help="Compare sharded scans of the synthetic universe against one unsharded scan")
+    bench.add_argument("--funds", type=int, default=2000)
+    bench.add_argument("--shards", default="1,2,4", help="Comma-separated shard counts")
+    bench.add_argument("--latency", type=float, default=0.0, help="Seconds every synthetic upstream call takes")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING if args.command == "bench" else logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s', force=True)
+
+    if args.command == "work":
+        logging.info(f"Worker {socket.gethostname()}-{os.getpid()}: {work_spool(args.spool_dir, args.idle)} shards screened")
+    else:
+        benchmark(args.funds, [int(n) for n in args.shards.split(",")], latency=args.latency)
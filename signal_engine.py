@@ -0,0 +1,164 @@
+import os
+import json
+import logging
+
+import numpy as np
+
+# Optional overrides: {"momentum": {...} or [{...}, ...], "divergence": {"return": [a, b], "investor": [a, b]}}
+SIGNAL_WEIGHTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "signal_weights.json")
+
+# Momentum score = weighted percentile ranks (0-100) of these result columns
+MOMENTUM_WEIGHTS = {"flow_pct": 0.45, "inv_change_pct": 0.35, "return_pct": 0.20}
+
+# Divergence score = |flow %| * first weight + |other metric| * second weight
+DIVERGENCE_WEIGHTS = {"return": (1.4, 1.1), "investor": (1.2, 1.0)}
+
+# (signal_key, title, summary) of each divergence rule, in the order ties are resolved
+DIVERGENCE_RULES = [
+    ("flow_down_return_up", "Çıkışa rağmen getiri güçlü", "Çıkış var ama performans pozitif"),
+    ("flow_up_return_down", "Girişe rağmen getiri zayıf", "Para girişi var ama performans negatif"),
+    ("flow_down_investor_up", "Çıkışa rağmen yatırımcı artıyor", "Para çıkıyor ama yatırımcı sayısı artıyor"),
+    ("flow_up_investor_down", "Girişe rağmen yatırımcı azalıyor", "Para giriyor ama yatırımcı sayısı düşüyor"),
+]
+
+# Crowding: investor growth this many points ahead of flow % (or the reverse for quiet accumulation)
+CROWDING_MIN_GAP = 1.0
+CROWDING_BOOST = 0.35
+CROWDING, QUIET = 1, 2
+
+# Categories moving less than this flow % are not a rotation
+ROTATION_MIN_FLOW_PCT = 0.05
+
+TOP_N = 5
+
+
+def load_signal_weights(path=SIGNAL_WEIGHTS_PATH):
+    # Missing file means the built-in weights; with a list of momentum weightings the first one is published
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable signal weights {path}: {e}")
+        return {}
+
+
+def round_scores(values, decimals=2):
+    # Rounds like Python's round(): np.round scales by 10**decimals first, which can carry a value stored just
+    # below a half (2.755 is 2.75499...) over it. Only the values that land near a half are re-rounded one by one.
+    values = np.asarray(values, dtype=float)
+    out = np.round(values, decimals)
+    scaled = values * 10 ** decimals
+    near = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near.any():
+        out[near] = [round(v, decimals) for v in values[near].tolist()]
+    return out
+
+
+def percentile_ranks(values, where=None):
+    # Percentile rank (0-100) down axis 0 among the `where` rows (NaN elsewhere), so a (funds x dates)
+    # matrix is ranked per date; ties keep row order like a stable sort
+    values = np.asarray(values, dtype=float)
+    if where is not None:
+        values = np.where(where, values, np.inf)
+    # Sorted along the last axis of a contiguous copy: sorting down the strided first axis is several times slower
+    rows_last = np.ascontiguousarray(np.moveaxis(values, 0, -1))
+    order = np.argsort(rows_last, axis=-1, kind="stable")
+    positions = np.empty(rows_last.shape)
+    np.put_along_axis(positions, order, np.broadcast_to(np.arange(len(values)), rows_last.shape), axis=-1)
+    positions = np.moveaxis(positions, -1, 0)
+    n_ranked = len(values) if where is None else np.sum(where, axis=0)
+    ranks = positions / np.maximum(n_ranked - 1, 1) * 100
+    return ranks if where is None else np.where(where, ranks, np.nan)
+
+
+def top_k(scores, k=TOP_N, where=None):
+    # Indices of the k highest scores among `where`, best first, ties in row order.
+    # argpartition finds the cut-off in O(n); only candidates at or above it get sorted.
+    idx = np.flatnonzero(where) if where is not None else np.arange(len(scores))
+    if len(idx) > k:
+        values = scores[idx]
+        cutoff = values[np.argpartition(-values, k - 1)[k - 1]]
+        idx = idx[values >= cutoff]
+    return idx[np.argsort(-scores[idx], kind="stable")[:k]]
+
+
+def top_k_columns(scores, k=TOP_N, where=None):
+    # top_k() for every column of a (rows x columns) matrix at once: (k x columns) row indices, -1 padded
+    n_rows, n_cols = scores.shape
+    out = np.full((k, n_cols), -1, dtype=np.int64)
+    if n_rows == 0:
+        return out
+    where = np.ones(scores.shape, dtype=bool) if where is None else where
+    masked = np.where(where, scores, -np.inf)
+    cutoff = -np.partition(-masked, min(k, n_rows) - 1, axis=0)[min(k, n_rows) - 1]
+    rows, cols = np.nonzero(where & (masked >= cutoff))
+    order = np.lexsort((rows, -scores[rows, cols], cols))
+    rows, cols = rows[order], cols[order]
+    rank = np.arange(len(cols)) - np.searchsorted(cols, cols)
+    keep = rank < k
+    out[rank[keep], cols[keep]] = rows[keep]
+    return out
+
+
+def momentum_scores(results, weights=None, where=None):
+    # (weightings x funds [x dates]) scores, rounded like the published momentum_score; weights is one
+    # mapping or a list of them, so many weightings share one set of ranks
+    weights = weights or MOMENTUM_WEIGHTS
+    weightings = [weights] if isinstance(weights, dict) else list(weights)
+    ranks = {col: percentile_ranks(getattr(results, col), where) for col in MOMENTUM_WEIGHTS}
+    shape = np.shape(results.flow_pct)
+    scores = np.zeros((len(weightings),) + shape)
+    for col in MOMENTUM_WEIGHTS:
+        scores += np.array([w.get(col, 0) for w in weightings]).reshape((-1,) + (1,) * len(shape)) * ranks[col]
+    return round_scores(scores)
+
+
+def divergence_scores(results, weights=None):
+    # Per fund (and date): index into DIVERGENCE_RULES of its strongest rule and that rule's score (-inf = none)
+    weights = weights or DIVERGENCE_WEIGHTS
+    flow_pct, return_pct = results.flow_pct, results.return_pct
+    inv_change, inv_change_pct = results.inv_change, results.inv_change_pct
+    ret_score = np.abs(flow_pct) * weights["return"][0] + np.abs(return_pct) * weights["return"][1]
+    inv_score = np.abs(flow_pct) * weights["investor"][0] + np.abs(inv_change_pct) * weights["investor"][1]
+    candidates = np.stack([
+        np.where((flow_pct < 0) & (return_pct > 0), ret_score, -np.inf),
+        np.where((flow_pct > 0) & (return_pct < 0), ret_score, -np.inf),
+        np.where((flow_pct < 0) & (inv_change > 0), inv_score, -np.inf),
+        np.where((flow_pct > 0) & (inv_change < 0), inv_score, -np.inf),
+    ], axis=-1)
+    rule = np.argmax(candidates, axis=-1)
+    return rule, np.take_along_axis(candidates, rule[..., None], axis=-1)[..., 0]
+
+
+def crowding_scores(results, min_gap=CROWDING_MIN_GAP, boost=CROWDING_BOOST):
+    # Per fund: CROWDING, QUIET or 0 and the rounded signal score
+    flow_pct, inv_change_pct = results.flow_pct, results.inv_change_pct
+    crowd_gap = inv_change_pct - flow_pct
+    quiet_gap = flow_pct - inv_change_pct
+    active = (flow_pct > 0) | (inv_change_pct > 0)
+    crowding = active & (crowd_gap >= min_gap) & (inv_change_pct > 0)
+    quiet = active & ~crowding & (quiet_gap >= min_gap) & (flow_pct > 0)
+    kind = np.where(crowding, CROWDING, np.where(quiet, QUIET, 0))
+    score = round_scores(np.where(crowding, crowd_gap + np.maximum(inv_change_pct, 0) * boost,
+                               quiet_gap + np.maximum(flow_pct, 0) * boost), 2)
+    return kind, score
+
+
+def rotation_scores(flow_pct, min_flow_pct=ROTATION_MIN_FLOW_PCT):
+    # Category rotation: |flow %| of every category that moved enough
+    flow_pct = np.asarray(flow_pct, dtype=float)
+    return np.abs(flow_pct) >= min_flow_pct, round_scores(np.abs(flow_pct))
+
+
+def compute_signals(results, momentum_weights=None, divergence_weights=None, k=TOP_N):
+    # The whole signal stage in one pass over the result columns: top-k row indices plus scores
+    rule, div_score = divergence_scores(results, divergence_weights)
+    kind, crowd_score = crowding_scores(results)
+    momentum = momentum_scores(results, momentum_weights)
+    return {
+        'divergent': (top_k(div_score, k, np.isfinite(div_score)), rule, div_score),
+        'momentum': [(top_k(row, k), row) for row in momentum],
+        'crowding': (top_k(crowd_score, k, kind > 0), kind, crowd_score),
+    }
@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import queue
+import logging
+import argparse
+import tempfile
+import threading
+import http.client
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlencode, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from fetch_pipeline import fetch_many
+from history_store import FIELDS, HistoryStore
+
+# TEFAS's date-oriented history endpoint: one POST returns every fund's daily row for a date window
+BULK_HISTORY_URL = "https://www.tefas.gov.tr/api/DB/BindHistoryInfo"
+
+# Calendar days per request: a daily refresh is one window, a 3-month seed about 14
+BULK_WINDOW_DAYS = 7
+
+# Keep-alive connections (and requests in flight); TEFAS throttles bursts, so stay small
+BULK_POOL_SIZE = 2
+BULK_TIMEOUT = 60
+
+BULK_HEADERS = {
+    "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "X-Requested-With": "XMLHttpRequest",
+    "Origin": "https://www.tefas.gov.tr",
+    "Referer": "https://www.tefas.gov.tr/TarihselVeriler.aspx",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Connection": "keep-alive",
+}
+
+# Response field -> borsapy history column
+BULK_FIELDS = {"FIYAT": "Price", "PORTFOYBUYUKLUK": "FundSize", "TEDPAYSAYISI": "Shares", "KISISAYISI": "Investors"}
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections to one endpoint, shared by worker threads.
+
+    At most `size` requests are in flight; finished connections go back to the pool unless the
+    server asked to close them, and an idle connection the server dropped is replaced once.
+    """
+
+    def __init__(self, url, size=BULK_POOL_SIZE, timeout=BULK_TIMEOUT):
+        parts = urlsplit(url)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path + (f"?{parts.query}" if parts.query else "")
+        self.size = size
+        self.timeout = timeout
+        self.opened = 0
+        self.requests = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        with self._lock:
+            self.opened += 1
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def _send(self, conn, method, body, headers):
+        conn.request(method, self.path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        payload = response.read()
+        with self._lock:
+            self.requests += 1
+        return response.status, payload, not response.will_close
+
+    def request(self, method, body=None, headers=None):
+        # (status, body bytes)
+        with self._slots:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._connect(), False
+            try:
+                try:
+                    status, payload, keep = self._send(conn, method, body, headers)
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    if not reused:
+                        raise
+                    # The server closed this connection while it sat idle
+                    conn.close()
+                    conn = self._connect()
+                    status, payload, keep = self._send(conn, method, body, headers)
+            except Exception:
+                conn.close()
+                raise
+            if keep:
+                self._idle.put(conn)
+            else:
+                conn.close()
+            return status, payload
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def tefas_dates(values):
+    # TARIH is epoch milliseconds of the fund's (Istanbul) calendar day
+    ms = pd.to_numeric(pd.Series(values), errors="coerce")
+    stamps = pd.to_datetime(ms, unit="ms", utc=True).dt.tz_convert("Europe/Istanbul")
+    return stamps.dt.tz_localize(None).dt.normalize()
+
+
+def rows_to_frame(rows):
+    # Long (code, name, Date, Price, FundSize, Shares, Investors) frame of one response
+    columns = ["code", "name", "Date"] + list(BULK_FIELDS.values())
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    df = pd.DataFrame(rows)
+    out = pd.DataFrame({
+        "code": df["FONKODU"].astype(str).str.strip().str.upper(),
+        "name": df["FONUNVAN"].fillna("") if "FONUNVAN" in df.columns else "",
+        "Date": tefas_dates(df["TARIH"]).values,
+    })
+    for field, col in BULK_FIELDS.items():
+        out[col] = pd.to_numeric(df[field], errors="coerce") if field in df.columns else np.nan
+    return out[columns].dropna(subset=["Date", "Price"])
+
+
+def record_rows(record_dir, fund_type, rows):
+    # Recorded responses are kept per day (<fund_type>_<YYYYMMDD>.json) so any window can be replayed
+    os.makedirs(record_dir, exist_ok=True)
+    days = tefas_dates([row.get("TARIH") for row in rows]).dt.strftime("%Y%m%d")
+    by_day = {}
+    for day, row in zip(days, rows):
+        by_day.setdefault(day, []).append(row)
+    for day, day_rows in by_day.items():
+        with open(os.path.join(record_dir, f"{fund_type}_{day}.json"), "w", encoding="utf-8") as f:
+            json.dump(day_rows, f, ensure_ascii=False)
+
+
+def bulk_windows(start, end, days=BULK_WINDOW_DAYS):
+    # Consecutive [start, end] windows of at most `days`, skipping windows that are all weekend
+    start, end = pd.Timestamp(start).date(), pd.Timestamp(end).date()
+    windows = []
+    cursor = start
+    while cursor <= end:
+        stop = min(cursor + timedelta(days=days - 1), end)
+        if np.is_busday(np.arange(np.datetime64(cursor), np.datetime64(stop) + 1)).any():
+            windows.append((cursor, stop))
+        cursor = stop + timedelta(days=1)
+    return windows
+
+
+class BulkHistoryClient:
+    """Whole-universe history rows per date window from TEFAS, over pooled keep-alive connections."""
+
+    def __init__(self, url=BULK_HISTORY_URL, fund_type="YAT", pool_size=BULK_POOL_SIZE, window_days=BULK_WINDOW_DAYS, record_dir=None):
+        self.pool = ConnectionPool(url, pool_size)
+        self.fund_type = fund_type
+        self.window_days = window_days
+        self.record_dir = record_dir
+
+    def fetch_window(self, window):
+        start, end = window
+        body = urlencode({
+            "fontip": self.fund_type,
+            "bastarih": start.strftime("%d.%m.%Y"),
+            "bittarih": end.strftime("%d.%m.%Y"),
+            "fonkod": "",
+        })
+        status, payload = self.pool.request("POST", body, BULK_HEADERS)
+        if status != 200:
+            raise ConnectionError(f"TEFAS bulk history returned HTTP {status} for {start}..{end}")
+        try:
+            rows = json.loads(payload)["data"]
+        except (ValueError, KeyError, TypeError):
+            # TEFAS answers throttled requests with an HTML page and HTTP 200
+            raise ConnectionError(f"TEFAS bulk history returned a non-JSON body for {start}..{end}: {payload[:120]!r}")
+        if self.record_dir:
+            record_rows(self.record_dir, self.fund_type, rows)
+        return rows_to_frame(rows)
+
+    def fetch(self, start, end):
+        # Every window's rows (None for a window that failed after retries)
+        windows = bulk_windows(start, end, self.window_days)
+        fetched = fetch_many(windows, self.fetch_window, concurrency=self.pool.size, rate=None)
+        return windows, [fetched.get(w) for w in windows]
+
+    def close(self):
+        self.pool.close()
+
+
+def bulk_refresh(store, client=None, start=None, end=None, metadata=None, new_funds=False, codes=None):
+    # Pulls the client's whole universe from its funds' latest stored date (re-read, it may have been
+    # partial) to `end` and writes them into the store. Funds the store does not hold yet are skipped
+    # unless new_funds, since they need a full per-fund history anyway; `codes` limits the refresh to
+    # one universe's funds when the store holds several. Returns the number of funds updated.
+    client = client or BulkHistoryClient()
+    end = pd.Timestamp(end or datetime.now().date())
+    held = set(store.codes) if codes is None else set(codes) & set(store.codes)
+    last = store.last_dates()
+    if start is None:
+        dates = [last[code] for code in held if code in last]
+        if not dates:
+            logging.warning(f"Bulk refresh of {client.fund_type} needs stored funds or an explicit start date")
+            return 0
+        start = max(dates)
+    start = pd.Timestamp(start)
+    windows, frames = client.fetch(start, end)
+    failed = sum(frame is None for frame in frames)
+    if failed:
+        logging.warning(f"Bulk refresh: {failed} of {len(windows)} windows failed; per-fund fetches will fill the gap")
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    df = pd.concat(frames, ignore_index=True) if frames else rows_to_frame([])
+
+    if not new_funds:
+        df = df[df["code"].isin(held)]
+    elif codes is not None:
+        df = df[df["code"].isin(set(codes))]
+    columns = {field: df[col].to_numpy(dtype=float) for field, col in FIELDS.items()}
+    store.stage_rows(df["code"].to_numpy(dtype=object), df["Date"].values, **columns)
+    updated = df["code"].nunique()
+    if metadata is not None:
+        for code, name in df.drop_duplicates("code")[["code", "name"]].itertuples(index=False):
+            if name and metadata.name(code) is None:
+                metadata.set_name(code, name)
+    store.flush()
+    store.save()
+    if not failed:
+        # Funds whose stored rows already reached `start` now hold every row up to `end`; their per-fund
+        # incremental fetches can be skipped. Funds that lagged behind (or are new) keep a gap before `start`
+        # and are left to those fetches.
+        current = [code for code, day in last.items() if code in held and day >= start.to_datetime64()]
+        store.bulk_through.update(dict.fromkeys(current, end.date()))
+    logging.info(f"Bulk refresh {client.fund_type} {start.date()}..{end.date()}: {len(windows)} requests over "
+                 f"{client.pool.opened} connections, {len(df)} rows for {updated} funds")
+    return updated
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+        start = datetime.strptime(form["bastarih"][0], "%d.%m.%Y").date()
+        end = datetime.strptime(form["bittarih"][0], "%d.%m.%Y").date()
+        rows = self.server.replay(form.get("fontip", ["YAT"])[0], start, end)
+        body = json.dumps({"draw": 0, "recordsTotal": len(rows), "recordsFiltered": len(rows), "data": rows},
+                          ensure_ascii=False).encode("utf-8")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Local TEFAS stand-in that answers bulk history POSTs from recorded day files, with keep-alive."""
+
+    daemon_threads = True
+
+    def __init__(self, record_dir, latency=0.0, address=("127.0.0.1", 0)):
+        super().__init__(address, ReplayHandler)
+        self.record_dir = record_dir
+        self.latency = latency
+        self.connections = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/api/DB/BindHistoryInfo"
+
+    def get_request(self):
+        request = super().get_request()
+        self.connections += 1
+        return request
+
+    def replay(self, fund_type, start, end):
+        rows = []
+        for day in pd.date_range(start, end):
+            path = os.path.join(self.record_dir, f"{fund_type}_{day.strftime('%Y%m%d')}.json")
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    rows.extend(json.load(f))
+        return rows
+
+    def serve_in_background(self):
+        threading.Thread(target=self.serve_forever, name="tefas-replay", daemon=True).start()
+        return self
+
+
+def record_synthetic(record_dir, n_funds, start, end, fund_type="YAT"):
+    # Day files in the endpoint's format, generated from the synthetic provider (for air-gapped runs)
+    from providers import SyntheticProvider
+    provider = SyntheticProvider(n_funds, end=end)
+    frames = []
+    for code in provider.universe_codes(fund_type):
+        df = provider.history_frame(code, start=start, end=end)
+        frames.append(pd.DataFrame({
+            "TARIH": ((df.index.tz_localize("Europe/Istanbul").tz_convert("UTC") - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(milliseconds=1)).astype(str),
+            "FONKODU": code, "FONUNVAN": provider.fund_name(code),
+            "FIYAT": df["Price"].values, "TEDPAYSAYISI": df["Shares"].values,
+            "KISISAYISI": df["Investors"].values, "PORTFOYBUYUKLUK": df["FundSize"].values,
+        }))
+    rows = pd.concat(frames, ignore_index=True).to_dict("records")
+    record_rows(record_dir, fund_type, rows)
+    return provider
+
+
+def replay_benchmark(record_dir=None, n_funds=2000, days=92, latency=0.05):
+    # Seeds a scratch store from the replay server, then runs one daily refresh and checks it
+    # against the recorded rows
+    with tempfile.TemporaryDirectory() as tmp:
+        end = pd.Timestamp(datetime.now().date())
+        provider = None
+        if record_dir is None:
+            record_dir = os.path.join(tmp, "recorded")
+            provider = record_synthetic(record_dir, n_funds, end - timedelta(days=days), end)
+        server = ReplayServer(record_dir, latency).serve_in_background()
+        store = HistoryStore(os.path.join(tmp, "history"))
+
+        client = BulkHistoryClient(server.url)
+        t0 = time.perf_counter()
+        bulk_refresh(store, client, start=end - timedelta(days=days), end=end - timedelta(days=1), new_funds=True)
+        print(f"seed  {days:>3} days  {time.perf_counter() - t0:6.2f}s  requests={client.pool.requests} "
+              f"connections={client.pool.opened} funds={len(store.codes)}")
+
+        client = BulkHistoryClient(server.url)
+        t0 = time.perf_counter()
+        updated = bulk_refresh(store, client, end=end)
+        print(f"daily refresh  {time.perf_counter() - t0:6.2f}s  requests={client.pool.requests} "
+              f"connections={client.pool.opened} funds updated={updated} (per-fund path: {len(store.codes)} requests)")
+
+        if provider is not None:
+            mismatched = 0
+            for code in store.codes[:50]:
+                expected = provider.history_frame(code, start=end - timedelta(days=days), end=end)
+                stored = store.frame(code)
+                if len(expected) != len(stored) or not np.allclose(expected["Price"].values, stored["Price"].values):
+                    mismatched += 1
+            print(f"stored rows match the recorded responses for {50 - mismatched}/50 sampled funds")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk TEFAS history refresh into the local history store")
+    parser.add_argument("--start", help="First date to fetch (YYYY-MM-DD), defaults to the store's latest date")
+    parser.add_argument("--end", help="Last date to fetch (YYYY-MM-DD), defaults to today")
+    parser.add_argument("--new-funds", action="store_true", help="Also add funds the store does not hold yet")
+    parser.add_argument("--record", help="Save every response as per-day files in this directory")
+    parser.add_argument("--replay", nargs="?", const="", default=None,
+                        help="Benchmark against a local replay server (recorded day files, or synthetic ones if no directory is given)")
+    parser.add_argument("--funds", type=int, default=2000, help="Synthetic universe size for --replay without recordings")
+    parser.add_argument("--latency", type=float, default=0.05, help="Replay server latency per request")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.replay is not None:
+        replay_benchmark(args.replay or None, args.funds, latency=args.latency)
+    else:
+        client = BulkHistoryClient(record_dir=args.record)
+        bulk_refresh(HistoryStore().load(), client, args.start, args.end, new_funds=args.new_funds)
+        client.close()
@@ -1,14 +1,11 @@
-import sys
 import os
 import pandas as pd
 from datetime import datetime
 
-# Add borsapy to path
-sys.path.append(r"C:\Users\svkto\.gemini\antigravity\scratch\borsapy_repo")
-import borsapy as bp
+from providers import active_provider
 
 def get_allocation_diff(fund_code):
-    fund = bp.Fund(fund_code)
+    fund = active_provider().fund(fund_code)
     try:
         df = fund.allocation_history(period="1mo")
         # Ensure we have date as datetime to sort properly
@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+from allocation_store import TEFAS_ORIGINAL_NAMES, AllocationStore
+
+
+def allocation_rows(code, day, weights):
+    return pd.DataFrame({'Date': pd.Timestamp(day), 'fund_code': code,
+                         'asset_name': list(weights), 'weight': list(weights.values())})
+
+
+@pytest.fixture
+def rows():
+    # Two raw holdings that both map to "Mevduat (TL)"
+    return pd.concat([
+        allocation_rows("AAA", "2026-10-01", {"Vadeli Mevduat": 10.0, "Vadesiz Mevduat Türk Lirası": 5.0, "Hisse Senedi": 85.0}),
+        allocation_rows("AAA", "2026-10-02", {"Vadeli Mevduat": 12.0, "Vadesiz Mevduat Türk Lirası": 1.0, "Hisse Senedi": 87.0}),
+    ], ignore_index=True)
+
+
+def baseline_diff(df):
+    # The pre-store fetch_allocation_diff: merge the two latest snapshots on the raw asset name, then map it
+    dates = sorted(df['Date'].unique(), reverse=True)
+    merged = pd.merge(df[df['Date'] == dates[0]], df[df['Date'] == dates[1]], on='asset_name', how='outer', suffixes=('_latest', '_prev'))
+    merged[['weight_latest', 'weight_prev']] = merged[['weight_latest', 'weight_prev']].fillna(0)
+    merged['diff'] = merged['weight_latest'] - merged['weight_prev']
+    merged = merged.sort_values(by='weight_latest', ascending=False)
+    return [{'asset': TEFAS_ORIGINAL_NAMES.get(r['asset_name'], r['asset_name']), 'weight': r['weight_latest'], 'diff': r['diff']}
+            for _, r in merged.iterrows() if not (r['weight_latest'] == 0 and r['diff'] == 0)]
+
+
+def test_fund_diff_lists_holdings_that_share_a_label_separately(rows):
+    store = AllocationStore(root=None)
+    store.ingest(rows)
+    diff = store.fund_allocation_diff("AAA")
+    assert (diff['latest_date'], diff['prev_date']) == ("2026-10-02", "2026-10-01")
+    assert diff['allocations'] == baseline_diff(rows)
+
+
+def test_universe_diff_sums_holdings_per_label(rows, tmp_path):
+    store = AllocationStore(root=str(tmp_path))
+    store.ingest(rows)
+    store.save()
+    store = AllocationStore(root=str(tmp_path)).load()
+    delta, latest, has_both = store.diff()
+    col = store.assets.index("Mevduat (TL)")
+    assert has_both[0]
+    assert latest[0, col] == 13.0
+    assert delta[0, col] == -2.0
+    assert store.top_changes("Hisse Senedi")[0]['diff'] == 2.0
+    # The per-fund diff survives the reload with raw names intact
+    assert store.fund_allocation_diff("AAA")['allocations'] == baseline_diff(rows)
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import rolling_flows, run_backtest
+from flow_engine import FlowPanel, compute_flows
+from fund_categories import build_category_index
+from providers import SyntheticProvider
+
+
+@pytest.fixture(scope="module")
+def provider():
+    return SyntheticProvider(30, end="2026-10-16")
+
+
+@pytest.fixture(scope="module")
+def histories(provider):
+    rng = np.random.default_rng(11)
+    out = {}
+    for code in provider.codes:
+        df = provider.history_frame(code, start="2025-09-01")
+        out[code] = df[rng.random(len(df)) > 0.1]
+    return out
+
+
+@pytest.fixture(scope="module")
+def panel(provider, histories):
+    panel = FlowPanel.from_histories(histories)
+    names = {code: provider.fund_name(code) for code in panel.codes}
+    code_to_type = {code: provider.fund_type(code) for code in panel.codes}
+    panel.category, panel.default_excluded = build_category_index(panel.codes, code_to_type, names)
+    return panel
+
+
+@pytest.mark.parametrize("period_type", ["daily", "weekly", "monthly"])
+def test_rolling_flows_match_compute_flows_as_of_each_date(histories, panel, period_type):
+    rolling = rolling_flows(panel, period_type)
+    for col in (60, 150, len(panel.dates) - 1):
+        as_of = pd.Timestamp(panel.dates[col])
+        past = FlowPanel.from_histories({code: df[df.index <= as_of] for code, df in histories.items()})
+        assert past.codes == panel.codes
+        flows = compute_flows(past, period_type)
+        np.testing.assert_array_equal(rolling['valid'][:, col], flows['valid'])
+        for key in ('latest_idx', 'prev_idx', 'net_flow', 'flow_pct', 'return_pct', 'inv_change'):
+            np.testing.assert_allclose(rolling[key][:, col][flows['valid']], flows[key][flows['valid']], rtol=1e-12,
+                                       err_msg=f"{as_of.date()} {key}")
+
+
+def test_picking_every_eligible_fund_has_no_excess_return(panel):
+    # With k above the universe size the momentum picks are the whole universe of each day,
+    # so their forward returns average out to the benchmark
+    report = run_backtest(panel, "weekly", start="2025-11-01", horizons=(5, 20), signal_weights={}, k=len(panel))
+    momentum = report['signals']['momentum_scores']
+    assert momentum['picks'] > 0
+    for h in (5, 20):
+        assert momentum['horizons'][h]['mean_excess'] == pytest.approx(0.0, abs=1e-9)
+    # Every divergent pick belongs to exactly one rule
+    divergent = report['signals']['divergent_signals']
+    rules = [s for name, s in report['signals'].items() if name.startswith('divergent_signals/')]
+    assert sum(s['picks'] for s in rules) == divergent['picks']
+    assert report['start'] >= "2025-11-01" and report['end'] == "2026-10-16"
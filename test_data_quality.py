@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from data_quality import (FEW_INVESTORS, MISSING_INVESTORS, NO_PRICE, SHARE_JUMP, STALE_PRICE, eligible,
+                          flag_names)
+from flow_engine import FlowPanel, compute_flows
+
+DATES = pd.bdate_range(end="2026-10-16", periods=10)
+
+
+def fund(price=None, shares=None, investors=None):
+    # Ten published rows of a healthy fund, with the given columns overridden
+    price = np.linspace(10.0, 11.0, len(DATES)) if price is None else np.asarray(price, dtype=float)
+    shares = np.full(len(DATES), 1e6) if shares is None else np.asarray(shares, dtype=float)
+    investors = np.full(len(DATES), 900) if investors is None else np.asarray(investors)
+    return pd.DataFrame({'Price': price, 'FundSize': price * shares, 'Shares': shares, 'Investors': investors},
+                        index=DATES)
+
+
+def codes(histories, period_type="weekly"):
+    panel = FlowPanel.from_histories(histories)
+    flows = compute_flows(panel, period_type)
+    return dict(zip(panel.codes, panel.quality_index().check(flows['latest_idx'], flows['prev_idx'])))
+
+
+def test_flags():
+    jump = np.full(len(DATES), 1e6)
+    jump[-2:] = 5e6
+    few = fund(investors=np.full(len(DATES), 120))
+    missing = fund(investors=[900] * 9 + [0])
+    unpublished = fund(price=list(np.linspace(10.0, 11.0, 9)) + [0.0])
+    stale = fund(price=[10.0] * 4 + [10.5] * 6)
+    result = codes({"OK": fund(), "JMP": fund(shares=jump), "FEW": few, "INV": missing, "NOP": unpublished,
+                    "STL": stale})
+    assert result["OK"] == 0
+    assert result["JMP"] == SHARE_JUMP
+    assert result["FEW"] == FEW_INVESTORS
+    assert result["INV"] == MISSING_INVESTORS
+    assert result["NOP"] & NO_PRICE
+    assert result["STL"] == STALE_PRICE
+    assert flag_names(result["JMP"]) == ["share_jump"]
+    assert list(eligible(np.array(list(result.values())))) == [True, False, False, False, False, False]
+
+
+def test_share_jump_before_the_period_is_not_flagged():
+    shares = np.full(len(DATES), 1e6)
+    shares[1:] = 5e6
+    assert codes({"OLD": fund(shares=shares)}, "daily")["OLD"] == 0
+    assert codes({"OLD": fund(shares=shares)}, "monthly")["OLD"] == SHARE_JUMP
+
+
+def test_fund_launched_inside_the_period_still_ranks():
+    # The reference row carries no price and no investors yet; only the latest row is checked for them,
+    # like the >= 500 investor filter of the per-fund leaderboards
+    launch = fund(price=[0.0] + list(np.linspace(10.0, 11.0, 9)), investors=[0] + [900] * 9)
+    assert codes({"NEW": launch}, "monthly")["NEW"] == 0
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import data_fetcher
+import fetch_pipeline
+import providers
+from fetch_pipeline import CircuitBreaker, fetch_many
+from fund_metadata import MetadataCache
+from history_store import HistoryStore
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(fetch_pipeline, "backoff_delay", lambda attempt: 0.0)
+
+
+@pytest.fixture
+def provider_slot(monkeypatch):
+    # Whatever a test sets as the active provider is dropped afterwards
+    monkeypatch.setattr(providers, "_active", None)
+
+
+def test_fetch_many_retries_transient_failures():
+    calls = {}
+
+    def fetch(code):
+        calls[code] = calls.get(code, 0) + 1
+        if calls[code] <= 2:
+            raise ConnectionError("transient")
+        return code.lower()
+
+    results = fetch_many(["A", "B", "C"], fetch, rate=None, retries=3)
+    assert results == {"A": "a", "B": "b", "C": "c"}
+    assert calls == {"A": 3, "B": 3, "C": 3}
+
+
+def test_fetch_many_gives_up_after_retries_and_trips_the_breaker():
+    calls = []
+
+    def fetch(code):
+        calls.append(code)
+        raise ConnectionError("down")
+
+    breaker = CircuitBreaker(window=10, error_threshold=0.3, cooldown=0.0)
+    codes = [f"F{i}" for i in range(6)]
+    results = fetch_many(codes, fetch, concurrency=2, rate=None, retries=2, breaker=breaker)
+    assert results == {}
+    assert len(calls) == len(codes) * 3
+    assert breaker.trips >= 1
+    assert breaker.rate_factor < 1.0
+
+
+def test_none_results_are_kept_and_not_retried():
+    calls = []
+
+    def fetch(code):
+        calls.append(code)
+        return None
+
+    assert fetch_many(["A"], fetch, rate=None) == {"A": None}
+    assert calls == ["A"]
+
+
+def test_failed_incremental_history_fetch_reaches_the_retries(tmp_path, provider_slot):
+    # A stored fund with a cached name (no fund.info call) whose upstream fails must not be served silently
+    # from its old rows
+    store = HistoryStore(str(tmp_path / "history"))
+    metadata = MetadataCache(None, path=str(tmp_path / "fund_metadata.json"))
+    providers.set_provider(providers.SyntheticProvider(5, end=datetime.now() - timedelta(days=10)))
+    assert data_fetcher.fetch_fund_history("S0001", store, metadata) is not None
+    store.flush()
+
+    failing = providers.set_provider(providers.SyntheticProvider(5, failure_rate=1.0))
+    results = fetch_many(["S0001"], lambda code: data_fetcher.fetch_fund_history(code, store, metadata), rate=None, retries=2)
+    assert results == {}
+    assert failing.calls == {"history": 3}
+
+
+def test_incremental_history_fetch_with_nothing_new_keeps_stored_rows(tmp_path, provider_slot):
+    store = HistoryStore(str(tmp_path))
+    provider = providers.set_provider(providers.SyntheticProvider(5, end=datetime.now() - timedelta(days=10)))
+    name, first = data_fetcher.fetch_fund_history("S0002", store)
+    store.flush()
+    # The same provider has no rows after its end date: an empty frame, not an error
+    name, again = data_fetcher.fetch_fund_history("S0002", store)
+    assert again.index.equals(first.index)
+    assert provider.calls["history"] == 2
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_fetcher import PERIODS, get_prev_row
+from flow_engine import FlowPanel, FundDigest, compute_flows, range_flows
+from providers import SyntheticProvider
+
+
+@pytest.fixture(scope="module")
+def histories():
+    # Synthetic histories with random holes, so anchors often fall on days a fund did not publish
+    provider = SyntheticProvider(40, end="2026-10-16")
+    rng = np.random.default_rng(7)
+    out = {}
+    for code in provider.codes:
+        df = provider.history_frame(code, start="2023-06-01")
+        out[code] = df[rng.random(len(df)) > 0.15]
+    return out
+
+
+def per_fund_flows(df, period_type):
+    # The pre-panel per-fund computation: latest row against get_prev_row()
+    latest, prev = df.iloc[-1], get_prev_row(df, period_type)
+    net_flow = (latest['Shares'] - prev['Shares']) * latest['Price']
+    return {
+        'net_flow': net_flow,
+        'flow_pct': net_flow / prev['FundSize'] * 100,
+        'return_pct': (latest['Price'] - prev['Price']) / prev['Price'] * 100,
+        'inv_change': latest['Investors'] - prev['Investors'],
+    }
+
+
+@pytest.mark.parametrize("period_type", PERIODS)
+def test_compute_flows_matches_get_prev_row(histories, period_type):
+    panel = FlowPanel.from_histories(histories)
+    flows = compute_flows(panel, period_type)
+    assert flows['valid'].all()
+    for row, code in enumerate(panel.codes):
+        expected = per_fund_flows(histories[code], period_type)
+        for key, value in expected.items():
+            assert flows[key][row] == pytest.approx(value, rel=1e-9, abs=1e-6), (code, key)
+
+
+def test_digest_panel_matches_full_histories(histories):
+    # Histories reduced to the rows their periods need give the same flows and quality codes as the full frames
+    full = FlowPanel.from_histories(histories)
+    digests = FlowPanel.from_digests({code: FundDigest.from_frame(df, PERIODS) for code, df in histories.items()}, PERIODS)
+    for period_type in PERIODS:
+        a, b = compute_flows(full, period_type), compute_flows(digests, period_type)
+        for key in ('net_flow', 'flow_pct', 'return_pct', 'inv_change'):
+            np.testing.assert_allclose(a[key], b[key], rtol=1e-12, err_msg=f"{period_type} {key}")
+        qa = full.quality_index().check(a['latest_idx'], a['prev_idx'])
+        qb = digests.quality_index().check(b['latest_idx'], b['prev_idx'])
+        np.testing.assert_array_equal(qa, qb)
+
+
+def test_single_row_fund_is_not_valid():
+    df = pd.DataFrame({'Price': [1.0], 'FundSize': [1e6], 'Shares': [1e6], 'Investors': [900]},
+                      index=pd.DatetimeIndex(["2026-10-16"]))
+    flows = compute_flows(FlowPanel.from_histories({"ONE": df}), "weekly")
+    assert not flows['valid'][0]
+
+
+@pytest.mark.parametrize("start", ["2024-02-29", "2025-06-14", "2026-09-30"])
+def test_range_flows_match_get_prev_row(histories, start):
+    panel = FlowPanel.from_histories(histories)
+    flows = range_flows(panel, start)
+    assert flows['valid'].all()
+    for row, code in enumerate(panel.codes):
+        df = histories[code]
+        latest, prev = df.iloc[-1], get_prev_row(df, "custom", start)
+        assert panel.dates[flows['prev_idx'][row]] == prev.name
+        # Range flows value each day's share change at that day's price
+        window = df.loc[prev.name:]
+        daily_flow = (window['Shares'].diff() * window['Price']).iloc[1:].sum()
+        assert flows['net_flow'][row] == pytest.approx(daily_flow, rel=1e-9, abs=1e-6), code
+        assert flows['flow_pct'][row] == pytest.approx(daily_flow / prev['FundSize'] * 100, rel=1e-9, abs=1e-9), code
+        assert flows['return_pct'][row] == pytest.approx((latest['Price'] / prev['Price'] - 1) * 100, rel=1e-9, abs=1e-9), code
+        assert flows['inv_change'][row] == latest['Investors'] - prev['Investors']
+
+
+def test_range_return_spans_a_zero_price_row():
+    df = pd.DataFrame({'Price': [10.0, 0.0, 12.0], 'FundSize': [1e7, 0.0, 1.2e7], 'Shares': [1e6, 1e6, 1e6],
+                       'Investors': [900, 900, 900]}, index=pd.DatetimeIndex(["2026-10-14", "2026-10-15", "2026-10-16"]))
+    flows = range_flows(FlowPanel.from_histories({"GAP": df}), "2026-10-14")
+    assert flows['return_pct'][0] == pytest.approx(20.0)
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+from history_store import HistoryStore
+
+
+def history(dates, price, investors=1000):
+    price = np.asarray(price, dtype=float)
+    shares = np.linspace(1e6, 1.1e6, len(price))
+    return pd.DataFrame({'Price': price, 'FundSize': price * shares, 'Shares': shares, 'Investors': investors},
+                        index=pd.DatetimeIndex(dates))
+
+
+def test_stage_flush_save_load_round_trip(tmp_path):
+    # Rows across a year boundary land in two partitions and read back unchanged after a reload
+    dates = pd.bdate_range("2025-12-24", "2026-01-09")
+    df = history(dates, np.linspace(10, 11, len(dates)))
+    store = HistoryStore(str(tmp_path))
+    store.stage("AAA", df)
+    assert store.flush() == 1
+    store.save()
+
+    loaded = HistoryStore(str(tmp_path)).load()
+    assert loaded.codes == ["AAA"]
+    assert sorted(loaded._parts) == [2025, 2026]
+    frame = loaded.frame("AAA")
+    assert list(frame.columns) == ["Price", "FundSize", "Shares", "Investors"]
+    assert frame.index.equals(df.index)
+    np.testing.assert_allclose(frame.to_numpy(dtype=float), df.to_numpy(dtype=float))
+    assert loaded.last_date("AAA") == dates[-1]
+    assert loaded.first_date("AAA") == dates[0]
+
+
+def test_incremental_append_replaces_overlapping_dates(tmp_path):
+    dates = pd.bdate_range("2026-03-02", periods=8)
+    store = HistoryStore(str(tmp_path))
+    store.stage("AAA", history(dates[:5], [1, 2, 3, 4, 5]))
+    store.flush()
+    store.save()
+
+    store = HistoryStore(str(tmp_path)).load()
+    # The last stored day is re-published with a corrected price, then three new days follow
+    store.stage("AAA", history(dates[4:], [50, 6, 7, 8]))
+    store.stage("BBB", history(dates[2:], [9, 9, 9, 9, 9, 9]))
+    store.flush()
+    store.save()
+
+    store = HistoryStore(str(tmp_path)).load()
+    frame = store.frame("AAA")
+    assert frame.index.equals(dates)
+    assert frame["Price"].tolist() == [1, 2, 3, 4, 50, 6, 7, 8]
+    assert store.frame("BBB").index.equals(dates[2:])
+    assert store.frame("AAA", start=dates[6])["Price"].tolist() == [7, 8]
+
+
+def test_frame_includes_staged_rows_before_flush(tmp_path):
+    dates = pd.bdate_range("2026-03-02", periods=4)
+    store = HistoryStore(str(tmp_path))
+    store.stage("AAA", history(dates[:2], [1, 2]))
+    store.flush()
+    store.stage("AAA", history(dates[2:], [3, 4]))
+    assert store.frame("AAA")["Price"].tolist() == [1, 2, 3, 4]
+    assert store.last_date("AAA") == dates[1]
+
+
+def test_duplicate_dates_are_counted_and_the_last_row_kept(tmp_path):
+    dates = pd.DatetimeIndex(["2026-03-02", "2026-03-03", "2026-03-03", "2026-03-04"])
+    store = HistoryStore(str(tmp_path))
+    store.stage("AAA", history(dates, [1, 2, 20, 3]))
+    store.flush()
+    assert store.duplicates == {"AAA": 1}
+    assert store.frame("AAA")["Price"].tolist() == [1, 20, 3]
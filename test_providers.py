@@ -0,0 +1,48 @@
+import sys
+import types
+
+import pandas as pd
+import pytest
+
+from providers import BorsapyProvider
+
+
+class NoData(Exception):
+    pass
+
+
+def fake_borsapy(monkeypatch, error, **exports):
+    # A borsapy module whose Fund.history always raises `error`
+    class Fund:
+        def __init__(self, code):
+            self.code = code
+
+        def history(self, **kwargs):
+            raise error
+
+    module = types.ModuleType("borsapy")
+    module.Fund = Fund
+    for name, value in exports.items():
+        setattr(module, name, value)
+    monkeypatch.setitem(sys.modules, "borsapy", module)
+    return BorsapyProvider()
+
+
+def test_no_data_is_an_empty_frame(monkeypatch):
+    provider = fake_borsapy(monkeypatch, NoData("no rows"), DataNotAvailableError=NoData)
+    df = provider.fund("AAA").history(start="2026-10-16")
+    assert isinstance(df, pd.DataFrame) and df.empty
+
+
+def test_other_errors_still_raise(monkeypatch):
+    provider = fake_borsapy(monkeypatch, ConnectionError("down"), DataNotAvailableError=NoData)
+    with pytest.raises(ConnectionError):
+        provider.fund("AAA").history(start="2026-10-16")
+
+
+def test_borsapy_without_the_no_data_error_raises_the_upstream_error(monkeypatch):
+    # Not an AttributeError from resolving the except clause
+    provider = fake_borsapy(monkeypatch, ConnectionError("down"))
+    with pytest.raises(ConnectionError):
+        provider.fund("AAA").history(start="2026-10-16")
+    assert provider.fund("AAA").code == "AAA"
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import data_fetcher
+import providers
+from fund_metadata import MetadataCache
+from history_store import HistoryStore
+from shard_screen import screen_sharded
+
+PERIODS = ["daily", "weekly", "monthly"]
+VIEWS = ["YAT", "EMK", "ALL"]
+PROVIDER_ARGS = {'n_funds': 60}
+
+
+@pytest.fixture
+def scratch(tmp_path, monkeypatch):
+    # A fresh store and metadata cache per scan, all paths under tmp_path
+    monkeypatch.setattr(providers, "_active", None)
+    providers.set_provider(providers.make_provider("synthetic", **PROVIDER_ARGS))
+    paths = {'snapshot_path': str(tmp_path / "universe_snapshot.npz"), 'checkpoint_dir': str(tmp_path / "checkpoints")}
+
+    def make(label):
+        metadata = MetadataCache(providers.active_provider().screen_funds, path=str(tmp_path / f"{label}_metadata.json")).load()
+        return HistoryStore(str(tmp_path / label)), metadata
+    return make, paths, tmp_path
+
+
+@pytest.fixture
+def unsharded(scratch):
+    make, paths, _ = scratch
+    store, metadata = make("single")
+    return data_fetcher.fetch_all_periods(PERIODS, store=store, rate=None, resume=False, metadata=metadata, views=VIEWS, **paths)
+
+
+def test_spooled_shards_match_the_unsharded_reports(scratch, unsharded):
+    # The coordinator works through the spool itself, so this runs in-process
+    make, paths, tmp_path = scratch
+    store, metadata = make("spool")
+    reports = screen_sharded(PERIODS, VIEWS, 3, store=store, metadata=metadata, rate=None, resume=False,
+                             provider=("synthetic", PROVIDER_ARGS), spool_dir=str(tmp_path / "spool"), **paths)
+    assert set(reports) == set(unsharded)
+    for key in unsharded:
+        assert reports[key] == unsharded[key], key
+    # Category sums are part of the reports; check they are not trivially empty
+    assert unsharded[("weekly", "ALL")].top_cat_in or unsharded[("weekly", "ALL")].top_cat_out
+    # Every shard's rows reached the coordinator's store
+    assert sorted(store.codes) == sorted(HistoryStore(str(tmp_path / "single")).load().codes)
+
+
+def test_pooled_shards_match_the_unsharded_reports(scratch, unsharded):
+    make, paths, _ = scratch
+    store, metadata = make("pool")
+    reports = screen_sharded(PERIODS, VIEWS, 2, store=store, metadata=metadata, rate=None, resume=False,
+                             provider=("synthetic", PROVIDER_ARGS), **paths)
+    assert reports == unsharded
+    assert not os.listdir(paths['checkpoint_dir'])
+
+
+def test_sharding_needs_the_history_store(scratch):
+    make, _, _ = scratch
+    _, metadata = make("none")
+    with pytest.raises(ValueError):
+        screen_sharded(PERIODS, VIEWS, 2, metadata=metadata)
@@ -0,0 +1,131 @@
+import numpy as np
+import pytest
+
+from data_fetcher import build_category_rotation, build_crowding_signals, build_divergent_signals, build_momentum_scores
+from flow_engine import FlowResults
+from signal_engine import compute_signals
+
+
+# The per-dict signal builders compute_signals replaced, kept verbatim as the reference
+
+def old_divergent_signals(results_filtered):
+    signals = []
+    for r in results_filtered:
+        flow_pct = float(r.get('flow_pct', 0))
+        return_pct = float(r.get('return_pct', 0))
+        inv_change = int(r.get('inv_change', 0))
+        inv_change_pct = float(r.get('inv_change_pct', 0))
+        candidates = []
+        if flow_pct < 0 and return_pct > 0:
+            candidates.append(("flow_down_return_up", "Çıkışa rağmen getiri güçlü", "Çıkış var ama performans pozitif", abs(flow_pct) * 1.4 + abs(return_pct) * 1.1))
+        if flow_pct > 0 and return_pct < 0:
+            candidates.append(("flow_up_return_down", "Girişe rağmen getiri zayıf", "Para girişi var ama performans negatif", abs(flow_pct) * 1.4 + abs(return_pct) * 1.1))
+        if flow_pct < 0 and inv_change > 0:
+            candidates.append(("flow_down_investor_up", "Çıkışa rağmen yatırımcı artıyor", "Para çıkıyor ama yatırımcı sayısı artıyor", abs(flow_pct) * 1.2 + abs(inv_change_pct)))
+        if flow_pct > 0 and inv_change < 0:
+            candidates.append(("flow_up_investor_down", "Girişe rağmen yatırımcı azalıyor", "Para giriyor ama yatırımcı sayısı düşüyor", abs(flow_pct) * 1.2 + abs(inv_change_pct)))
+        if not candidates:
+            continue
+        signal_key, signal_title, signal_summary, signal_score = max(candidates, key=lambda x: x[3])
+        signals.append({
+            'fund_code': r['fund_code'], 'name': r.get('name', ''), 'signal_key': signal_key,
+            'signal_title': signal_title, 'signal_summary': signal_summary, 'signal_score': float(signal_score),
+            'flow_pct': flow_pct, 'return_pct': return_pct, 'inv_change': inv_change, 'inv_change_pct': inv_change_pct,
+            'net_flow': float(r.get('net_flow', 0)), 'fund_size': float(r.get('fund_size', 0)), 'investors': int(r.get('investors', 0))
+        })
+    signals.sort(key=lambda x: x['signal_score'], reverse=True)
+    return signals[:5]
+
+
+def old_rank_map(results, key):
+    sorted_results = sorted(results, key=lambda x: x.get(key, 0))
+    total = max(len(sorted_results) - 1, 1)
+    return {item['fund_code']: (idx / total) * 100 for idx, item in enumerate(sorted_results)}
+
+
+def old_momentum_scores(results_filtered):
+    flow_ranks = old_rank_map(results_filtered, 'flow_pct')
+    ret_ranks = old_rank_map(results_filtered, 'return_pct')
+    inv_ranks = old_rank_map(results_filtered, 'inv_change_pct')
+    scores = []
+    for r in results_filtered:
+        code = r['fund_code']
+        score = flow_ranks.get(code, 0) * 0.45 + inv_ranks.get(code, 0) * 0.35 + ret_ranks.get(code, 0) * 0.20
+        scores.append({
+            'fund_code': code, 'name': r.get('name', ''), 'momentum_score': round(score, 2),
+            'flow_pct': float(r.get('flow_pct', 0)), 'return_pct': float(r.get('return_pct', 0)),
+            'inv_change_pct': float(r.get('inv_change_pct', 0)), 'inv_change': int(r.get('inv_change', 0))
+        })
+    scores.sort(key=lambda x: x['momentum_score'], reverse=True)
+    return scores[:5]
+
+
+def old_crowding_signals(results_filtered):
+    signals = []
+    for r in results_filtered:
+        flow_pct = float(r.get('flow_pct', 0))
+        inv_change_pct = float(r.get('inv_change_pct', 0))
+        if flow_pct <= 0 and inv_change_pct <= 0:
+            continue
+        crowd_gap = inv_change_pct - flow_pct
+        quiet_gap = flow_pct - inv_change_pct
+        if crowd_gap >= 1.0 and inv_change_pct > 0:
+            label, summary = "Kalabalıklaşma", "Yatırımcı artışı para girişinden hızlı"
+            signal_score = crowd_gap + max(inv_change_pct, 0) * 0.35
+        elif quiet_gap >= 1.0 and flow_pct > 0:
+            label, summary = "Sakin Birikim", "Para girişi yatırımcı artışından güçlü"
+            signal_score = quiet_gap + max(flow_pct, 0) * 0.35
+        else:
+            continue
+        signals.append({
+            'fund_code': r['fund_code'], 'name': r.get('name', ''), 'signal_title': label, 'signal_summary': summary,
+            'signal_score': round(signal_score, 2), 'flow_pct': flow_pct, 'return_pct': float(r.get('return_pct', 0)),
+            'inv_change_pct': inv_change_pct
+        })
+    signals.sort(key=lambda x: x['signal_score'], reverse=True)
+    return signals[:5]
+
+
+def old_category_rotation(cat_list):
+    rotations = []
+    for c in cat_list:
+        flow_pct = float(c.get('flow_pct', 0))
+        if abs(flow_pct) < 0.05:
+            continue
+        rotations.append({
+            'category': c.get('fund_code', ''),
+            'signal_title': "Rotasyon Güçleniyor" if flow_pct > 0 else "Rotasyon Zayıflıyor",
+            'signal_summary': "Kategoriye para girişi var" if flow_pct > 0 else "Kategoriden para çıkışı var",
+            'flow_pct': flow_pct, 'net_flow': float(c.get('net_flow', 0)), 'rotation_score': round(abs(flow_pct), 2)
+        })
+    rotations.sort(key=lambda x: x['rotation_score'], reverse=True)
+    return rotations[:5]
+
+
+def random_results(seed, n):
+    # Coarse values so ties are common and the tie order is exercised too
+    rng = np.random.default_rng(seed)
+    return FlowResults(
+        [f"F{i:03d}" for i in range(n)], [f"Fon {i}" for i in range(n)],
+        net_flow=rng.normal(0, 1e6, n).round(-4), fund_size=rng.uniform(1e6, 1e9, n).round(-4),
+        flow_pct=rng.normal(0, 2, n).round(1), return_pct=rng.normal(0, 2, n).round(1),
+        investors=rng.integers(500, 5000, n), inv_change=rng.integers(-50, 50, n),
+        inv_change_pct=rng.normal(0, 2, n).round(1),
+    )
+
+
+@pytest.mark.parametrize("seed, n", [(0, 1), (1, 7), (2, 200), (3, 2000)])
+def test_signals_match_the_per_dict_builders(seed, n):
+    results = random_results(seed, n)
+    records = results.records()
+    signals = compute_signals(results)
+    assert build_divergent_signals(results, signals) == old_divergent_signals(records)
+    assert build_momentum_scores(results, signals) == old_momentum_scores(records)
+    assert build_crowding_signals(results, signals) == old_crowding_signals(records)
+
+
+def test_category_rotation_matches_the_per_dict_builder():
+    rng = np.random.default_rng(4)
+    cats = [{'fund_code': f"Kategori {i}", 'flow_pct': float(v), 'net_flow': float(v) * 1e6}
+            for i, v in enumerate(rng.normal(0, 0.5, 30).round(2))]
+    assert build_category_rotation(cats) == old_category_rotation(cats)
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import fetch_pipeline
+from data_fetcher import bulk_current, fetch_histories
+from history_store import HistoryStore
+from tefas_bulk import BulkHistoryClient, ReplayServer, bulk_refresh, bulk_windows, record_synthetic
+
+
+@pytest.fixture
+def replay(tmp_path):
+    # Recorded day files of a small synthetic universe, served by the local replay server
+    end = pd.Timestamp(datetime.now().date())
+    provider = record_synthetic(str(tmp_path / "recorded"), 4, end - timedelta(days=40), end)
+    server = ReplayServer(str(tmp_path / "recorded")).serve_in_background()
+    yield provider, server, end
+    server.shutdown()
+
+
+def test_bulk_refresh_leaves_lagging_funds_to_per_fund_fetches(tmp_path, replay):
+    provider, server, end = replay
+    store = HistoryStore(str(tmp_path / "history"))
+    # S0000 stopped 15 days ago, the others 2 days ago
+    for code in provider.codes:
+        lag = 15 if code == "S0000" else 2
+        store.stage(code, provider.history_frame(code, start=end - timedelta(days=40), end=end - timedelta(days=lag)))
+    store.flush()
+    lagging_last = store.last_date("S0000")
+
+    client = BulkHistoryClient(server.url)
+    assert bulk_refresh(store, client, end=end) == len(provider.codes)
+    client.close()
+
+    expected = provider.history_frame("S0001", start=end - timedelta(days=40), end=end)
+    assert store.frame("S0001").index.equals(expected.index)
+    assert all(bulk_current(store, code) for code in provider.codes[1:])
+    # The window started at the others' last date: S0000 has a gap before it and must be fetched per fund
+    assert not bulk_current(store, "S0000")
+    gap = provider.history_frame("S0000", start=lagging_last + timedelta(days=1), end=end)
+    assert not gap.index.isin(store.frame("S0000").index).all()
+
+
+def test_bulk_refresh_marks_nothing_when_a_window_fails(tmp_path, replay, monkeypatch):
+    provider, server, end = replay
+    monkeypatch.setattr(fetch_pipeline, "backoff_delay", lambda attempt: 0.0)
+    store = HistoryStore(str(tmp_path / "history"))
+    for code in provider.codes:
+        store.stage(code, provider.history_frame(code, start=end - timedelta(days=20), end=end - timedelta(days=2)))
+    store.flush()
+    # Nothing listens on the discard port: every window fails
+    client = BulkHistoryClient("http://127.0.0.1:9/api/DB/BindHistoryInfo")
+    assert bulk_refresh(store, client, end=end) == 0
+    client.close()
+    assert not any(bulk_current(store, code) for code in provider.codes)
+
+
+def test_fetch_histories_serves_bulk_covered_funds_without_metadata_or_since(tmp_path, replay):
+    provider, server, end = replay
+    store = HistoryStore(str(tmp_path / "history"))
+    for code in provider.codes:
+        store.stage(code, provider.history_frame(code, start=end - timedelta(days=40), end=end - timedelta(days=2)))
+    store.flush()
+    client = BulkHistoryClient(server.url)
+    bulk_refresh(store, client, end=end)
+    client.close()
+
+    # Only a store: no upstream call is needed, so no provider is set either
+    names, histories, stale, missing = fetch_histories(provider.codes, store)
+    assert list(histories) == provider.codes
+    assert names == {code: '' for code in provider.codes}
+    assert histories["S0001"].index[-1] == store.last_date("S0001")
+    assert not stale and not missing
+
+
+def test_bulk_windows_skip_weekends():
+    windows = bulk_windows("2026-10-10", "2026-10-18", days=2)
+    # Sat-Sun windows are dropped
+    assert (datetime(2026, 10, 10).date(), datetime(2026, 10, 11).date()) not in windows
+    assert windows[0][0] == datetime(2026, 10, 12).date()
+    assert windows[-1][1] <= datetime(2026, 10, 18).date()
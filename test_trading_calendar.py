@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_fetcher import PERIODS
+from trading_calendar import anchor_columns, tefas_calendar
+
+
+def test_calendar_closes_weekends_and_holidays():
+    days = set(tefas_calendar().days.astype(str))
+    assert "2026-10-29" not in days          # Cumhuriyet Bayramı
+    assert "2026-10-31" not in days          # Saturday
+    assert not {"2026-05-27", "2026-05-28", "2026-05-29"} & days  # Kurban Bayramı
+    assert "2026-05-26" in days              # arefe: half day, still priced
+    assert "2016-07-15" in days and "2017-07-15" not in days
+
+
+def naive_anchor(dates, i, period_type, trading_days):
+    # The per-date rule: last trading day on or before the period's target date (daily: the trading day
+    # before), then the last of `dates` on or before that day
+    latest = pd.Timestamp(dates[i])
+    if period_type == "daily":
+        earlier = trading_days[trading_days < dates[i]]
+        anchor = earlier[-1] if len(earlier) else None
+    else:
+        target = {
+            "weekly": latest - pd.Timedelta(days=7),
+            "monthly": latest.replace(day=1) - pd.Timedelta(days=1),
+            "quarterly": latest.replace(month=latest.month - (latest.month - 1) % 3, day=1) - pd.Timedelta(days=1),
+            "ytd": latest.replace(month=1, day=1) - pd.Timedelta(days=1),
+            "1y": latest - pd.DateOffset(years=1),
+            "3y": latest - pd.DateOffset(years=3),
+        }[period_type]
+        earlier = trading_days[trading_days <= np.datetime64(target.date())]
+        anchor = earlier[-1] if len(earlier) else None
+    if anchor is None:
+        return -1
+    return int(np.searchsorted(dates, anchor, side="right")) - 1
+
+
+@pytest.mark.parametrize("period_type", PERIODS)
+def test_anchor_columns_match_the_per_date_rule(period_type):
+    # A fund's publication dates: most trading days, some skipped
+    rng = np.random.default_rng(3)
+    trading_days = tefas_calendar().days
+    span = trading_days[(trading_days >= np.datetime64("2022-06-01")) & (trading_days <= np.datetime64("2026-10-16"))]
+    dates = span[rng.random(len(span)) > 0.2]
+    cols = anchor_columns(dates, period_type)
+    for i in rng.choice(len(dates), 150, replace=False):
+        assert cols[i] == naive_anchor(dates, i, period_type, trading_days), str(dates[i])
+
+
+def test_a_row_on_a_closed_day_gets_its_own_column():
+    dates = np.array(["2026-10-27", "2026-10-28", "2026-10-29", "2026-10-30"], dtype="datetime64[D]")
+    # 29 October is a holiday but the fund published; the next day's daily anchor is that row
+    assert anchor_columns(dates, "daily").tolist() == [-1, 0, 1, 2]
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+# Fixed-date public holidays (MM-DD) on which TEFAS publishes no prices; 15 July since 2017
+FIXED_HOLIDAYS = ("01-01", "04-23", "05-01", "05-19", "07-15", "08-30", "10-29")
+
+# First day of the religious holidays (Diyanet calendar). The eves (arefe) are half days and
+# still have prices, so only the holiday days themselves are closed.
+RAMAZAN_BAYRAMI = ("2015-07-17", "2016-07-05", "2017-06-25", "2018-06-15", "2019-06-04", "2020-05-24",
+                   "2021-05-13", "2022-05-02", "2023-04-21", "2024-04-10", "2025-03-30", "2026-03-20",
+                   "2027-03-09", "2028-02-26", "2029-02-14", "2030-02-04")
+KURBAN_BAYRAMI = ("2015-09-24", "2016-09-12", "2017-09-01", "2018-08-21", "2019-08-11", "2020-07-31",
+                  "2021-07-20", "2022-07-09", "2023-06-28", "2024-06-16", "2025-06-06", "2026-05-27",
+                  "2027-05-16", "2028-05-05", "2029-04-24", "2030-04-13")
+RAMAZAN_DAYS = 3
+KURBAN_DAYS = 4
+
+# Years the holiday tables cover; the precomputed calendar spans exactly these
+CALENDAR_YEARS = (2015, 2030)
+
+
+def turkish_holidays(first_year=CALENDAR_YEARS[0], last_year=CALENDAR_YEARS[1]):
+    days = [np.datetime64(f"{year}-{md}") for year in range(first_year, last_year + 1)
+            for md in FIXED_HOLIDAYS if not (md == "07-15" and year < 2017)]
+    for starts, length in ((RAMAZAN_BAYRAMI, RAMAZAN_DAYS), (KURBAN_BAYRAMI, KURBAN_DAYS)):
+        for start in starts:
+            if first_year <= int(start[:4]) <= last_year:
+                days.extend(np.datetime64(start) + np.arange(length))
+    return np.unique(np.array(days, dtype="datetime64[D]"))
+
+
+def period_target(latest_date, period_type):
+    # Reference date of a preset period for each latest date (None = previous trading day, i.e. daily).
+    # Same rules as get_prev_row.
+    if period_type == "weekly":
+        return latest_date - np.timedelta64(7, "D")
+    if period_type == "monthly":
+        return latest_date.astype("datetime64[M]").astype("datetime64[D]") - np.timedelta64(1, "D")
+    if period_type == "quarterly":
+        months = latest_date.astype("datetime64[M]").astype(np.int64)
+        quarter_start = (months - months % 3).astype("datetime64[M]")
+        return quarter_start.astype("datetime64[D]") - np.timedelta64(1, "D")
+    if period_type == "ytd":
+        return latest_date.astype("datetime64[Y]").astype("datetime64[D]") - np.timedelta64(1, "D")
+    if period_type in ("1y", "3y"):
+        years = int(period_type[0])
+        return (pd.DatetimeIndex(latest_date) - pd.DateOffset(years=years)).values.astype("datetime64[D]")
+    return None
+
+
+class TradingCalendar:
+    """TEFAS trading days (weekdays without Turkish public holidays) as an integer index.
+
+    Period anchors are tables over that index: anchors(period)[t] is the trading day the period
+    reaching back from day t starts at, so every fund that has published day t shares it and
+    resolving a fund's anchor is one array lookup.
+    """
+
+    def __init__(self, days):
+        self.days = np.asarray(days, dtype="datetime64[D]")
+        self._anchors = {}
+
+    def __len__(self):
+        return len(self.days)
+
+    @classmethod
+    def span(cls, start, end, holidays=None):
+        holidays = turkish_holidays(pd.Timestamp(start).year, pd.Timestamp(end).year) if holidays is None else holidays
+        days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + np.timedelta64(1, "D"))
+        return cls(days[np.is_busday(days, holidays=holidays)])
+
+    @classmethod
+    def covering(cls, dates):
+        # The precomputed calendar when it covers `dates`. A date outside it (e.g. a row published on a
+        # day the holiday table closes) is added rather than folded into the day before.
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        calendar = tefas_calendar()
+        if not len(dates):
+            return calendar
+        pos = np.minimum(np.searchsorted(calendar.days, dates), len(calendar.days) - 1)
+        extra = dates[calendar.days[pos] != dates]
+        if not len(extra):
+            return calendar
+        # Anchors before the first date resolve to "none" either way, so the extension only spans `dates`.
+        # The last one is kept: the same panel usually asks for several periods in a row.
+        global _extended
+        key = (dates[0], dates[-1], extra.tobytes())
+        cached = _extended
+        if cached is None or cached[0] != key:
+            cached = _extended = (key, cls(np.union1d(cls.span(dates[0], dates[-1]).days, extra)))
+        return cached[1]
+
+    def index(self, dates):
+        # Trading-day index of each date: the last trading day on or before it (-1 before the calendar)
+        return np.searchsorted(self.days, np.asarray(dates, dtype="datetime64[D]"), side="right") - 1
+
+    def anchors(self, period_type):
+        # Built once per period for the whole calendar
+        if period_type not in self._anchors:
+            target = period_target(self.days, period_type)
+            self._anchors[period_type] = np.arange(len(self.days)) - 1 if target is None else self.index(target)
+        return self._anchors[period_type]
+
+
+_calendar = None
+_extended = None
+
+
+def tefas_calendar():
+    # Every trading day of the years the holiday tables cover
+    global _calendar
+    if _calendar is None:
+        first, last = CALENDAR_YEARS
+        _calendar = TradingCalendar.span(f"{first}-01-01", f"{last}-12-31")
+    return _calendar
+
+
+def anchor_columns(dates, period_type):
+    # For each of the sorted, unique `dates` (e.g. panel columns): the position of the last date on or
+    # before its period's anchor trading day, -1 if there is none
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    if not len(dates):
+        return np.empty(0, dtype=int)
+    calendar = TradingCalendar.covering(dates)
+    ref = calendar.anchors(period_type)[calendar.index(dates)]
+    cols = np.searchsorted(dates, calendar.days[np.maximum(ref, 0)], side="right") - 1
+    return np.where(ref >= 0, cols, -1)